@@ -1,332 +1,358 @@
-from fastapi import UploadFile, File, Depends, HTTPException, Form
+from fastapi import UploadFile, File, Depends, HTTPException, Form, Request
 from typing import List, Optional
 import pandas as pd
-from auth import get_current_active_user
-from services.sales_cleaner import process_sales_clean
-from services.utils import leer_archivo_base
-from services.analysis_cleaner import TAMAL_MAPPING, get_product_category
+from auth import get_current_active_user, users_db
+from services.heatmap_service import compute_demand_heatmap
+from services.ticket_service import compute_ticket_analytics
+from services.comparison_service import compute_period_metrics
+from services.sales_loader import cargar_ventas_limpias, enriquecer_ventas
+from services.result_cache import fingerprint
+from services.pinned_store import cargar_ventas_fijadas, cargar_rollup, hash_archivo
+from services.json_response import (
+    tabla_json, LAYOUTS, LAYOUT_RECORDS, crear_etag, etag_coincide, no_modificado, json_negociado
+)
+import os
+
+# Defaults of the analysis form, used for the precomputed pinned rollup
+PARAMETROS_DEFAULT = {
+    "start_date": None,
+    "end_date": None,
+    "sucursales": None,
+    "view_mode": "daily",
+    "product_filter": None,
+    "category_filter": None,
+    "heatmap_slot": 60,
+    "heatmap_by_product": False,
+    "compare_to": "previous"
+}
+
+def clave_analisis_fijado(content_hash: str, **params):
+    return fingerprint("analysis", content_hash, *[params.get(k, v) for k, v in PARAMETROS_DEFAULT.items()])
+
+def precalculo_analisis_fijado(df: pd.DataFrame, content_hash: str):
+    """
+    Rollup por defecto del analisis para el archivo fijado (tarea de fondo).
+    """
+    return clave_analisis_fijado(content_hash), compute_analysis(df.copy(), **PARAMETROS_DEFAULT)
 
 # --- DATA ANALYSIS ENDPOINT ---
 async def data_analysis_endpoint(
-    files: List[UploadFile] = File(...),
+    request: Request,
+    files: Optional[List[UploadFile]] = File(None),
+    use_pinned_file: bool = Form(False), # Analyze the pinned file instead of uploads
     start_date: Optional[str] = Form(None),
     end_date: Optional[str] = Form(None),
     sucursales: Optional[str] = Form(None), # Comma separated list
     view_mode: str = Form("daily"), # daily, weekly, monthly
     product_filter: Optional[str] = Form(None), # Comma separated list of normalized names
     category_filter: Optional[str] = Form(None), # Comma separated list of categories
+    heatmap_slot: int = Form(60), # Minutes per heatmap slot: 15, 30 or 60
+    heatmap_by_product: bool = Form(False), # Split heatmap per Producto_Normalizado
+    compare_to: str = Form("previous"), # previous (same length, right before) or year (same dates last year)
+    layout: str = Form(LAYOUT_RECORDS), # records or columnar ({columns, data: {col: [...]}}) tables
     current_user = Depends(get_current_active_user)
 ):
     try:
-        clean_dfs = []
-        raw_files_content = []
+        params = {
+            "start_date": start_date,
+            "end_date": end_date,
+            "sucursales": sucursales,
+            "view_mode": view_mode,
+            "product_filter": product_filter,
+            "category_filter": category_filter,
+            "heatmap_slot": heatmap_slot,
+            "heatmap_by_product": heatmap_by_product,
+            "compare_to": compare_to
+        }
+        if layout not in LAYOUTS:
+            raise HTTPException(status_code=400, detail=f"layout must be one of {', '.join(LAYOUTS)}")
 
-        # 1. Separate Clean vs Raw Files
-        for f in files:
-            content = await f.read()
-            filename = f.filename
-            
-            # Try to read as DF
-            try:
-                base = leer_archivo_base(content, filename)
-            except Exception as e:
-                print(f"Error reading file {filename}: {e}")
-                base = None
-            
-            df_check = None
-            
-            if isinstance(base, pd.ExcelFile):
-                try:
-                    df_check = pd.read_excel(base, sheet_name=0)
-                except:
-                    pass
-            elif isinstance(base, pd.DataFrame):
-                df_check = base
-            
-            is_clean = False
-            if df_check is not None and not df_check.empty:
-                # Check for "Cleaned" signature columns
-                # 'Sucursal', 'Fecha', 'Total_Venta', 'Producto_Final'
-                # Note: We relax the check to allow minor variations or BOM issues
-                
-                # Normalize columns to check (upper case and stripped of non-alphanumeric if needed)
-                # Helper to normalize
-                def normalize_col(c):
-                    return str(c).upper().strip().replace(' ', '_').replace('.', '')
-                
-                cols = {normalize_col(c) for c in df_check.columns}
-                
-                # We look for key ingredients
-                has_sucursal = any('SUCURSAL' in c for c in cols)
-                has_fecha = any('FECHA' in c for c in cols)
-                has_total = any('TOTAL_VENTA' in c or 'TOTALVENTA' in c for c in cols)
-                has_prod = any('PRODUCTO_FINAL' in c or 'PRODUCTOFINAL' in c for c in cols)
-                
-                if has_sucursal and has_fecha and has_total and has_prod:
-                    is_clean = True
-                    # Normalize column names in DF to ensure consistency
-                    # Map found cols to standard names
-                    new_cols = {}
-                    for c in df_check.columns:
-                        norm = normalize_col(c)
-                        if 'SUCURSAL' in norm: new_cols[c] = 'Sucursal'
-                        elif 'FECHA' in norm: new_cols[c] = 'Fecha'
-                        elif 'TOTAL_VENTA' in norm or 'TOTALVENTA' in norm: new_cols[c] = 'Total_Venta'
-                        elif 'PRODUCTO_FINAL' in norm or 'PRODUCTOFINAL' in norm: new_cols[c] = 'Producto_Final'
-                        elif 'CANTIDAD' in norm: new_cols[c] = 'Cantidad'
-                        elif 'PAQUETE_ORIGEN' in norm or 'PAQUETEORIGEN' in norm: new_cols[c] = 'Paquete_Origen'
-                        else: new_cols[c] = str(c).strip()
-                    
-                    df_check.rename(columns=new_cols, inplace=True)
-                    clean_dfs.append(df_check)
-            
-            if not is_clean:
-                # If it's a CSV that was read as DF but not "Clean", we need to pass bytes to raw processor
-                # But raw processor expects bytes.
-                # If leer_archivo_base returned a DF for CSV, it means it parsed it.
-                # But process_sales_clean expects (filename, bytes).
-                # So we just pass original content.
-                raw_files_content.append((filename, content))
+        # 0. Pinned file: precomputed rollup, else the pre-cleaned Parquet, else the raw file
+        if use_pinned_file:
+            pinned_info = users_db.get(current_user.username, {}).get("pinned_file_info")
+            if not pinned_info or not os.path.exists(pinned_info["path"]):
+                raise HTTPException(status_code=400, detail="No pinned file found. Please upload a file or pin one in Analysis.")
 
-        # 2. Process Raw Files if any
-        if raw_files_content:
-            try:
-                df_processed = await process_sales_clean(raw_files_content)
-                if not df_processed.empty:
-                    clean_dfs.append(df_processed)
-            except Exception as e:
-                print(f"Error processing raw files: {e}")
-                # Don't fail immediately, check if we have other data
-                pass
+            content_hash = pinned_info.get("content_hash") or hash_archivo(pinned_info["path"])
+            etag = crear_etag(clave_analisis_fijado(content_hash, **params), layout)
+            if etag_coincide(request, etag):
+                return no_modificado(etag)
 
-        # 3. Combine All Data
-        if not clean_dfs:
-            raise HTTPException(status_code=400, detail="No valid data found in files. Please ensure you are uploading valid Wansoft Sales Reports (Excel or CSV).")
-            
-        df = pd.concat(clean_dfs, ignore_index=True)
-        
-        # Ensure Types
-        df['Total_Venta'] = pd.to_numeric(df['Total_Venta'], errors='coerce').fillna(0)
-        df['Cantidad'] = pd.to_numeric(df['Cantidad'], errors='coerce').fillna(0)
-        
-        # 4. APPLY NORMALIZATION (MAPPING) & CATEGORIZATION
-        # We apply the mapping to group similar products
-        # If product not in mapping, we keep original name or mark as 'Otros'
-        def get_normalized_info(prod_name):
-            if prod_name in TAMAL_MAPPING:
-                guiso, tipo, factor = TAMAL_MAPPING[prod_name]
-                return f"{guiso} ({tipo})", factor
-            return prod_name, 1
+            # Rollups are stored in the default records layout
+            rollup = None
+            if layout == LAYOUT_RECORDS:
+                rollup = cargar_rollup(pinned_info["path"], clave_analisis_fijado(content_hash, **params))
+            if rollup is not None:
+                return json_negociado(rollup, request, etag=etag)
 
-        # Apply mapping to get Normalized Name AND Factor
-        # This fixes the calculation issue where "Tamales Puerco 12pz" was counted as 1 unit instead of 12
-        df[['Producto_Normalizado', 'Factor']] = df['Producto_Final'].apply(
-            lambda x: pd.Series(get_normalized_info(x))
-        )
-        
-        # Calculate Real Units (Unidades Reales)
-        df['Unidades_Reales'] = df['Cantidad'] * df['Factor']
-        
-        df['Categoria'] = df['Producto_Final'].apply(get_product_category)
+            df = cargar_ventas_fijadas(pinned_info)
+            if df is None:
+                with open(pinned_info["path"], "rb") as f:
+                    df = await cargar_ventas_limpias([(pinned_info["filename"], f.read())])
+            if df.empty:
+                raise HTTPException(status_code=400, detail="No valid data found in pinned file.")
+            return json_negociado(compute_analysis(df, layout=layout, **params), request, etag=etag)
 
-        # Determine if sold in package
-        # Logic: If Paquete_Origen is not NaN/None and not "N/A" -> Inside Package
-        # Note: Check data first. Usually "N/A" or null means individual.
-        def is_package(val):
-            if pd.isna(val): return False
-            s = str(val).upper().strip()
-            return s not in ['NAN', 'NONE', 'N/A', '', 'NAT']
-            
-        df['En_Paquete'] = df['Paquete_Origen'].apply(is_package)
+        if not files:
+            raise HTTPException(status_code=400, detail="No files provided.")
+
+        # Clean files (any format) and raw Wansoft reports, same loader as the other endpoints
+        files_content = [(f.filename, await f.read()) for f in files]
+        df = await cargar_ventas_limpias(files_content)
+        if df.empty:
+            raise HTTPException(status_code=400, detail="No valid data found in files. Please ensure you are uploading valid Wansoft Sales Reports (Excel or CSV).")
         
-        # 5. Filter by Date
-        if start_date and end_date:
-            df['Fecha'] = pd.to_datetime(df['Fecha'], errors='coerce')
-            mask = (df['Fecha'] >= start_date) & (df['Fecha'] <= end_date)
-            df = df.loc[mask]
+        return json_negociado(compute_analysis(df, layout=layout, **params), request)
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Server Error: {str(e)}")
 
-        # Calculate available sucursales BEFORE filtering by sucursal
-        available_sucursales = sorted(df['Sucursal'].astype(str).unique().tolist())
+def compute_analysis(
+    df: pd.DataFrame,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    sucursales: Optional[str] = None,
+    view_mode: str = "daily",
+    product_filter: Optional[str] = None,
+    category_filter: Optional[str] = None,
+    heatmap_slot: int = 60,
+    heatmap_by_product: bool = False,
+    compare_to: str = "previous",
+    layout: str = LAYOUT_RECORDS
+):
+    """
+    Todas las agregaciones de /tools/data-analysis sobre un DataFrame de ventas limpias.
+    Filters use the same comma separated strings as the endpoint form fields.
+    layout='columnar' returns the tables as {columns, data: {col: [...]}} (see json_response).
+    """
+    # Ensure Types + 4. APPLY NORMALIZATION (MAPPING) & CATEGORIZATION
+    # Normalized Name and Factor ("Tamales Puerco 12pz" counts as 12 units), Unidades_Reales, Categoria
+    df = enriquecer_ventas(df)
 
-        # 5.1 Filter by Category (Global)
-        if category_filter:
-            cat_list = [c.strip() for c in category_filter.split(',')]
-            # Special case: If user wants to filter by "Paquete" category, they might expect to see the wrapper
-            # But if they filter by "Tamal", they expect to see tamales.
-            # This is straightforward row filtering.
-            if "TODAS" not in cat_list and "Todas" not in cat_list:
-                df = df[df['Categoria'].isin(cat_list)]
-            
-        # 6. Filter by Sucursal
-        if sucursales:
-            sucursal_list = [s.strip().upper() for s in sucursales.split(',')]
-            if "TODAS" not in sucursal_list:
-                df = df[df['Sucursal'].isin(sucursal_list)]
-        
-        # 7. Grouping Logic (Time)
-        df['Fecha'] = pd.to_datetime(df['Fecha'])
+    # Determine if sold in package
+    # Logic: If Paquete_Origen is not NaN/None and not "N/A" -> Inside Package
+    # Note: Check data first. Usually "N/A" or null means individual.
+    def is_package(val):
+        if pd.isna(val): return False
+        s = str(val).upper().strip()
+        return s not in ['NAN', 'NONE', 'N/A', '', 'NAT']
         
-        # Calculate Number of Active Days (Days with sales in the filtered data)
-        # This is used for Daily Average calculation
-        active_days = df['Fecha'].nunique()
-        if active_days == 0: active_days = 1
+    df['En_Paquete'] = df['Paquete_Origen'].apply(is_package)
+    
+    # Keep full history (category/sucursal filtered only) for period comparison
+    df_historial = df
 
-        if view_mode == 'weekly':
-            df['Periodo'] = df['Fecha'].dt.to_period('W').apply(lambda r: r.start_time.strftime('%Y-%m-%d'))
-        elif view_mode == 'monthly':
-            df['Periodo'] = df['Fecha'].dt.to_period('M').apply(lambda r: r.strftime('%Y-%m'))
-        else: # daily
-            df['Periodo'] = df['Fecha'].dt.strftime('%Y-%m-%d')
-            
-        # --- AGGREGATIONS ---
+    # 5. Filter by Date
+    if start_date and end_date:
+        df['Fecha'] = pd.to_datetime(df['Fecha'], errors='coerce')
+        mask = (df['Fecha'] >= start_date) & (df['Fecha'] <= end_date)
+        df = df.loc[mask]
 
-        # A. Total Sales Over Time
-        sales_over_time = df.groupby('Periodo')['Total_Venta'].sum().reset_index().to_dict(orient='records')
-        
-        # B. Product Mix (Top products) - USING NORMALIZED NAME AND EXCLUDING PACKAGES
-        # We only want to see 'Real Products' (Tamales, Drinks) here, not the wrapper 'Media Docena'
-        # Categories: 'Tamal', 'Bebida', 'Otro', 'Paquete'
-        # We exclude 'Paquete' category for this specific chart
-        # We use 'Unidades_Reales' instead of 'Cantidad' to account for 12pz packs
-        df_mix = df[df['Categoria'] != 'Paquete']
-        product_mix = df_mix.groupby('Producto_Normalizado')['Unidades_Reales'].sum().reset_index()
-        product_mix = product_mix.sort_values('Unidades_Reales', ascending=False).head(15).to_dict(orient='records')
-        
-        # C. Sucursal Performance
-        sucursal_perf = df.groupby('Sucursal')['Total_Venta'].sum().reset_index().to_dict(orient='records')
-        
-        # D. Detailed Product Table (Excluding Packages)
-        # Filter out 'Paquete' category for this main table
-        df_products_only = df[df['Categoria'] != 'Paquete'].copy()
-        
-        # We need to calculate:
-        # - Unidades Totales (Sum of Unidades_Reales)
-        # - Venta Normal (Sum of Unidades_Reales where En_Paquete is False)
-        # - Promocion (Sum of Unidades_Reales where En_Paquete is True)
-        # - Promedio Diario (Unidades Totales / Active Days)
-        
-        # Create helper columns for pivot
-        df_products_only['Venta_Normal'] = df_products_only.apply(lambda x: x['Unidades_Reales'] if not x['En_Paquete'] else 0, axis=1)
-        df_products_only['Venta_Promo'] = df_products_only.apply(lambda x: x['Unidades_Reales'] if x['En_Paquete'] else 0, axis=1)
-        
-        detailed_stats = df_products_only.groupby(['Producto_Normalizado', 'Categoria']).agg({
-            'Unidades_Reales': 'sum',
-            'Venta_Normal': 'sum',
-            'Venta_Promo': 'sum'
-        }).reset_index()
-        
-        detailed_stats.rename(columns={'Unidades_Reales': 'Unidades_Totales'}, inplace=True)
-        
-        # Calculate Daily Average (Factor de Venta)
-        detailed_stats['Promedio_Diario'] = (detailed_stats['Unidades_Totales'] / active_days).round(2)
-        
-        # --- CUSTOM SORTING LOGIC ---
-        priority_order = [
-            # Tradicionales
-            "Puerco (Tradicional)", "Pollo (Tradicional)", "Frijol (Tradicional)", "Queso (Tradicional)", "Dulce (Tradicional)",
-            # Hoja de Plátano
-            "Pollo (Hoja de Platano)", "Puerco (Hoja de Platano)",
-            # Borrachos
-            "Pollo Salsa Verde (Borracho)", "Puerco (Borracho)", "Queso (Borracho)", "Pollo Mole (Borracho)",
-            # Bebidas, Extras y Paquetes
-            "1 tamal borracho + 1 refresco",
-            "1 tamal hp  + refresco",
-            "5 tamales tradicionales + 1 refresco",
-            "Cafe vaso",
-            "Café vaso",
-            "Ciel 1 lto.",
-            "Ciel 600 ml",
-            "Ciento",
-            "Docena Mixta",
-            "EMPANADA CAJETA Y NUEZ",
-            "EMPANADA PIÑA",
-            "Fuze Tea",
-            "Media Docena",
-            "Medio Ciento",
-            "PAN DULCE",
-            "Promo 3 Docenas",
-            "Refresco Lata (355ml)",
-            "Refresco Pet (600ml)",
-            "Refresco Vidrio (355ml)",
-            "Vallefrut",
-            "Vaso de salsa 1/2 litro"
-        ]
-        
-        # Helper to get sort index
-        # We need to handle items not in the list (put them at the end or sort by volume)
-        def get_sort_index(prod_name):
-            if prod_name in priority_order:
-                return priority_order.index(prod_name)
-            if prod_name == "Tamal Elote":
-                return 9999
-            return 1000 # Others
-            
-        detailed_stats['sort_key'] = detailed_stats['Producto_Normalizado'].apply(get_sort_index)
-        
-        # Sort by Key (ASC) then by Unidades_Totales (DESC) for items not in list
-        detailed_stats = detailed_stats.sort_values(['sort_key', 'Unidades_Totales'], ascending=[True, False])
-        detailed_stats = detailed_stats.drop(columns=['sort_key'])
-        
-        product_table = detailed_stats.to_dict(orient='records')
-        
-        # D2. Package Breakdown Table
-        # We want to see what is inside the packages
-        # Filter for rows that ARE inside a package (En_Paquete == True) AND represent content (Categoria != Paquete)
-        df_package_content = df[(df['En_Paquete'] == True) & (df['Categoria'] != 'Paquete')].copy()
-        
-        # Group by Package Name (Paquete_Origen) and Product
-        package_stats = df_package_content.groupby(['Paquete_Origen', 'Producto_Normalizado']).agg({
-            'Unidades_Reales': 'sum'
-        }).reset_index()
-        
-        package_stats = package_stats.sort_values(['Paquete_Origen', 'Unidades_Reales'], ascending=[True, False])
-        package_breakdown = package_stats.to_dict(orient='records')
+    # Calculate available sucursales BEFORE filtering by sucursal
+    available_sucursales = sorted(df['Sucursal'].astype(str).unique().tolist())
+
+    # 5.1 Filter by Category (Global)
+    if category_filter:
+        cat_list = [c.strip() for c in category_filter.split(',')]
+        # Special case: If user wants to filter by "Paquete" category, they might expect to see the wrapper
+        # But if they filter by "Tamal", they expect to see tamales.
+        # This is straightforward row filtering.
+        if "TODAS" not in cat_list and "Todas" not in cat_list:
+            df = df[df['Categoria'].isin(cat_list)]
+            df_historial = df_historial[df_historial['Categoria'].isin(cat_list)]
         
-        # E. Specific Product Trend (if filter provided)
-        product_trend = []
-        if product_filter:
-            # Filter by Normalized Name
-            # product_filter is comma separated
-            prod_list = [p.strip() for p in product_filter.split(',')]
-            df_prod = df[df['Producto_Normalizado'].isin(prod_list)]
-            # Use Unidades_Reales for trend too
-            product_trend = df_prod.groupby('Periodo')['Unidades_Reales'].sum().reset_index().to_dict(orient='records')
-            # Rename for frontend compatibility (frontend expects 'Cantidad')
-            for pt in product_trend:
-                pt['Cantidad'] = pt['Unidades_Reales']
+    # 6. Filter by Sucursal
+    if sucursales:
+        sucursal_list = [s.strip().upper() for s in sucursales.split(',')]
+        if "TODAS" not in sucursal_list:
+            df = df[df['Sucursal'].isin(sucursal_list)]
+            df_historial = df_historial[df_historial['Sucursal'].isin(sucursal_list)]
+    
+    # 7. Grouping Logic (Time)
+    df['Fecha'] = pd.to_datetime(df['Fecha'])
+    
+    # Calculate Number of Active Days (Days with sales in the filtered data)
+    # This is used for Daily Average calculation
+    active_days = df['Fecha'].nunique()
+    if active_days == 0: active_days = 1
 
-        # Get available sucursales and products for filters
-        # available_sucursales = sorted(df['Sucursal'].astype(str).unique().tolist())
+    if view_mode == 'weekly':
+        df['Periodo'] = (df['Fecha'].dt.normalize() - pd.to_timedelta(df['Fecha'].dt.dayofweek, unit='D')).dt.strftime('%Y-%m-%d') # Monday of the week
+    elif view_mode == 'monthly':
+        df['Periodo'] = df['Fecha'].dt.strftime('%Y-%m')
+    else: # daily
+        df['Periodo'] = df['Fecha'].dt.strftime('%Y-%m-%d')
         
-        # Available products grouped by category
-        # List of { name: "...", category: "..." }
-        unique_prods = df[['Producto_Normalizado', 'Categoria']].drop_duplicates()
-        available_products = unique_prods.sort_values('Producto_Normalizado').to_dict(orient='records')
+    # --- AGGREGATIONS ---
+
+    # A. Total Sales Over Time
+    sales_over_time = tabla_json(df.groupby('Periodo')['Total_Venta'].sum().reset_index(), layout)
+    
+    # B. Product Mix (Top products) - USING NORMALIZED NAME AND EXCLUDING PACKAGES
+    # We only want to see 'Real Products' (Tamales, Drinks) here, not the wrapper 'Media Docena'
+    # Categories: 'Tamal', 'Bebida', 'Otro', 'Paquete'
+    # We exclude 'Paquete' category for this specific chart
+    # We use 'Unidades_Reales' instead of 'Cantidad' to account for 12pz packs
+    df_mix = df[df['Categoria'] != 'Paquete']
+    product_mix = df_mix.groupby('Producto_Normalizado')['Unidades_Reales'].sum().reset_index()
+    product_mix = tabla_json(product_mix.sort_values('Unidades_Reales', ascending=False).head(15), layout)
+    
+    # C. Sucursal Performance
+    # Sucursal may be categorical (pinned Parquet / columnar uploads): only branches with sales
+    sucursal_perf = tabla_json(df.groupby('Sucursal', observed=True)['Total_Venta'].sum().reset_index(), layout)
+    
+    # D. Detailed Product Table (Excluding Packages)
+    # Filter out 'Paquete' category for this main table
+    df_products_only = df[df['Categoria'] != 'Paquete'].copy()
+    
+    # We need to calculate:
+    # - Unidades Totales (Sum of Unidades_Reales)
+    # - Venta Normal (Sum of Unidades_Reales where En_Paquete is False)
+    # - Promocion (Sum of Unidades_Reales where En_Paquete is True)
+    # - Promedio Diario (Unidades Totales / Active Days)
+    
+    # Create helper columns for pivot
+    df_products_only['Venta_Normal'] = df_products_only['Unidades_Reales'].where(~df_products_only['En_Paquete'], 0)
+    df_products_only['Venta_Promo'] = df_products_only['Unidades_Reales'].where(df_products_only['En_Paquete'], 0)
+    
+    detailed_stats = df_products_only.groupby(['Producto_Normalizado', 'Categoria']).agg({
+        'Unidades_Reales': 'sum',
+        'Venta_Normal': 'sum',
+        'Venta_Promo': 'sum'
+    }).reset_index()
+    
+    detailed_stats.rename(columns={'Unidades_Reales': 'Unidades_Totales'}, inplace=True)
+    
+    # Calculate Daily Average (Factor de Venta)
+    detailed_stats['Promedio_Diario'] = (detailed_stats['Unidades_Totales'] / active_days).round(2)
+    
+    # --- CUSTOM SORTING LOGIC ---
+    priority_order = [
+        # Tradicionales
+        "Puerco (Tradicional)", "Pollo (Tradicional)", "Frijol (Tradicional)", "Queso (Tradicional)", "Dulce (Tradicional)",
+        # Hoja de Plátano
+        "Pollo (Hoja de Platano)", "Puerco (Hoja de Platano)",
+        # Borrachos
+        "Pollo Salsa Verde (Borracho)", "Puerco (Borracho)", "Queso (Borracho)", "Pollo Mole (Borracho)",
+        # Bebidas, Extras y Paquetes
+        "1 tamal borracho + 1 refresco",
+        "1 tamal hp  + refresco",
+        "5 tamales tradicionales + 1 refresco",
+        "Cafe vaso",
+        "Café vaso",
+        "Ciel 1 lto.",
+        "Ciel 600 ml",
+        "Ciento",
+        "Docena Mixta",
+        "EMPANADA CAJETA Y NUEZ",
+        "EMPANADA PIÑA",
+        "Fuze Tea",
+        "Media Docena",
+        "Medio Ciento",
+        "PAN DULCE",
+        "Promo 3 Docenas",
+        "Refresco Lata (355ml)",
+        "Refresco Pet (600ml)",
+        "Refresco Vidrio (355ml)",
+        "Vallefrut",
+        "Vaso de salsa 1/2 litro"
+    ]
+    
+    # Helper to get sort index
+    # We need to handle items not in the list (put them at the end or sort by volume)
+    def get_sort_index(prod_name):
+        if prod_name in priority_order:
+            return priority_order.index(prod_name)
+        if prod_name == "Tamal Elote":
+            return 9999
+        return 1000 # Others
         
-        data_min_date = df['Fecha'].min().strftime('%Y-%m-%d') if not df.empty else None
-        data_max_date = df['Fecha'].max().strftime('%Y-%m-%d') if not df.empty else None
+    detailed_stats['sort_key'] = detailed_stats['Producto_Normalizado'].apply(get_sort_index)
+    
+    # Sort by Key (ASC) then by Unidades_Totales (DESC) for items not in list
+    detailed_stats = detailed_stats.sort_values(['sort_key', 'Unidades_Totales'], ascending=[True, False])
+    detailed_stats = detailed_stats.drop(columns=['sort_key'])
+    
+    product_table = tabla_json(detailed_stats, layout)
+    
+    # D2. Package Breakdown Table
+    # We want to see what is inside the packages
+    # Filter for rows that ARE inside a package (En_Paquete == True) AND represent content (Categoria != Paquete)
+    df_package_content = df[(df['En_Paquete'] == True) & (df['Categoria'] != 'Paquete')].copy()
+    
+    # Group by Package Name (Paquete_Origen) and Product
+    package_stats = df_package_content.groupby(['Paquete_Origen', 'Producto_Normalizado']).agg({
+        'Unidades_Reales': 'sum'
+    }).reset_index()
+    
+    package_stats = package_stats.sort_values(['Paquete_Origen', 'Unidades_Reales'], ascending=[True, False])
+    package_breakdown = tabla_json(package_stats, layout)
+    
+    # E. Specific Product Trend (if filter provided)
+    product_trend = []
+    if product_filter:
+        # Filter by Normalized Name
+        # product_filter is comma separated
+        prod_list = [p.strip() for p in product_filter.split(',')]
+        df_prod = df[df['Producto_Normalizado'].isin(prod_list)]
+        # Use Unidades_Reales for trend too
+        product_trend = df_prod.groupby('Periodo')['Unidades_Reales'].sum().reset_index()
+        # Rename for frontend compatibility (frontend expects 'Cantidad')
+        product_trend['Cantidad'] = product_trend['Unidades_Reales']
+        product_trend = tabla_json(product_trend, layout)
 
-        return {
-            "sales_over_time": sales_over_time,
-            "product_mix": product_mix,
-            "sucursal_performance": sucursal_perf,
-            "product_table": product_table, 
-            "package_breakdown": package_breakdown,
-            "product_trend": product_trend,
-            "available_sucursales": available_sucursales,
-            "available_products": available_products,
-            "data_range": {"min": data_min_date, "max": data_max_date},
-            "raw_data_summary": {
-                "total_sales": float(df['Total_Venta'].sum()),
-                "total_items": float(df['Unidades_Reales'].sum()), 
-                "transaction_count": int(len(df)),
-                "active_days": int(active_days)
-            }
-        }
+    # F. Demand Heatmap (Hour x Weekday x Sucursal)
+    # If a product filter is active, the per-product heatmap only covers those products
+    df_heatmap = df
+    if heatmap_by_product and product_filter:
+        df_heatmap = df[df['Producto_Normalizado'].isin([p.strip() for p in product_filter.split(',')])]
+    demand_heatmap = compute_demand_heatmap(df_heatmap, slot_minutes=heatmap_slot, by_product=heatmap_by_product)
 
-    except HTTPException as he:
-        raise he
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Server Error: {str(e)}")
+    # G. Ticket Analytics (MovimientoPDV)
+    ticket_analytics = compute_ticket_analytics(df)
+
+    # H. Period-over-period deltas and 7/28-day moving averages (packages excluded, like product_table)
+    period_comparison, rolling_averages = compute_period_metrics(
+        df_historial[df_historial['Categoria'] != 'Paquete'],
+        start_date=start_date if start_date and end_date else None,
+        end_date=end_date if start_date and end_date else None,
+        compare_to=compare_to,
+        layout=layout
+    )
+
+    # Get available sucursales and products for filters
+    # available_sucursales = sorted(df['Sucursal'].astype(str).unique().tolist())
+    
+    # Available products grouped by category
+    # List of { name: "...", category: "..." }
+    unique_prods = df[['Producto_Normalizado', 'Categoria']].drop_duplicates()
+    available_products = tabla_json(unique_prods.sort_values('Producto_Normalizado'), layout)
+    
+    data_min_date = df['Fecha'].min().strftime('%Y-%m-%d') if not df.empty else None
+    data_max_date = df['Fecha'].max().strftime('%Y-%m-%d') if not df.empty else None
+
+    return {
+        "sales_over_time": sales_over_time,
+        "product_mix": product_mix,
+        "sucursal_performance": sucursal_perf,
+        "product_table": product_table, 
+        "package_breakdown": package_breakdown,
+        "product_trend": product_trend,
+        "demand_heatmap": demand_heatmap,
+        "ticket_analytics": ticket_analytics,
+        "period_comparison": period_comparison,
+        "rolling_averages": rolling_averages,
+        "available_sucursales": available_sucursales,
+        "available_products": available_products,
+        "data_range": {"min": data_min_date, "max": data_max_date},
+        "raw_data_summary": {
+            "total_sales": float(df['Total_Venta'].sum()),
+            "total_items": float(df['Unidades_Reales'].sum()), 
+            "transaction_count": int(len(df)),
+            "active_days": int(active_days)
+        }
+    }
@@ -1,5 +1,6 @@
 import sys
 import asyncio
+import anyio
 
 # Force ProactorEventLoop on Windows for Playwright/Subprocess support
 if sys.platform == 'win32':
@@ -9,15 +10,14 @@ if sys.platform == 'win32':
         # Fallback for systems where this policy might be default or different
         pass
 
-from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, Body, Form
+from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, Body, Form, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse
 from pydantic import BaseModel
-import io
 import os
 import shutil
-import zipfile
 import pandas as pd
+import orjson
 from typing import List, Optional
 from dotenv import load_dotenv
 
@@ -25,13 +25,29 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from auth import router as auth_router, get_current_active_user, users_db, save_users
-from services.sales_cleaner import process_sales_clean, extract_df_and_sucursal
+from services.sales_cleaner import process_sales_clean, extract_df_and_sucursal, LimpiezaEnCola
 from services.analysis_cleaner import procesar_analisis
-from services.production_cleaner import procesar_produccion
-from services.breakdown_service import process_breakdown
-from services.wansoft_service import get_wansoft_session_cookies, download_reports_raw
+from services.production_cleaner import cerrar_pool
+from services.production_store import ruta_store, procesar_produccion_incremental, cargar_produccion_guardada, version_store
+from services.reconciliation_service import COLUMNAS_VENTAS, conciliar_produccion_ventas
+from services.breakdown_service import process_breakdown, breakdown_to_frame, window_breakdown
+from services.result_cache import fingerprint, get_cached, put_cached
+from services.json_response import LAYOUTS, LAYOUT_RECORDS, crear_etag, etag_coincide, no_modificado, json_negociado, tabla_json
+from services.export_service import (
+    csv_streaming_response, xlsx_streaming_response, escribir_xlsx,
+    columnar_streaming_response, FORMATOS_COLUMNARES
+)
+from services.sales_loader import cargar_ventas_limpias, enriquecer_ventas, tipar_ventas
+from services.forecast_service import pronosticar_demanda
+from services.wansoft_service import SesionExpirada
+from services.wansoft_cache import sincronizar_reportes, anunciar_fuentes, escribir_zip
+from services.wansoft_session import obtener_sesion
+from services.browser_pool import navegador
 from services.utils import leer_archivo_base
-from analysis_service import data_analysis_endpoint
+from services.pinned_store import (
+    hash_archivo, limpiar_cache, preparar_archivo_fijado, cargar_ventas_fijadas, cargar_rollup
+)
+from analysis_service import data_analysis_endpoint, precalculo_analisis_fijado
 
 app = FastAPI(title="Velea Limpieza API")
 
@@ -62,10 +78,23 @@ async def startup_event():
     except Exception as e:
         print(f"Error checking Playwright browsers: {e}")
 
+    # Warm shared Chromium for Wansoft logins / browser downloads (jobs skip the launch)
+    await navegador.iniciar()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Production parsing workers (only started by large uploads)
+    cerrar_pool()
+    await navegador.cerrar()
+
 # Configuration
 UPLOAD_DIR = "uploads"
 if not os.path.exists(UPLOAD_DIR):
     os.makedirs(UPLOAD_DIR)
+# Per-user production store; outside uploads/<user>, which unpinning deletes
+PRODUCTION_STORE_DIR = os.getenv("PRODUCTION_STORE_DIR", os.path.join(UPLOAD_DIR, ".produccion"))
+# Processed Wansoft jobs clean each report while the rest download (0 = clean after the download)
+WANSOFT_PIPELINE = os.getenv("WANSOFT_PIPELINE", "1") != "0"
 
 # CORS
 origins = ["*"] # Temporarily allow all for debugging
@@ -76,7 +105,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["Content-Disposition"],
+    expose_headers=["Content-Disposition", "ETag", "X-Production-Sheets-Parsed", "X-Production-Sheets-Reused"],
 )
 
 app.include_router(auth_router)
@@ -146,6 +175,7 @@ async def scan_files(
 # --- SALES CLEANER ---
 @app.post("/tools/clean-sales")
 async def clean_sales_endpoint(
+    request: Request,
     files: List[UploadFile] = File(...), 
     format: Optional[str] = Form("csv"),
     current_user = Depends(get_current_active_user)
@@ -174,22 +204,13 @@ async def clean_sales_endpoint(
 
         if format == "xlsx":
             filename = f"Ventas limpias {min_date} al {max_date}.xlsx"
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df_result.to_excel(writer, index=False)
-            output.seek(0)
-            media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            response_content = iter([output.getvalue()])
+            return xlsx_streaming_response(df_result, filename)
+        elif format in FORMATOS_COLUMNARES:
+            # Typed schema (real dates, categories) so BI jobs and re-uploads skip parsing
+            return columnar_streaming_response(tipar_ventas(df_result), f"Ventas limpias {min_date} al {max_date}", format)
         else:
             filename = f"Ventas limpias {min_date} al {max_date}.csv"
-            stream = io.StringIO()
-            df_result.to_csv(stream, index=False, encoding='utf-8-sig')
-            media_type = "text/csv"
-            response_content = iter([stream.getvalue()])
-
-        response = StreamingResponse(response_content, media_type=media_type)
-        response.headers["Content-Disposition"] = f"attachment; filename={filename}"
-        return response
+            return csv_streaming_response(df_result, filename, request)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -197,6 +218,7 @@ async def clean_sales_endpoint(
 # --- ANALYSIS CLEANER ---
 @app.post("/tools/clean-analysis")
 async def clean_analysis_endpoint(
+    request: Request,
     files: List[UploadFile] = File(...),
     format: Optional[str] = Form("xlsx"), # Default to Excel as it has multiple sheets
     current_user = Depends(get_current_active_user)
@@ -219,36 +241,28 @@ async def clean_analysis_endpoint(
         
         if format == "csv":
             filename = f"Reporte de ventas{range_str}.csv"
-            stream = io.StringIO()
-            # If TOTAL_GENERAL exists
-            if "TOTAL_GENERAL" in results:
-                results["TOTAL_GENERAL"].to_csv(stream, index=False, encoding='utf-8-sig')
-            else:
-                # Fallback to first available
-                list(results.values())[0].to_csv(stream, index=False, encoding='utf-8-sig')
-            
-            media_type = "text/csv"
-            response_content = iter([stream.getvalue()])
+            # If TOTAL_GENERAL exists, else fallback to first available
+            df_csv = results["TOTAL_GENERAL"] if "TOTAL_GENERAL" in results else list(results.values())[0]
+            return csv_streaming_response(df_csv, filename, request)
         else:
             filename = f"Reporte de ventas{range_str}.xlsx"
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                for sheet_name, df in results.items():
-                    df.to_excel(writer, sheet_name=sheet_name, index=False)
-            output.seek(0)
-            media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            response_content = iter([output.getvalue()])
-
-        response = StreamingResponse(response_content, media_type=media_type)
-        response.headers["Content-Disposition"] = f"attachment; filename={filename}"
-        return response
+            return xlsx_streaming_response(results, filename)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # --- PRODUCTION CLEANER ---
+def respuesta_produccion(request: Request, df_result: pd.DataFrame, nombre: str, format: Optional[str]):
+    if format == "xlsx":
+        return xlsx_streaming_response(df_result, f"{nombre}.xlsx")
+    elif format in FORMATOS_COLUMNARES:
+        return columnar_streaming_response(df_result, nombre, format)
+    else:
+        return csv_streaming_response(df_result, f"{nombre}.csv", request)
+
 @app.post("/tools/clean-production")
 async def clean_production_endpoint(
+    request: Request,
     files: List[UploadFile] = File(...),
     start_date: Optional[str] = Form(None),
     end_date: Optional[str] = Form(None),
@@ -261,7 +275,11 @@ async def clean_production_endpoint(
             content = await f.read()
             files_content.append((f.filename, content))
             
-        df_result = procesar_produccion(files_content)
+        # Only new / changed weekly sheets are parsed, the rest come from the user's store
+        store_dir = ruta_store(PRODUCTION_STORE_DIR, current_user.username)
+        # Off the event loop: the parse waits on the worker processes
+        df_result, resumen = await asyncio.to_thread(procesar_produccion_incremental, files_content, store_dir)
+        print(f"Production upload ({current_user.username}): {resumen}")
         
         if df_result.empty:
             raise HTTPException(status_code=400, detail="No valid production data found")
@@ -271,44 +289,221 @@ async def clean_production_endpoint(
         if start_date and end_date:
             range_str = f" {start_date} al {end_date}"
         
-        if format == "xlsx":
-            filename = f"Produccion del Periodo{range_str}.xlsx"
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df_result.to_excel(writer, index=False)
-            output.seek(0)
-            media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            response_content = iter([output.getvalue()])
-        else:
-            filename = f"Produccion del Periodo{range_str}.csv"
-            stream = io.StringIO()
-            df_result.to_csv(stream, index=False, encoding='utf-8-sig')
-            media_type = "text/csv"
-            response_content = iter([stream.getvalue()])
-
-        response = StreamingResponse(response_content, media_type=media_type)
-        response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+        response = respuesta_produccion(request, df_result, f"Produccion del Periodo{range_str}", format)
+        response.headers["X-Production-Sheets-Parsed"] = str(resumen["reprocesadas"])
+        response.headers["X-Production-Sheets-Reused"] = str(resumen["reutilizadas"])
         return response
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/tools/production-store")
+async def production_store_endpoint(
+    request: Request,
+    format: Optional[str] = "csv",
+    current_user = Depends(get_current_active_user)
+):
+    """
+    Tabla de produccion del ultimo upload, servida desde el store sin volver a subir el libro.
+    """
+    df_result = cargar_produccion_guardada(ruta_store(PRODUCTION_STORE_DIR, current_user.username))
+    if df_result.empty:
+        raise HTTPException(status_code=404, detail="No stored production data")
+    return respuesta_produccion(request, df_result, "Produccion guardada", format)
+
+# --- PRODUCTION VS SALES RECONCILIATION ---
+@app.post("/tools/production-reconciliation")
+async def production_reconciliation_endpoint(
+    request: Request,
+    sales_files: Optional[List[UploadFile]] = File(None),
+    production_files: Optional[List[UploadFile]] = File(None), # Optional: new weeks go into the store first
+    use_pinned_file: bool = Form(False), # Sales from the pinned file instead of sales_files
+    start_date: Optional[str] = Form(None), # Defaults to the overlap of both sources
+    end_date: Optional[str] = Form(None),
+    sucursales: Optional[str] = Form(None), # Comma separated list (sales side only)
+    format: Optional[str] = Form(None), # csv, xlsx, parquet or arrow; if present, returns file
+    layout: str = Form(LAYOUT_RECORDS), # records or columnar
+    current_user = Depends(get_current_active_user)
+):
+    try:
+        if layout not in LAYOUTS:
+            raise HTTPException(status_code=400, detail=f"layout must be one of {', '.join(LAYOUTS)}")
+
+        # 1. Production: the user's store (only new / changed sheets of an upload are parsed)
+        store_dir = ruta_store(PRODUCTION_STORE_DIR, current_user.username)
+        if production_files:
+            production_content = [(f.filename, await f.read()) for f in production_files]
+            await asyncio.to_thread(procesar_produccion_incremental, production_content, store_dir)
+        version_produccion = version_store(store_dir)
+        if version_produccion is None:
+            raise HTTPException(status_code=400, detail="No production data. Upload the production workbook first.")
+
+        # 2. Sales: pinned file (pre-cleaned Parquet when ready) or uploaded files
+        files_content = []
+        pinned_info = None
+        if use_pinned_file:
+            pinned_info = users_db.get(current_user.username, {}).get("pinned_file_info")
+            if not pinned_info or not os.path.exists(pinned_info["path"]):
+                raise HTTPException(status_code=400, detail="No pinned file found. Please upload a file or pin one in Analysis.")
+            fuente_ventas = ("pinned", pinned_info.get("content_hash") or hash_archivo(pinned_info["path"]))
+        elif sales_files:
+            for f in sales_files:
+                files_content.append((f.filename, await f.read()))
+            fuente_ventas = [part for name, content in files_content for part in (name, content)]
+        else:
+            raise HTTPException(status_code=400, detail="No sales files provided.")
+
+        sucursal_list = None
+        if sucursales:
+            sucursal_list = [s.strip().upper() for s in sucursales.split(',')]
+            if "TODAS" in sucursal_list:
+                sucursal_list = None
+
+        # 3. Reconcile (cached per user + stored production + sales + filters)
+        result_key = fingerprint("conciliacion", version_produccion, fuente_ventas, start_date, end_date, sucursal_list)
+        etag = None
+        if not format:
+            etag = crear_etag("conciliacion", result_key, layout)
+            if etag_coincide(request, etag):
+                return no_modificado(etag)
+
+        result = get_cached(f"{current_user.username}:{result_key}")
+        if result is None:
+            df_ventas = cargar_ventas_fijadas(pinned_info, columns=COLUMNAS_VENTAS) if pinned_info else None
+            if df_ventas is None:
+                if pinned_info:
+                    with open(pinned_info["path"], "rb") as f:
+                        files_content.append((pinned_info["filename"], f.read()))
+                df_ventas = await cargar_ventas_limpias(files_content)
+            if df_ventas.empty:
+                raise HTTPException(status_code=400, detail="No valid sales data found in files")
+            if sucursal_list:
+                df_ventas = df_ventas[df_ventas['Sucursal'].astype(str).str.upper().isin(sucursal_list)]
+
+            result = conciliar_produccion_ventas(cargar_produccion_guardada(store_dir), df_ventas, start_date, end_date)
+            put_cached(f"{current_user.username}:{result_key}", result)
+
+        diario, semanal, resumen = result["diario"], result["semanal"], result["resumen"]
+        if diario.empty:
+            raise HTTPException(status_code=400, detail="Production and sales do not overlap in the selected dates")
+
+        range_str = f" {resumen['start_date']} al {resumen['end_date']}"
+        if format == "xlsx":
+            filename = f"Produccion vs Ventas{range_str}.xlsx"
+            return xlsx_streaming_response({"DIARIO": diario, "SEMANAL": semanal}, filename)
+        elif format in FORMATOS_COLUMNARES:
+            return columnar_streaming_response(diario, f"Produccion vs Ventas{range_str}", format)
+        elif format == "csv":
+            return csv_streaming_response(diario, f"Produccion vs Ventas{range_str}.csv", request)
+
+        return json_negociado({
+            "diario": tabla_json(diario.assign(Fecha=diario['Fecha'].dt.strftime('%Y-%m-%d')), layout),
+            "semanal": tabla_json(semanal.assign(Semana=semanal['Semana'].dt.strftime('%Y-%m-%d')), layout),
+            "resumen": resumen
+        }, request, etag)
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Server Error: {str(e)}")
+
+# --- DEMAND FORECAST ---
+@app.post("/tools/demand-forecast")
+async def demand_forecast_endpoint(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    sucursales: Optional[str] = Form(None), # Comma separated list
+    start_date: Optional[str] = Form(None), # First forecast day, defaults to day after history
+    horizon: int = Form(7), # Days to forecast
+    format: Optional[str] = Form(None), # csv or xlsx, if present, returns production grid file
+    layout: str = Form(LAYOUT_RECORDS), # records or columnar
+    current_user = Depends(get_current_active_user)
+):
+    try:
+        if layout not in LAYOUTS:
+            raise HTTPException(status_code=400, detail=f"layout must be one of {', '.join(LAYOUTS)}")
+
+        files_content = []
+        for f in files:
+            content = await f.read()
+            files_content.append((f.filename, content))
+
+        df = await cargar_ventas_limpias(files_content)
+        if df.empty:
+            raise HTTPException(status_code=400, detail="No valid sales data found in files")
+        df = enriquecer_ventas(df)
+
+        if sucursales:
+            sucursal_list = [s.strip().upper() for s in sucursales.split(',')]
+            if "TODAS" not in sucursal_list:
+                df = df[df['Sucursal'].isin(sucursal_list)]
+
+        # Package wrappers carry no units of their own (content rows do)
+        df = df[df['Categoria'] != 'Paquete']
+
+        horizon = max(1, min(horizon, 28))
+        df_produccion, df_detalle = pronosticar_demanda(df, horizon=horizon, start_date=start_date)
+        if df_produccion.empty and df_detalle.empty:
+            raise HTTPException(status_code=400, detail="Not enough history to forecast")
+
+        fechas = df_detalle['Fecha']
+        range_str = f" {fechas.min().strftime('%Y-%m-%d')} al {fechas.max().strftime('%Y-%m-%d')}"
+
+        if format == "xlsx":
+            filename = f"Pronostico de Produccion{range_str}.xlsx"
+            return xlsx_streaming_response({"PRODUCCION": df_produccion, "DETALLE_SUCURSAL": df_detalle}, filename)
+        elif format == "csv":
+            filename = f"Pronostico de Produccion{range_str}.csv"
+            return csv_streaming_response(df_produccion, filename, request)
+
+        return json_negociado({
+            "produccion": tabla_json(df_produccion.assign(Fecha=df_produccion['Fecha'].dt.strftime('%Y-%m-%d')), layout),
+            "detalle": tabla_json(df_detalle.assign(Fecha=df_detalle['Fecha'].dt.strftime('%Y-%m-%d')), layout),
+            "horizon": horizon
+        }, request)
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Server Error: {str(e)}")
+
 # Register Analysis Endpoint
 app.post("/tools/data-analysis")(data_analysis_endpoint)
 
 # --- PINNING FUNCTIONALITY (UPDATED) ---
 
+def hash_analisis_fijado(data) -> str:
+    # Content hash of the pinned analysis blob (stable key order)
+    return fingerprint(orjson.dumps(data, option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY))
+
 @app.get("/tools/pinned-analysis")
-async def get_pinned_analysis(current_user = Depends(get_current_active_user)):
+async def get_pinned_analysis(request: Request, current_user = Depends(get_current_active_user)):
     user_data = users_db.get(current_user.username)
     if not user_data:
         raise HTTPException(status_code=404, detail="User not found")
-        
+
+    data = user_data.get("pinned_analysis", None)
+    file_info = user_data.get("pinned_file_info", None)
+
+    # ETag: pinned analysis content + pinned file version and background status
+    if data is not None and "pinned_analysis_hash" not in user_data:
+        user_data["pinned_analysis_hash"] = hash_analisis_fijado(data)
+    etag = crear_etag(
+        "pinned-analysis",
+        user_data.get("pinned_analysis_hash") if data is not None else None,
+        *[(file_info or {}).get(k) for k in ("content_hash", "uploaded_at", "clean_status", "rows")]
+    )
+    if etag_coincide(request, etag):
+        return no_modificado(etag)
+
     # Return both data and file info if exists
-    return {
-        "data": user_data.get("pinned_analysis", None),
-        "file_info": user_data.get("pinned_file_info", None)
-    }
+    return json_negociado({"data": data, "file_info": file_info}, request, etag=etag)
 
 @app.post("/tools/pin-analysis")
 async def pin_analysis(
@@ -320,14 +515,46 @@ async def pin_analysis(
              raise HTTPException(status_code=404, detail="User not found")
              
         users_db[current_user.username]["pinned_analysis"] = data
+        users_db[current_user.username]["pinned_analysis_hash"] = hash_analisis_fijado(data)
         save_users()
         return {"message": "Analysis pinned successfully"}
     except Exception as e:
         print(f"Error pinning analysis: {e}")
         raise HTTPException(status_code=500, detail="Failed to save analysis")
 
+def clave_breakdown(fuente, start_date=None, end_date=None, sucursales=None, view_mode="daily",
+                    product_filter=None, category_filter=None, split_by=None):
+    # Cache key of a full breakdown result: data source + every filter
+    return fingerprint(*fuente, start_date, end_date, sucursales, view_mode, product_filter, category_filter, split_by)
+
+def precalcular_fijado(username: str, pinned_info: dict):
+    """
+    Background job after pinning: clean once to Parquet, then precompute the default
+    breakdown and analysis so the first pinned queries skip parsing entirely.
+    """
+    content_hash = pinned_info["content_hash"]
+
+    def breakdown_default(df):
+        key = clave_breakdown(("pinned", content_hash))
+        result = asyncio.run(process_breakdown([], df_limpio=df))
+        result["result_id"] = key
+        return key, result
+
+    def aplicar(cambios):
+        # Only if this is still the pinned file; runs on the event loop like every other users_db write
+        if users_db.get(username, {}).get("pinned_file_info") is pinned_info:
+            pinned_info.update(cambios)
+            save_users()
+
+    preparar_archivo_fijado(
+        pinned_info,
+        precalculos=[breakdown_default, lambda df: precalculo_analisis_fijado(df, content_hash)],
+        publicar=lambda cambios: anyio.from_thread.run_sync(aplicar, cambios)
+    )
+
 @app.post("/tools/upload-pinned-file")
 async def upload_pinned_file(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     current_user = Depends(get_current_active_user)
 ):
@@ -340,14 +567,22 @@ async def upload_pinned_file(
         
         with open(file_path, "wb") as buffer:
             shutil.copyfileobj(file.file, buffer)
+
+        # Derived files of the previous pinned upload are stale now
+        limpiar_cache(file_path)
             
         # Update user DB with file info
-        users_db[current_user.username]["pinned_file_info"] = {
+        pinned_info = {
             "filename": file.filename,
             "path": file_path,
-            "uploaded_at": pd.Timestamp.now().isoformat()
+            "uploaded_at": pd.Timestamp.now().isoformat(),
+            "content_hash": hash_archivo(file_path),
+            "clean_status": "pending"
         }
+        users_db[current_user.username]["pinned_file_info"] = pinned_info
         save_users()
+
+        background_tasks.add_task(precalcular_fijado, current_user.username, pinned_info)
         
         return {"message": "File pinned successfully", "filename": file.filename}
     except Exception as e:
@@ -362,6 +597,7 @@ async def unpin_analysis(current_user = Depends(get_current_active_user)):
              
         # Clear both analysis data and file info
         users_db[current_user.username]["pinned_analysis"] = None
+        users_db[current_user.username]["pinned_analysis_hash"] = None
         users_db[current_user.username]["pinned_file_info"] = None
         
         # Optionally delete file? Maybe keep it for history or just overwrite next time.
@@ -379,6 +615,7 @@ async def unpin_analysis(current_user = Depends(get_current_active_user)):
 
 @app.post("/tools/breakdown")
 async def breakdown_endpoint(
+    request: Request,
     files: Optional[List[UploadFile]] = File(None),
     use_pinned_file: bool = Form(False),
     start_date: Optional[str] = Form(None),
@@ -387,24 +624,43 @@ async def breakdown_endpoint(
     view_mode: str = Form("daily"), # daily, weekly, monthly
     product_filter: Optional[str] = Form(None), # Comma separated list
     category_filter: Optional[str] = Form(None), # Comma separated list
-    format: Optional[str] = Form(None), # csv or xlsx, if present, returns file
+    format: Optional[str] = Form(None), # csv, xlsx, parquet or arrow; if present, returns file
+    split_by: Optional[str] = Form(None), # 'sucursal' to break each product down per sucursal
+    result_id: Optional[str] = Form(None), # Page a cached result without re-uploading files
+    row_offset: int = Form(0), # First product row of the window
+    row_limit: Optional[int] = Form(None), # Product rows in the window (all if empty)
+    column_start: Optional[str] = Form(None), # First period column of the window (inclusive)
+    column_end: Optional[str] = Form(None), # Last period column of the window (inclusive)
+    sparse: bool = Form(False), # Return non-zero cells as [row, column, value]
+    layout: str = Form(LAYOUT_RECORDS), # records or columnar ({columns, data: {col: [...]}})
     current_user = Depends(get_current_active_user)
 ):
     try:
+        if layout not in LAYOUTS:
+            raise HTTPException(status_code=400, detail=f"layout must be one of {', '.join(LAYOUTS)}")
         files_content = []
+        df_pinned = None
+        fuente = None
         
+        # 0. Cached full pivot (virtual scroll / paging)
+        result = None
+        if result_id:
+            result = get_cached(f"{current_user.username}:{result_id}")
+            if result is None and not files and not use_pinned_file:
+                raise HTTPException(status_code=410, detail="Cached result expired. Please send the files again.")
+
         # 1. Load Files (Uploaded OR Pinned)
-        if use_pinned_file:
+        if result is not None:
+            pass
+        elif use_pinned_file:
             user_data = users_db.get(current_user.username)
             pinned_info = user_data.get("pinned_file_info")
             
             if not pinned_info or not os.path.exists(pinned_info["path"]):
                 raise HTTPException(status_code=400, detail="No pinned file found. Please upload a file or pin one in Analysis.")
-                
-            # Read local file
-            with open(pinned_info["path"], "rb") as f:
-                content = f.read()
-                files_content.append((pinned_info["filename"], content))
+
+            # Data is only read on a cache miss (see 3.)
+            fuente = ("pinned", pinned_info.get("content_hash") or hash_archivo(pinned_info["path"]))
         elif files:
             for f in files:
                 content = await f.read()
@@ -417,33 +673,60 @@ async def breakdown_endpoint(
         product_list = [p.strip() for p in product_filter.split(',')] if product_filter else None
         category_list = [c.strip() for c in category_filter.split(',')] if category_filter else None
 
-        # 3. Process
-        result = await process_breakdown(
-            files_content,
-            start_date=start_date,
-            end_date=end_date,
-            sucursales=sucursales_list,
-            view_mode=view_mode,
-            product_filter=product_list,
-            category_filter=category_list
-        )
+        # 3. Process (full pivot is cached per user + files + filters)
+        if result is None:
+            if fuente is None:
+                fuente = [part for name, content in files_content for part in (name, content)]
+            result_id = clave_breakdown(
+                fuente, start_date, end_date, sucursales_list, view_mode, product_list, category_list, split_by
+            )
+
+        # Same data + filters + window -> same body: answer 304 before touching the data
+        etag = None
+        if not format:
+            etag = crear_etag("breakdown", result_id, row_offset, row_limit, column_start, column_end, sparse, layout)
+            if etag_coincide(request, etag):
+                return no_modificado(etag)
+
+        if result is None:
+            result = get_cached(f"{current_user.username}:{result_id}")
+            if result is None and use_pinned_file:
+                # Precomputed by the pinning background job
+                result = cargar_rollup(pinned_info["path"], result_id)
+                if result is not None:
+                    put_cached(f"{current_user.username}:{result_id}", result)
+            if result is None and use_pinned_file:
+                # Pre-cleaned Parquet if the background job already finished, else the raw file
+                df_pinned = cargar_ventas_fijadas(pinned_info)
+                if df_pinned is None:
+                    with open(pinned_info["path"], "rb") as f:
+                        files_content.append((pinned_info["filename"], f.read()))
+            if result is None:
+                result = await process_breakdown(
+                    files_content,
+                    start_date=start_date,
+                    end_date=end_date,
+                    sucursales=sucursales_list,
+                    view_mode=view_mode,
+                    product_filter=product_list,
+                    category_filter=category_list,
+                    split_by=split_by,
+                    df_limpio=df_pinned
+                )
+                if isinstance(result, dict) and "data" in result:
+                    result["result_id"] = result_id
+                    put_cached(f"{current_user.username}:{result_id}", result)
         
         # 4. Export if format requested
         if format:
             data = result["data"]
             columns = result["columns"]
-            row_key = result["row_key"]
             
             if not data:
                 raise HTTPException(status_code=400, detail="No data to export")
                 
-            df_export = pd.DataFrame(data)
-            
-            # Reorder columns to match UI: Row Key + Date Columns
-            final_cols = [row_key] + columns
-            # Ensure columns exist in DF
-            existing_cols = [c for c in final_cols if c in df_export.columns]
-            df_export = df_export[existing_cols]
+            # Row Key (+ Sucursal in split mode) + Date Columns, same order as the UI
+            df_export = breakdown_to_frame(result)
             
             # Filename logic
             range_str = ""
@@ -456,24 +739,25 @@ async def breakdown_endpoint(
 
             if format == "xlsx":
                 filename = f"Desglose_Ventas{range_str}.xlsx"
-                output = io.BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    df_export.to_excel(writer, index=False)
-                output.seek(0)
-                media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                response_content = iter([output.getvalue()])
+                return xlsx_streaming_response(df_export, filename)
+            elif format in FORMATOS_COLUMNARES:
+                return columnar_streaming_response(df_export, f"Desglose_Ventas{range_str}", format)
             else: # csv
                 filename = f"Desglose_Ventas{range_str}.csv"
-                stream = io.StringIO()
-                df_export.to_csv(stream, index=False, encoding='utf-8-sig')
-                media_type = "text/csv"
-                response_content = iter([stream.getvalue()])
-
-            response = StreamingResponse(response_content, media_type=media_type)
-            response.headers["Content-Disposition"] = f"attachment; filename={filename}"
-            return response
+                return csv_streaming_response(df_export, filename, request)
         
-        return result
+        if not isinstance(result, dict):
+            return result
+
+        return json_negociado(window_breakdown(
+            result,
+            row_offset=row_offset,
+            row_limit=row_limit,
+            column_start=column_start,
+            column_end=column_end,
+            sparse=sparse,
+            layout=layout
+        ), request, etag=etag)
 
     except HTTPException as he:
         raise he
@@ -483,12 +767,30 @@ async def breakdown_endpoint(
         raise HTTPException(status_code=500, detail=f"Server Error: {str(e)}")
 
 import uuid
-from fastapi import BackgroundTasks
+import time
 
 # --- JOB MANAGER ---
 # Simple in-memory job store
-# Structure: job_id -> { "status": "pending"|"processing"|"completed"|"failed", "message": "...", "progress": 0-100, "result": bytes|None, "filename": str, "media_type": str }
+# Structure: job_id -> { "status": "pending"|"processing"|"completed"|"failed", "message": "...", "progress": 0-100, "path": str|None, "filename": str, "media_type": str, "created": float }
 jobs = {}
+# Job results are files here (the job only keeps the path); finished jobs expire after WANSOFT_JOB_TTL seconds
+JOBS_DIR = os.path.join(UPLOAD_DIR, ".wansoft_jobs")
+JOB_TTL = int(os.getenv("WANSOFT_JOB_TTL", str(6 * 60 * 60)))
+
+def limpiar_jobs():
+    """
+    Quita los jobs terminados que vencieron y sus archivos, y los archivos sin job
+    (left by a previous run of the server).
+    """
+    limite = time.time() - JOB_TTL
+    for job_id in [j for j, job in jobs.items() if job["status"] in ("completed", "failed") and job.get("created", 0) < limite]:
+        path = jobs.pop(job_id).get("path")
+        if path and os.path.exists(path):
+            os.remove(path)
+    if os.path.isdir(JOBS_DIR):
+        for nombre in os.listdir(JOBS_DIR):
+            if nombre.split(".")[0] not in jobs:
+                os.remove(os.path.join(JOBS_DIR, nombre))
 
 # --- WANSOFT DOWNLOADER ---
 class WansoftRequest(BaseModel):
@@ -499,6 +801,7 @@ class WansoftRequest(BaseModel):
     output_type: str # "raw" or "processed"
 
 async def process_wansoft_job(job_id: str, req: WansoftRequest):
+    limpieza = None
     try:
         jobs[job_id]["status"] = "processing"
         jobs[job_id]["progress"] = 5
@@ -509,9 +812,9 @@ async def process_wansoft_job(job_id: str, req: WansoftRequest):
             jobs[job_id]["message"] = msg
             jobs[job_id]["progress"] = percent
 
-        # 1. Login
+        # 1. Login (reuses the account's cached session while it is still valid)
         try:
-            cookies = await get_wansoft_session_cookies(req.username, req.password)
+            cookies, _ = await obtener_sesion(req.username, req.password)
         except Exception as login_err:
              print(f"Login failed: {login_err}")
              jobs[job_id]["status"] = "failed"
@@ -522,15 +825,32 @@ async def process_wansoft_job(job_id: str, req: WansoftRequest):
         jobs[job_id]["message"] = "Descargando reportes..."
         jobs[job_id]["progress"] = 10
         
+        # Pipelined: the download feeds cleaning workers, so network and CPU overlap
+        limpieza = LimpiezaEnCola() if req.output_type == "processed" else None
+        al_llegar = limpieza.encolar if limpieza and WANSOFT_PIPELINE else None
+
+        # Per-report download metrics (attempts, latency, bytes, errors), live in the job status
+        metricas = jobs[job_id]["metricas"] = []
+
+        # Only days missing from the account's report cache (or still open) are downloaded
         try:
-            files_content = await download_reports_raw(cookies, req.start_date, req.end_date, progress_callback=update_progress)
+            try:
+                fuentes, resumen = await sincronizar_reportes(cookies, req.username, req.start_date, req.end_date, progress_callback=update_progress, al_llegar=al_llegar, metricas=metricas)
+            except SesionExpirada as sesion_err:
+                # Session died after the check (or a fresh login was rejected): log in again once
+                print(f"Wansoft session rejected ({sesion_err}), logging in again")
+                update_progress("La sesión expiró, iniciando sesión de nuevo...", 10)
+                metricas[:] = [m for m in metricas if m["estado"] != "sesion"]
+                cookies, _ = await obtener_sesion(req.username, req.password, forzar_login=True)
+                fuentes, resumen = await sincronizar_reportes(cookies, req.username, req.start_date, req.end_date, progress_callback=update_progress, al_llegar=al_llegar, metricas=metricas)
+            jobs[job_id]["sync"] = resumen
         except Exception as download_err:
              print(f"Download failed: {download_err}")
              jobs[job_id]["status"] = "failed"
              jobs[job_id]["message"] = f"Error de descarga: {str(download_err)}"
              return
         
-        if not files_content:
+        if not fuentes:
              jobs[job_id]["status"] = "failed"
              jobs[job_id]["message"] = "No se pudieron descargar reportes. Verifica las fechas y permisos."
              return
@@ -539,9 +859,20 @@ async def process_wansoft_job(job_id: str, req: WansoftRequest):
         jobs[job_id]["message"] = "Procesando archivos..."
         jobs[job_id]["progress"] = 95
         
+        os.makedirs(JOBS_DIR, exist_ok=True)
         if req.output_type == "processed":
-            # Use existing cleaning logic
-            df_result = await process_sales_clean(files_content)
+            if not WANSOFT_PIPELINE:
+                # Clean after the download: same workers, fed from the cache now
+                anunciar_fuentes(req.username, fuentes, limpieza.encolar)
+            # Only what is still in the queue is left to clean; then merge cleaned frames
+            try:
+                df_result = await limpieza.unir([blob for _, blob, _ in fuentes], [dias for _, _, dias in fuentes])
+            except ValueError as clean_err:
+                # A report that cannot be cleaned fails the job instead of dropping its sales
+                print(f"Cleaning failed: {clean_err}")
+                jobs[job_id]["status"] = "failed"
+                jobs[job_id]["message"] = f"Error procesando reportes: {str(clean_err)}"
+                return
             
             if df_result.empty:
                 jobs[job_id]["status"] = "failed"
@@ -549,31 +880,33 @@ async def process_wansoft_job(job_id: str, req: WansoftRequest):
                 return
                 
             filename = f"Ventas_Wansoft_Limpias_{req.start_date}_al_{req.end_date}.xlsx"
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df_result.to_excel(writer, index=False)
-            output.seek(0)
+            # Workbook written to disk row by row (constant_memory), off the event loop
+            path = os.path.join(JOBS_DIR, f"{job_id}.xlsx")
+            await asyncio.to_thread(escribir_xlsx, {"Sheet1": df_result}, path)
+            del df_result
             
-            jobs[job_id]["result"] = output.getvalue()
+            jobs[job_id]["path"] = path
             jobs[job_id]["filename"] = filename
             jobs[job_id]["media_type"] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
             
         else: # raw
-            # Return ZIP of all files
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-                for fname, content in files_content:
-                    zip_file.writestr(fname, content)
-            
-            zip_buffer.seek(0)
+            # ZIP: one report per subsidiary with exactly the requested days, from the report cache
+            path = os.path.join(JOBS_DIR, f"{job_id}.zip")
+            await asyncio.to_thread(escribir_zip, req.username, fuentes, path, req.start_date, req.end_date)
             filename = f"Reportes_Crudos_Wansoft_{req.start_date}_al_{req.end_date}.zip"
             
-            jobs[job_id]["result"] = zip_buffer.getvalue()
+            jobs[job_id]["path"] = path
             jobs[job_id]["filename"] = filename
             jobs[job_id]["media_type"] = "application/zip"
 
         jobs[job_id]["status"] = "completed"
         jobs[job_id]["message"] = "¡Descarga completada!"
+        if resumen["reportes_fallidos"]:
+            # Partial result: the failed windows stay missing in the cache, so the next job
+            # downloads only those
+            fallidas = sorted({m["sucursal"] for m in metricas if m["estado"] == "fallido"})
+            jobs[job_id]["message"] += (f" {resumen['reportes_fallidos']} reportes fallaron"
+                                        f" (sucursales {', '.join(map(str, fallidas))}); vuelve a descargar para reintentar solo esos.")
         jobs[job_id]["progress"] = 100
 
     except Exception as e:
@@ -582,6 +915,9 @@ async def process_wansoft_job(job_id: str, req: WansoftRequest):
         traceback.print_exc()
         jobs[job_id]["status"] = "failed"
         jobs[job_id]["message"] = f"Error inesperado: {str(e)}"
+    finally:
+        # Cleaning workers never outlive the job, whatever path it ended on
+        if limpieza: limpieza.cerrar()
 
 @app.post("/tools/wansoft-download")
 async def start_wansoft_download(
@@ -589,16 +925,23 @@ async def start_wansoft_download(
     background_tasks: BackgroundTasks,
     current_user = Depends(get_current_active_user)
 ):
+    limpiar_jobs()
     job_id = str(uuid.uuid4())
     jobs[job_id] = {
         "status": "pending",
         "message": "Iniciando...",
         "progress": 0,
-        "result": None
+        "path": None,
+        "created": time.time()
     }
     background_tasks.add_task(process_wansoft_job, job_id, req)
     return {"job_id": job_id}
 
+@app.get("/tools/wansoft-browser")
+async def get_wansoft_browser(current_user = Depends(get_current_active_user)):
+    # Shared Chromium health: connected, contexts in use, launches (> 1 means it was restarted)
+    return navegador.estado()
+
 @app.get("/tools/wansoft-status/{job_id}")
 async def get_wansoft_status(job_id: str, current_user = Depends(get_current_active_user)):
     if job_id not in jobs:
@@ -608,7 +951,11 @@ async def get_wansoft_status(job_id: str, current_user = Depends(get_current_act
     return {
         "status": job["status"],
         "message": job["message"],
-        "progress": job.get("progress", 0)
+        "progress": job.get("progress", 0),
+        # Reports downloaded vs subsidiary-days served from the report cache
+        "sync": job.get("sync"),
+        # One entry per downloaded report: estado, intentos, latencia_s, total_s, bytes, error
+        "metricas": job.get("metricas")
     }
 
 @app.get("/tools/wansoft-result/{job_id}")
@@ -617,17 +964,12 @@ async def get_wansoft_result(job_id: str, current_user = Depends(get_current_act
         raise HTTPException(status_code=404, detail="Job not found")
     
     job = jobs[job_id]
-    if job["status"] != "completed" or not job.get("result"):
+    if job["status"] != "completed" or not job.get("path") or not os.path.exists(job["path"]):
         raise HTTPException(status_code=400, detail="Result not ready or job failed")
     
-    # Serve file
-    response = StreamingResponse(
-        iter([job["result"]]), 
-        media_type=job["media_type"]
+    # Served from disk in chunks; removed by limpiar_jobs after WANSOFT_JOB_TTL
+    return FileResponse(
+        job["path"],
+        media_type=job["media_type"],
+        headers={"Content-Disposition": f"attachment; filename={job['filename']}"}
     )
-    response.headers["Content-Disposition"] = f"attachment; filename={job['filename']}"
-    
-    # Cleanup (optional, maybe keep it for a bit?)
-    # For now, let's keep it. A cron job would be better for cleanup.
-    
-    return response
@@ -54,6 +54,30 @@ TAMAL_MAPPING = {
     'Refresco Pet 600ml': ('Refresco Pet', '600ml', 1),
 }
 
+# Sales vocabulary (TAMAL_MAPPING) -> production sheet vocabulary (procesar_produccion)
+GUISO_PRODUCCION = {
+    'Puerco': 'PCO',
+    'Pollo': 'POLLO',
+    'Queso': 'QUESO',
+    'Frijol': 'FRIJOL',
+    'Dulce': 'DULCE',
+    # No 'Elote': its production block is not parsed (production_cleaner.GUISOS_SIN_BLOQUE)
+    'Pollo Salsa Verde': 'SALSA VERDE',
+    'Pollo Mole': 'MOLE',
+}
+TIPO_PRODUCCION = {
+    'Tradicional': 'Tradicional',
+    'Hoja de Platano': 'Hoja de Platano (HP)',
+    'Borracho': 'Borracho',
+}
+
+# Producto_Normalizado ("Puerco (Tradicional)") -> (Tipo_Tamal, Guiso) as written by procesar_produccion
+NORMALIZADO_A_PRODUCCION = {
+    f"{guiso} ({tipo})": (TIPO_PRODUCCION[tipo], GUISO_PRODUCCION[guiso])
+    for guiso, tipo, _ in TAMAL_MAPPING.values()
+    if guiso in GUISO_PRODUCCION and tipo in TIPO_PRODUCCION
+}
+
 # Add Drinks or other common items here if needed to classify
 BEBIDA_KEYWORDS = ['CAFÉ', 'CHAMPURRADO', 'REFRESCO', 'AGUA', 'ATOLE', 'COCA', 'SPRITE', 'FANTA', 'JUGO', 'VASO', 'VALLEFRUT', 'FUZE TEA', 'CIEL']
 PAQUETE_KEYWORDS = ['PAQUETE', 'DOCENA', 'COMBO', 'CIENTO', 'PROMO', '+']
@@ -1,21 +1,124 @@
 
+import numpy as np
 import pandas as pd
 import os
 from typing import List, Optional, Tuple
 from services.utils import leer_archivo_base
 from services.sales_cleaner import process_sales_clean
-from services.analysis_cleaner import TAMAL_MAPPING, get_product_category
+from services.sales_loader import enriquecer_ventas, COLUMNAS_VENTAS_LIMPIAS
+from services.json_response import LAYOUT_RECORDS, LAYOUT_COLUMNAR
 
-async def process_breakdown(
-    files_content: List[Tuple[str, bytes]],
-    start_date: Optional[str] = None,
-    end_date: Optional[str] = None,
-    sucursales: Optional[List[str]] = None,
-    view_mode: str = 'daily', # daily, weekly, monthly
-    product_filter: Optional[List[str]] = None,
-    category_filter: Optional[List[str]] = None
-):
-    # 1. Load Data (Handle both Raw and Clean files)
+# Row order for the breakdown table (Products)
+PRIORITY_ORDER = [
+    # Tradicionales
+    "Puerco (Tradicional)", "Pollo (Tradicional)", "Frijol (Tradicional)", "Queso (Tradicional)", "Dulce (Tradicional)",
+    # Hoja de Plátano
+    "Pollo (Hoja de Platano)", "Puerco (Hoja de Platano)",
+    # Borrachos
+    "Pollo Salsa Verde (Borracho)", "Puerco (Borracho)", "Queso (Borracho)", "Pollo Mole (Borracho)",
+    # Bebidas, Extras y Paquetes (Nuevo Orden Solicitado)
+    "Refresco Vidrio (355ml)",
+    "Refresco Lata (355ml)",
+    "Refresco Pet (600ml)",
+    "Fuze Tea",
+    "Ciel 600 ml",
+    "Ciel 1 lto.",
+    "Vallefrut",
+    "Cafe vaso",
+    "Café vaso", # Added variant
+    "EMPANADA CAJETA Y NUEZ",
+    "EMPANADA PIÑA",
+    "Vaso de salsa 1/2 litro",
+    "1 tamal borracho + 1 refresco",
+    "1 tamal hp  + refresco",
+    "5 tamales tradicionales + 1 refresco",
+    "Docena Mixta",
+    "Ciento",
+    "Medio Ciento",
+    "Media Docena",
+    "PAN DULCE",
+    "Promo 3 Docenas",
+]
+# Precomputed rank, O(1) per row instead of list.index()
+PRIORITY_RANK = {name: i for i, name in enumerate(PRIORITY_ORDER)}
+
+def ordenar_productos(productos):
+    """
+    Priority list first, then the rest alphabetically, "Tamal Elote" last.
+    """
+    resto = {p: 100 + i for i, p in enumerate(sorted(p for p in productos if p not in PRIORITY_RANK))}
+    def rank(p):
+        if p in PRIORITY_RANK:
+            return PRIORITY_RANK[p]
+        if p == "Tamal Elote":
+            return 9999 # Last
+        return resto[p]
+    return sorted(productos, key=lambda p: (rank(p), p))
+
+def construir_desglose_por_sucursal(df: pd.DataFrame):
+    """
+    Desglose producto x periodo x sucursal en una sola agregacion sobre codigos enteros.
+    Returns a hierarchical, sparse structure: only non-zero cells are emitted.
+    """
+    prod_codes, prod_labels = pd.factorize(df['Producto_Normalizado'])
+    per_codes, per_labels = pd.factorize(df['Periodo'])
+    suc_codes, suc_labels = pd.factorize(df['Sucursal'].astype(str))
+
+    valid = (prod_codes >= 0) & (per_codes >= 0)
+    celdas = pd.DataFrame({
+        'p': prod_codes[valid],
+        't': per_codes[valid],
+        's': suc_codes[valid],
+        'v': df['Unidades_Reales'].to_numpy()[valid]
+    }).groupby(['p', 't', 's'], sort=False)['v'].sum()
+    celdas = celdas[celdas != 0]
+
+    filas = {}
+    for (p, t, s_idx), v in zip(celdas.index, celdas.to_numpy()):
+        fila = filas.setdefault(p, {"total": {}, "sucursales": {}})
+        periodo = per_labels[t]
+        valor = float(v)
+        fila["total"][periodo] = fila["total"].get(periodo, 0.0) + valor
+        fila["sucursales"].setdefault(suc_labels[s_idx], {})[periodo] = valor
+
+    rank = {label: i for i, label in enumerate(prod_labels)}
+    data = []
+    for producto in ordenar_productos([prod_labels[p] for p in filas]):
+        fila = filas[rank[producto]]
+        data.append({
+            "Producto_Normalizado": producto,
+            "total": fila["total"],
+            "sucursales": dict(sorted(fila["sucursales"].items()))
+        })
+
+    date_columns = sorted(str(c) for c in per_labels)
+    return data, date_columns, sorted(str(c) for c in suc_labels)
+
+def breakdown_to_frame(result: dict) -> pd.DataFrame:
+    """
+    Tabla plana para exportar (csv/xlsx). In split mode there is one row per
+    product total plus one per sucursal.
+    """
+    row_key = result["row_key"]
+    columns = result["columns"]
+    if result.get("split_by") != "sucursal":
+        df_export = pd.DataFrame(result["data"])
+        final_cols = [row_key] + columns
+        return df_export[[c for c in final_cols if c in df_export.columns]]
+
+    rows = []
+    for fila in result["data"]:
+        rows.append({row_key: fila[row_key], "Sucursal": "TOTAL", **fila["total"]})
+        for sucursal, valores in fila["sucursales"].items():
+            rows.append({row_key: fila[row_key], "Sucursal": sucursal, **valores})
+    df_export = pd.DataFrame(rows, columns=[row_key, "Sucursal"] + columns)
+    df_export[columns] = df_export[columns].fillna(0)
+    return df_export
+
+async def _cargar_datos(files_content: List[Tuple[str, bytes]]):
+    """
+    Archivos limpios se leen directo; los crudos pasan por process_sales_clean.
+    """
     print(f"DEBUG: Processing breakdown with {len(files_content)} files")
     
     clean_dfs = []
@@ -23,7 +126,7 @@ async def process_breakdown(
 
     for filename, content in files_content:
         try:
-            base = leer_archivo_base(content, filename)
+            base = leer_archivo_base(content, filename, columns=COLUMNAS_VENTAS_LIMPIAS)
             df_check = None
             
             if isinstance(base, pd.ExcelFile):
@@ -63,30 +166,34 @@ async def process_breakdown(
 
     if not clean_dfs:
         print("DEBUG: No valid data found (clean or raw)")
-        return {}, [], []
+        return None
         
-    df = pd.concat(clean_dfs, ignore_index=True)
+    return pd.concat(clean_dfs, ignore_index=True)
+
+async def process_breakdown(
+    files_content: List[Tuple[str, bytes]],
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    sucursales: Optional[List[str]] = None,
+    view_mode: str = 'daily', # daily, weekly, monthly
+    product_filter: Optional[List[str]] = None,
+    category_filter: Optional[List[str]] = None,
+    split_by: Optional[str] = None, # None (sum of selected sucursales) or 'sucursal'
+    df_limpio: Optional[pd.DataFrame] = None # Pre-cleaned sales (pinned Parquet), skips parsing
+):
+    # 1. Load Data (Handle both Raw and Clean files, or an already clean frame)
+    if df_limpio is not None:
+        df = df_limpio.copy()
+    else:
+        df = await _cargar_datos(files_content)
+        if df is None:
+            return {}, [], []
     print(f"DEBUG: Final Combined DF shape: {df.shape}")
 
-    # 2. Pre-processing (same as analysis_service)
-    df['Total_Venta'] = pd.to_numeric(df['Total_Venta'], errors='coerce').fillna(0)
-    df['Cantidad'] = pd.to_numeric(df['Cantidad'], errors='coerce').fillna(0)
-    
-    # Normalization
-    def get_normalized_info(prod_name):
-        if prod_name in TAMAL_MAPPING:
-            guiso, tipo, factor = TAMAL_MAPPING[prod_name]
-            return f"{guiso} ({tipo})", factor
-        return prod_name, 1
-
-    df[['Producto_Normalizado', 'Factor']] = df['Producto_Final'].apply(
-        lambda x: pd.Series(get_normalized_info(x))
-    )
+    # 2. Pre-processing (same as analysis_service): types, normalization, factor, category
+    df = enriquecer_ventas(df)
     
     print(f"DEBUG: Sample Normalized: {df['Producto_Normalizado'].head().tolist()}")
-
-    df['Unidades_Reales'] = df['Cantidad'] * df['Factor']
-    df['Categoria'] = df['Producto_Final'].apply(get_product_category)
     
     # 3. Filtering
     print(f"DEBUG: Filters - Start: {start_date}, End: {end_date}, Suc: {sucursales}, Cat: {category_filter}, Prod: {product_filter}")
@@ -123,12 +230,25 @@ async def process_breakdown(
     df['Fecha'] = pd.to_datetime(df['Fecha'])
     
     if view_mode == 'weekly':
-        df['Periodo'] = df['Fecha'].dt.to_period('W').apply(lambda r: r.start_time.strftime('%Y-%m-%d'))
+        df['Periodo'] = (df['Fecha'].dt.normalize() - pd.to_timedelta(df['Fecha'].dt.dayofweek, unit='D')).dt.strftime('%Y-%m-%d') # Monday of the week
     elif view_mode == 'monthly':
-        df['Periodo'] = df['Fecha'].dt.to_period('M').apply(lambda r: r.strftime('%Y-%m'))
+        df['Periodo'] = df['Fecha'].dt.strftime('%Y-%m')
     else: # daily
         df['Periodo'] = df['Fecha'].dt.strftime('%Y-%m-%d')
 
+    # 4.1 Split by Sucursal: product -> {total, sucursales} with sparse period cells
+    if split_by == 'sucursal':
+        data, date_columns, split_values = construir_desglose_por_sucursal(df)
+        return {
+            "data": data,
+            "columns": date_columns,
+            "row_key": "Producto_Normalizado",
+            "split_by": "sucursal",
+            "split_values": split_values,
+            "available_sucursales": available_sucursales,
+            "available_products": available_products
+        }
+
     # 5. Pivot Table Logic (TRANSPOSED)
     # We want: Producto_Normalizado | Periodo1 | Periodo2 ...
     # But first, let's pivot normally then transpose logic or just pivot differently.
@@ -153,56 +273,10 @@ async def process_breakdown(
         fill_value=0
     ).reset_index()
     
-    # Sort Products (Rows) by Priority Order
-    # Define priority groups
-    priority_order = [
-        # Tradicionales
-        "Puerco (Tradicional)", "Pollo (Tradicional)", "Frijol (Tradicional)", "Queso (Tradicional)", "Dulce (Tradicional)",
-        # Hoja de Plátano
-        "Pollo (Hoja de Platano)", "Puerco (Hoja de Platano)",
-        # Borrachos
-        "Pollo Salsa Verde (Borracho)", "Puerco (Borracho)", "Queso (Borracho)", "Pollo Mole (Borracho)",
-        # Bebidas, Extras y Paquetes (Nuevo Orden Solicitado)
-        "Refresco Vidrio (355ml)",
-        "Refresco Lata (355ml)",
-        "Refresco Pet (600ml)",
-        "Fuze Tea",
-        "Ciel 600 ml",
-        "Ciel 1 lto.",
-        "Vallefrut",
-        "Cafe vaso",
-        "Café vaso", # Added variant
-        "EMPANADA CAJETA Y NUEZ",
-        "EMPANADA PIÑA",
-        "Vaso de salsa 1/2 litro",
-        "1 tamal borracho + 1 refresco",
-        "1 tamal hp  + refresco",
-        "5 tamales tradicionales + 1 refresco",
-        "Docena Mixta",
-        "Ciento",
-        "Medio Ciento",
-        "Media Docena",
-        "PAN DULCE",
-        "Promo 3 Docenas",
-    ]
-    
-    # Create a categorical type for sorting
-    # We need all unique products from data + priority list to ensure coverage
-    unique_products = pivot_df['Producto_Normalizado'].unique().tolist()
-    
-    # Helper to get sort index
-    def get_sort_index(prod_name):
-        if prod_name in priority_order:
-            return priority_order.index(prod_name)
-        if prod_name == "Tamal Elote":
-            return 9999 # Last
-        return 100 + (unique_products.index(prod_name) if prod_name in unique_products else 0) # Middle (Alphabetical ideally but this works)
-
-    # Sort logic
-    pivot_df['sort_key'] = pivot_df['Producto_Normalizado'].apply(get_sort_index)
-    
-    # Secondary sort: Alphabetical for non-priority items
-    pivot_df = pivot_df.sort_values(['sort_key', 'Producto_Normalizado'])
+    # Sort Products (Rows) by Priority Order (see PRIORITY_ORDER)
+    orden = {p: i for i, p in enumerate(ordenar_productos(pivot_df['Producto_Normalizado'].tolist()))}
+    pivot_df['sort_key'] = pivot_df['Producto_Normalizado'].map(orden)
+    pivot_df = pivot_df.sort_values('sort_key')
     pivot_df = pivot_df.drop(columns=['sort_key'])
     
     # Columns are now Periodos (Dates)
@@ -229,3 +303,92 @@ async def process_breakdown(
         "available_sucursales": available_sucursales,
         "available_products": available_products
     }
+
+def _tabla(result: dict) -> pd.DataFrame:
+    # Plain pivot as a numeric DataFrame (index = row names, one column per period), built
+    # once per cached result: windows are then positional iloc slices converted whole
+    tabla = result.get("_tabla")
+    if tabla is None:
+        row_key = result["row_key"]
+        tabla = pd.DataFrame(
+            result["data"], columns=[row_key] + result["columns"]
+        ).set_index(row_key).fillna(0)
+        result["_tabla"] = tabla
+    return tabla
+
+def window_breakdown(
+    result: dict,
+    row_offset: int = 0,
+    row_limit: Optional[int] = None,
+    column_start: Optional[str] = None,
+    column_end: Optional[str] = None,
+    sparse: bool = False,
+    layout: str = LAYOUT_RECORDS
+) -> dict:
+    """
+    Ventana de filas (offset/limit sobre productos) y columnas (rango de periodos)
+    sobre un resultado completo de process_breakdown, ya cacheado en el servidor.
+    sparse=True encodes non-zero cells as [row, column, value] triplets.
+    layout='columnar' returns the plain pivot as {columns, data: {col: array}} (split mode
+    is already sparse and keeps its nested layout).
+    """
+    row_key = result["row_key"]
+    all_columns = result["columns"]
+    posiciones = [
+        j for j, c in enumerate(all_columns)
+        if (not column_start or c >= column_start) and (not column_end or c <= column_end)
+    ]
+    columns = [all_columns[j] for j in posiciones]
+
+    row_offset = max(row_offset, 0)
+    fin = row_offset + row_limit if row_limit is not None else None
+
+    window = {k: v for k, v in result.items() if k != "data" and not k.startswith("_")}
+    window.update({
+        "columns": columns,
+        "total_rows": len(result["data"]),
+        "total_columns": len(all_columns),
+        "row_offset": row_offset
+    })
+
+    if result.get("split_by") == "sucursal":
+        # Already sparse (only non-zero periods), just clip the periods
+        seleccion = set(columns)
+        window["data"] = [
+            {
+                row_key: fila[row_key],
+                "total": {p: v for p, v in fila["total"].items() if p in seleccion},
+                "sucursales": {
+                    suc: celdas for suc, celdas in (
+                        (suc, {p: v for p, v in valores.items() if p in seleccion})
+                        for suc, valores in fila["sucursales"].items()
+                    ) if celdas
+                }
+            }
+            for fila in result["data"][row_offset:fin]
+        ]
+        return window
+
+    filas = _tabla(result).iloc[row_offset:fin, posiciones]
+    nombres = filas.index.tolist()
+    if sparse:
+        valores = filas.to_numpy()
+        i, j = np.nonzero(valores)  # row-major, same order as walking the rows
+        window["encoding"] = "sparse"
+        window["rows"] = nombres
+        window["cells"] = [[a, b, v] for a, b, v in zip(i.tolist(), j.tolist(), valores[i, j].tolist())]
+        window["data"] = []
+    elif layout == LAYOUT_COLUMNAR:
+        # Column-major matrix: each period column is a contiguous float64 array for orjson
+        matriz = np.asfortranarray(filas.to_numpy(dtype='float64'))
+        window["encoding"] = "columnar"
+        window["data"] = {
+            "columns": [row_key] + columns,
+            "data": {row_key: nombres, **{c: matriz[:, j] for j, c in enumerate(columns)}}
+        }
+    else:
+        window["data"] = [
+            {row_key: nombre, **dict(zip(columns, valores))}
+            for nombre, valores in zip(nombres, filas.to_numpy().tolist())
+        ]
+    return window
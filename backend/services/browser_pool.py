@@ -0,0 +1,125 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from playwright.async_api import async_playwright
+
+# One warm Chromium for the whole app; each job gets its own isolated context (cookies, storage)
+BROWSER_CONTEXTS = int(os.getenv("WANSOFT_BROWSER_CONTEXTS", "4"))
+# Seconds between health checks of the shared browser
+HEALTH_INTERVAL = 30
+LAUNCH_ARGS = ["--disable-dev-shm-usage", "--no-first-run"]
+
+class NavegadorCompartido:
+    """
+    Chromium de vida de la aplicacion. Lanzado una vez (startup o primer uso) y relanzado
+    si se cae; contextos aislados de un pool acotado (max `max_contextos` a la vez).
+    """
+    def __init__(self, max_contextos: int):
+        self.max_contextos = max(1, max_contextos)
+        self._playwright = None
+        self._browser = None
+        self._semaforo = None
+        self._lock = None
+        self._vigilante = None
+        self.activos = 0
+        self.lanzamientos = 0
+
+    def _primitivas(self):
+        # Created on first use, inside the running event loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+            self._semaforo = asyncio.Semaphore(self.max_contextos)
+
+    async def _navegador(self):
+        self._primitivas()
+        async with self._lock:
+            if self._browser is not None and self._browser.is_connected():
+                return self._browser
+            if self._browser is not None:
+                print("[NAVEGADOR] Chromium desconectado, relanzando...")
+            await self._cerrar_navegador()
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+            self._browser = await self._playwright.chromium.launch(headless=True, args=LAUNCH_ARGS)
+            self.lanzamientos += 1
+            print(f"[NAVEGADOR] Chromium listo (lanzamiento {self.lanzamientos})")
+            return self._browser
+
+    async def _cerrar_navegador(self):
+        browser, self._browser = self._browser, None
+        if browser is not None:
+            try:
+                await browser.close()
+            except Exception:
+                pass
+
+    @asynccontextmanager
+    async def contexto(self, **opciones):
+        """
+        Contexto aislado del navegador compartido; se cierra al salir.
+        Waits for a free slot when `max_contextos` are already in use.
+        """
+        self._primitivas()
+        async with self._semaforo:
+            browser = await self._navegador()
+            try:
+                context = await browser.new_context(**opciones)
+            except Exception:
+                if browser.is_connected():
+                    raise
+                # Died between the check and new_context: relaunch once
+                browser = await self._navegador()
+                context = await browser.new_context(**opciones)
+            self.activos += 1
+            try:
+                yield context
+            finally:
+                self.activos -= 1
+                try:
+                    await context.close()
+                except Exception:
+                    pass
+
+    async def _vigilar(self):
+        while True:
+            await asyncio.sleep(HEALTH_INTERVAL)
+            # Only once it was up: a browser that never launched is retried by the next job
+            if self.lanzamientos and not (self._browser is not None and self._browser.is_connected()):
+                try:
+                    await self._navegador()
+                except Exception as e:
+                    print(f"[NAVEGADOR] No se pudo relanzar Chromium: {e}")
+
+    async def iniciar(self):
+        """
+        Lanza Chromium por adelantado (startup) y arranca el health check.
+        A failed launch is only logged: the first job tries again.
+        """
+        if self._vigilante is None:
+            self._vigilante = asyncio.create_task(self._vigilar())
+        try:
+            await self._navegador()
+        except Exception as e:
+            print(f"[NAVEGADOR] Chromium no disponible al iniciar: {e}")
+
+    async def cerrar(self):
+        if self._vigilante is not None:
+            self._vigilante.cancel()
+            self._vigilante = None
+        await self._cerrar_navegador()
+        if self._playwright is not None:
+            try:
+                await self._playwright.stop()
+            except Exception:
+                pass
+            self._playwright = None
+
+    def estado(self) -> dict:
+        return {
+            "conectado": self._browser is not None and self._browser.is_connected(),
+            "contextos_activos": self.activos,
+            "max_contextos": self.max_contextos,
+            "lanzamientos": self.lanzamientos
+        }
+
+navegador = NavegadorCompartido(BROWSER_CONTEXTS)
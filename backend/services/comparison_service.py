@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+from typing import Optional
+from services.forecast_service import construir_cubo_diario
+from services.json_response import tabla_json, LAYOUT_RECORDS
+
+VENTANAS_MOVILES = (7, 28)
+
+def _sumas_ventana(cs: np.ndarray, inicio: int, fin: int) -> np.ndarray:
+    # Sum of days [inicio, fin) from a cumulative sum padded with a leading 0 column
+    n_dias = cs.shape[1] - 1
+    inicio, fin = max(inicio, 0), min(fin, n_dias)
+    if fin <= inicio:
+        return np.zeros(cs.shape[0])
+    return cs[:, fin] - cs[:, inicio]
+
+def _delta_pct(actual, anterior):
+    return np.where(anterior != 0, (actual - anterior) / np.where(anterior != 0, anterior, 1) * 100, np.nan)
+
+def compute_period_metrics(
+    df: pd.DataFrame,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    compare_to: str = 'previous',
+    layout: str = LAYOUT_RECORDS
+):
+    """
+    Comparativo contra el periodo anterior (o el mismo periodo del año pasado) y
+    promedios moviles de 7 y 28 dias por producto y sucursal.
+    `df` must still contain the history outside [start_date, end_date]; everything is
+    read from one daily aggregate with cumulative sums, no per-period regrouping.
+    """
+    if df.empty:
+        return None, None
+
+    cubo, series, fechas = construir_cubo_diario(
+        df, ['Unidades_Reales', 'Total_Venta'], claves=('Producto_Normalizado', 'Sucursal')
+    )
+    if cubo is None:
+        return None, None
+
+    origen = fechas[0]
+    actual_ini = pd.Timestamp(start_date).normalize() if start_date else fechas[0]
+    actual_fin = pd.Timestamp(end_date).normalize() if end_date else fechas[-1]
+    largo = (actual_fin - actual_ini).days + 1
+
+    if compare_to == 'year':
+        anterior_ini = actual_ini - pd.DateOffset(years=1)
+        anterior_fin = actual_fin - pd.DateOffset(years=1)
+    else:
+        compare_to = 'previous'
+        anterior_fin = actual_ini - pd.Timedelta(days=1)
+        anterior_ini = anterior_fin - pd.Timedelta(days=largo - 1)
+
+    def idx(fecha):
+        return (fecha - origen).days
+
+    U, V = cubo['Unidades_Reales'], cubo['Total_Venta']
+    cs_u = np.pad(np.cumsum(U, axis=1), ((0, 0), (1, 0)))
+    cs_v = np.pad(np.cumsum(V, axis=1), ((0, 0), (1, 0)))
+
+    a0, a1 = idx(actual_ini), idx(actual_fin) + 1
+    p0, p1 = idx(anterior_ini), idx(anterior_fin) + 1
+    u_act, u_ant = _sumas_ventana(cs_u, a0, a1), _sumas_ventana(cs_u, p0, p1)
+    v_act, v_ant = _sumas_ventana(cs_v, a0, a1), _sumas_ventana(cs_v, p0, p1)
+
+    # Days of the previous window actually covered by the uploaded history
+    dias_anterior = max(0, min(p1, len(fechas)) - max(p0, 0))
+
+    tabla = pd.DataFrame({
+        'Producto_Normalizado': series.get_level_values(0),
+        'Sucursal': series.get_level_values(1),
+        'Unidades_Actual': u_act,
+        'Unidades_Anterior': u_ant,
+        'Delta_Unidades': u_act - u_ant,
+        'Delta_Unidades_Pct': _delta_pct(u_act, u_ant),
+        'Venta_Actual': v_act,
+        'Venta_Anterior': v_ant,
+        'Delta_Venta': v_act - v_ant,
+        'Delta_Venta_Pct': _delta_pct(v_act, v_ant)
+    }).round(2)
+    tabla = tabla[(tabla['Unidades_Actual'] != 0) | (tabla['Unidades_Anterior'] != 0) |
+                  (tabla['Venta_Actual'] != 0) | (tabla['Venta_Anterior'] != 0)]
+    tabla = tabla.sort_values(['Producto_Normalizado', 'Sucursal'])
+    if layout == LAYOUT_RECORDS:
+        tabla = tabla.astype(object).where(tabla.notna(), None)
+
+    tot_u_act, tot_u_ant = float(u_act.sum()), float(u_ant.sum())
+    tot_v_act, tot_v_ant = float(v_act.sum()), float(v_ant.sum())
+    comparison = {
+        "compare_to": compare_to,
+        "current": {"start": actual_ini.strftime('%Y-%m-%d'), "end": actual_fin.strftime('%Y-%m-%d')},
+        "previous": {
+            "start": anterior_ini.strftime('%Y-%m-%d'),
+            "end": anterior_fin.strftime('%Y-%m-%d'),
+            "days_with_data": int(dias_anterior)
+        },
+        "totals": {
+            "units_current": round(tot_u_act, 2),
+            "units_previous": round(tot_u_ant, 2),
+            "units_delta": round(tot_u_act - tot_u_ant, 2),
+            "units_delta_pct": round((tot_u_act - tot_u_ant) / tot_u_ant * 100, 2) if tot_u_ant else None,
+            "sales_current": round(tot_v_act, 2),
+            "sales_previous": round(tot_v_ant, 2),
+            "sales_delta": round(tot_v_act - tot_v_ant, 2),
+            "sales_delta_pct": round((tot_v_act - tot_v_ant) / tot_v_ant * 100, 2) if tot_v_ant else None
+        },
+        "rows": tabla_json(tabla, layout)
+    }
+
+    # Rolling averages over the current window; days before it (when uploaded) fill the window
+    a0c, a1c = max(a0, 0), min(a1, len(fechas))
+    rolling = {"dates": [], "series": []}
+    if a1c > a0c:
+        t = np.arange(a0c, a1c)
+        medias = {}
+        for k in VENTANAS_MOVILES:
+            desde = np.maximum(t + 1 - k, 0)
+            medias[k] = (cs_u[:, t + 1] - cs_u[:, desde]) / (t + 1 - desde)
+
+        activas = np.flatnonzero(U[:, a0c:a1c].any(axis=1))
+        rolling["dates"] = fechas[a0c:a1c].strftime('%Y-%m-%d').tolist()
+        rolling["series"] = [
+            {
+                "Producto_Normalizado": series[i][0],
+                "Sucursal": series[i][1],
+                **{f"ma{k}": np.round(medias[k][i], 2).tolist() for k in VENTANAS_MOVILES}
+            }
+            for i in activas
+        ]
+
+    return comparison, rolling
@@ -0,0 +1,225 @@
+import zlib
+import pandas as pd
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from services.json_response import acepta_codificacion
+
+# Rows rendered per chunk: bounded memory, first bytes go out right away
+CSV_CHUNK_ROWS = 10000
+GZIP_LEVEL = 6
+
+def iter_csv(df: pd.DataFrame, chunk_rows: int = CSV_CHUNK_ROWS):
+    """
+    Genera el CSV por bloques de filas (bytes). The first block carries the
+    header and the UTF-8 BOM so Excel opens accents correctly.
+    """
+    if df.empty:
+        yield df.to_csv(index=False).encode('utf-8-sig')
+        return
+    for start in range(0, len(df), chunk_rows):
+        first = start == 0
+        chunk = df.iloc[start:start + chunk_rows].to_csv(index=False, header=first)
+        yield chunk.encode('utf-8-sig' if first else 'utf-8')
+
+def iter_gzip(chunks, level: int = GZIP_LEVEL):
+    """
+    Comprime un iterador de bytes como un solo stream gzip.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+def csv_streaming_response(df: pd.DataFrame, filename: str, request: Request = None) -> StreamingResponse:
+    """
+    Respuesta CSV en streaming; gzip (Content-Encoding) si el cliente lo acepta.
+    """
+    body = iter_csv(df)
+    headers = {"Content-Disposition": f"attachment; filename={filename}", "Vary": "Accept-Encoding"}
+    if acepta_codificacion(request, 'gzip'):
+        body = iter_gzip(body)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type="text/csv", headers=headers)
+
+# --- XLSX ---
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+# Spooled files stay in RAM up to this size, then move to disk
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+STREAM_CHUNK_BYTES = 256 * 1024
+
+# Preset number formats by column name; anything else by dtype
+FORMATOS_COLUMNA = {
+    'Total_Venta': '#,##0.00',
+    'Venta_Actual': '#,##0.00',
+    'Venta_Anterior': '#,##0.00',
+    'Delta_Venta': '#,##0.00',
+    'Cantidad': '#,##0.##',
+    'Unidades_Reales': '#,##0.##',
+    'Fecha': 'yyyy-mm-dd',
+}
+FORMATO_FECHA = 'yyyy-mm-dd'
+FORMATO_NUMERO = '#,##0.##'
+
+XLSX_CHUNK_ROWS = 10000
+
+def _vacio(v):
+    return v is None or v is pd.NA or (isinstance(v, float) and v != v)
+
+def _fechas(serie):
+    return [None if pd.isna(v) else v.to_pydatetime() for v in serie]
+
+def _lista(serie):
+    return serie.tolist()
+
+def _numeros(serie):
+    return serie.astype('float64').tolist()
+
+def _textos(serie):
+    return [None if _vacio(v) else v for v in serie.tolist()]
+
+def _mixtos(serie):
+    # Mixed object column (e.g. a TOTAL label among numbers): numbers stay numeric
+    return [
+        None if _vacio(v)
+        else v if isinstance(v, (int, float, bool))
+        else str(v)
+        for v in serie.tolist()
+    ]
+
+def _preparar_columna(serie: pd.Series, workbook, ws, formatos):
+    """
+    (conversion, metodo de escritura, formato) para una columna, decididos una sola vez.
+    The conversion turns one block of rows of the column into Python values.
+    """
+    fmt_name = FORMATOS_COLUMNA.get(str(serie.name))
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        fmt_name = fmt_name or FORMATO_FECHA
+        convertir, write = _fechas, ws.write_datetime
+    elif pd.api.types.is_bool_dtype(serie):
+        convertir, write = _lista, ws.write_boolean
+        fmt_name = None
+    elif pd.api.types.is_numeric_dtype(serie):
+        fmt_name = fmt_name or FORMATO_NUMERO
+        convertir, write = _numeros, ws.write_number
+    elif pd.api.types.infer_dtype(serie, skipna=True) in ('string', 'empty'):
+        convertir, write = _textos, ws.write_string
+        fmt_name = None
+    else:
+        convertir, write = _mixtos, ws.write
+        fmt_name = None
+
+    if fmt_name and fmt_name not in formatos:
+        formatos[fmt_name] = workbook.add_format({'num_format': fmt_name})
+    return convertir, write, formatos.get(fmt_name) if fmt_name else None
+
+def escribir_xlsx(hojas: dict, destino):
+    """
+    Escribe {nombre_hoja: DataFrame} con xlsxwriter en modo constant_memory
+    (filas en orden, sin mantener el libro completo en memoria). Cells are converted
+    to Python values XLSX_CHUNK_ROWS rows at a time, never the whole frame.
+    `destino` is a path or a binary file object.
+    """
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(destino, {'constant_memory': True, 'strings_to_urls': False})
+    formatos = {}
+    header_fmt = workbook.add_format({'bold': True})
+    try:
+        for sheet_name, df in hojas.items():
+            ws = workbook.add_worksheet(str(sheet_name)[:31])
+            columnas = [_preparar_columna(df.iloc[:, c], workbook, ws, formatos) for c in range(df.shape[1])]
+
+            for c, nombre in enumerate(df.columns):
+                ws.set_column(c, c, max(10, min(len(str(nombre)) + 2, 40)))
+                ws.write_string(0, c, str(nombre), header_fmt)
+
+            writers = [(c, write, fmt) for c, (_, write, fmt) in enumerate(columnas)]
+            for inicio in range(0, len(df), XLSX_CHUNK_ROWS):
+                bloque = df.iloc[inicio:inicio + XLSX_CHUNK_ROWS]
+                valores = [convertir(bloque.iloc[:, c]) for c, (convertir, _, _) in enumerate(columnas)]
+                for r, fila in enumerate(zip(*valores), start=inicio + 1):
+                    for (c, write, fmt), v in zip(writers, fila):
+                        if v is None or v != v:  # None / NaN -> empty cell
+                            continue
+                        write(r, c, v, fmt)
+    finally:
+        workbook.close()
+
+def iter_archivo(fileobj, chunk_bytes: int = STREAM_CHUNK_BYTES):
+    """
+    Lee un archivo temporal por bloques y lo cierra al terminar (o si se cancela la descarga).
+    """
+    try:
+        fileobj.seek(0)
+        while True:
+            chunk = fileobj.read(chunk_bytes)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        fileobj.close()
+
+def xlsx_spooled(hojas: dict):
+    """
+    Libro xlsx en un SpooledTemporaryFile (RAM hasta SPOOL_MAX_BYTES, luego disco).
+    """
+    import tempfile
+
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    try:
+        escribir_xlsx(hojas, spool)
+    except Exception:
+        spool.close()
+        raise
+    return spool
+
+def xlsx_streaming_response(hojas, filename: str) -> StreamingResponse:
+    """
+    Respuesta xlsx en streaming. `hojas` is a DataFrame (single "Sheet1") or {sheet: DataFrame}.
+    """
+    if isinstance(hojas, pd.DataFrame):
+        hojas = {"Sheet1": hojas}
+    spool = xlsx_spooled(hojas)
+    headers = {"Content-Disposition": f"attachment; filename={filename}"}
+    return StreamingResponse(iter_archivo(spool), media_type=XLSX_MEDIA_TYPE, headers=headers)
+
+# --- Parquet / Arrow IPC ---
+FORMATOS_COLUMNARES = {
+    # format -> (extension, media type)
+    'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('.arrow', 'application/vnd.apache.arrow.file'),
+}
+PARQUET_COMPRESSION = 'zstd'
+
+def escribir_columnar(df: pd.DataFrame, destino, formato: str):
+    """
+    Escribe el DataFrame como Parquet (zstd) o Arrow IPC file, keeping pandas dtypes
+    (datetimes, categories) in the schema.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if formato == 'parquet':
+        pq.write_table(table, destino, compression=PARQUET_COMPRESSION)
+    else:
+        with pa.ipc.new_file(destino, table.schema) as writer:
+            writer.write_table(table)
+
+def columnar_streaming_response(df: pd.DataFrame, filename: str, formato: str) -> StreamingResponse:
+    """
+    Respuesta Parquet / Arrow en streaming desde un archivo temporal. `filename` without extension.
+    """
+    import tempfile
+
+    extension, media_type = FORMATOS_COLUMNARES[formato]
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    try:
+        escribir_columnar(df, spool, formato)
+    except Exception:
+        spool.close()
+        raise
+    headers = {"Content-Disposition": f"attachment; filename={filename}{extension}"}
+    return StreamingResponse(iter_archivo(spool), media_type=media_type, headers=headers)
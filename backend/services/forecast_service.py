@@ -0,0 +1,136 @@
+import numpy as np
+import pandas as pd
+from typing import Optional
+from services.analysis_cleaner import NORMALIZADO_A_PRODUCCION
+
+SEASON = 7  # weekday seasonality
+# Small smoothing grid, evaluated for every series at once; the best pair per series wins
+ALPHAS = np.array([0.05, 0.1, 0.2, 0.3, 0.5])
+GAMMAS = np.array([0.05, 0.15, 0.3])
+MIN_DIAS_MODELO = 2 * SEASON
+
+def construir_cubo_diario(df: pd.DataFrame, columnas, claves=('Sucursal', 'Producto_Normalizado')):
+    """
+    Agregado diario de varias columnas en una sola pasada: {columna: matriz
+    (series x dias)}, una serie por combinacion de `claves`. Days without sales are 0.
+    """
+    fechas = pd.to_datetime(df['Fecha'], errors='coerce').dt.normalize()
+    valid = fechas.notna().to_numpy()
+    df = df.loc[valid]
+    fechas = fechas[valid]
+    if df.empty:
+        return None, None, None
+
+    inicio = fechas.min()
+    dia = (fechas - inicio).dt.days.to_numpy()
+    n_dias = int(dia.max()) + 1
+
+    keys = pd.MultiIndex.from_arrays([df[c].astype(str) for c in claves])
+    serie, series = keys.factorize()
+    n_series = len(series)
+    celda = serie * n_dias + dia
+
+    cubo = {
+        col: np.bincount(
+            celda,
+            weights=df[col].to_numpy(dtype=np.float64),
+            minlength=n_series * n_dias
+        ).reshape(n_series, n_dias)
+        for col in columnas
+    }
+
+    fechas_hist = pd.date_range(inicio, periods=n_dias, freq='D')
+    return cubo, series, fechas_hist
+
+def construir_matriz_diaria(df: pd.DataFrame):
+    """
+    Historial diario de Unidades_Reales como matriz (series x dias), una serie
+    por (Sucursal, Producto_Normalizado).
+    """
+    cubo, series, fechas_hist = construir_cubo_diario(df, ['Unidades_Reales'])
+    if cubo is None:
+        return None, None, None
+    return cubo['Unidades_Reales'], series, fechas_hist
+
+def ajustar_holt_winters(Y: np.ndarray):
+    """
+    Suavizamiento exponencial con estacionalidad semanal (aditivo, sin tendencia)
+    ajustado para todas las series a la vez.
+    Arrays are (grid, series[, season]); the only Python loop is over days.
+    Returns level (series,) and season (series, 7) aligned to day index % 7.
+    """
+    n_series, n_dias = Y.shape
+    alpha = np.repeat(ALPHAS, len(GAMMAS))[:, None]
+    gamma = np.tile(GAMMAS, len(ALPHAS))[:, None]
+    n_grid = alpha.shape[0]
+
+    # Initial state from the first full week
+    nivel0 = Y[:, :SEASON].mean(axis=1)
+    nivel = np.broadcast_to(nivel0, (n_grid, n_series)).copy()
+    estacion = np.broadcast_to(Y[:, :SEASON] - nivel0[:, None], (n_grid, n_series, SEASON)).copy()
+    sse = np.zeros((n_grid, n_series))
+
+    for t in range(SEASON, n_dias):
+        s = t % SEASON
+        error = Y[:, t] - (nivel + estacion[:, :, s])
+        sse += error * error
+        nivel += alpha * error
+        estacion[:, :, s] += gamma * error
+
+    best = sse.argmin(axis=0)
+    cols = np.arange(n_series)
+    return nivel[best, cols], estacion[best, cols]
+
+def pronosticar_demanda(df: pd.DataFrame, horizon: int = 7, start_date: Optional[str] = None):
+    """
+    Pronostico diario por (Sucursal, Producto_Normalizado) para los siguientes
+    `horizon` dias, y su agregado en la rejilla Fecha/Tipo_Tamal/Guiso de produccion.
+    """
+    Y, series, fechas_hist = construir_matriz_diaria(df)
+    if Y is None:
+        return pd.DataFrame(), pd.DataFrame()
+
+    n_dias = Y.shape[1]
+    ultimo = fechas_hist[-1]
+    inicio = pd.Timestamp(start_date).normalize() if start_date else ultimo + pd.Timedelta(days=1)
+    if inicio <= ultimo:
+        inicio = ultimo + pd.Timedelta(days=1)
+    offset = (inicio - fechas_hist[0]).days  # day index of the first forecast day
+    t_futuro = offset + np.arange(horizon)
+
+    if n_dias >= MIN_DIAS_MODELO:
+        nivel, estacion = ajustar_holt_winters(Y)
+        pred = nivel[:, None] + estacion[:, t_futuro % SEASON]
+    else:
+        # Too short for smoothing: mean per weekday position
+        medias = np.zeros((Y.shape[0], SEASON))
+        for s in range(SEASON):
+            dias_s = Y[:, s::SEASON]
+            if dias_s.shape[1]:
+                medias[:, s] = dias_s.mean(axis=1)
+        pred = medias[:, t_futuro % SEASON]
+
+    pred = np.clip(pred, 0, None)
+    fechas = pd.date_range(inicio, periods=horizon, freq='D')
+
+    detalle = pd.DataFrame({
+        'Sucursal': np.repeat(series.get_level_values(0).to_numpy(), horizon),
+        'Producto_Normalizado': np.repeat(series.get_level_values(1).to_numpy(), horizon),
+        'Fecha': np.tile(fechas.to_numpy(), len(series)),
+        'Unidades_Pronostico': pred.ravel().round(1)
+    })
+
+    # Production grid: only tamales that exist in the production sheets
+    prod = detalle[detalle['Producto_Normalizado'].isin(NORMALIZADO_A_PRODUCCION.keys())]
+    claves = prod['Producto_Normalizado'].map(NORMALIZADO_A_PRODUCCION)
+    produccion = pd.DataFrame({
+        'Fecha': prod['Fecha'].to_numpy(),
+        'Tipo_Tamal': claves.str[0].to_numpy(),
+        'Guiso': claves.str[1].to_numpy(),
+        'Cantidad': prod['Unidades_Pronostico'].to_numpy()
+    })
+    produccion = produccion.groupby(['Fecha', 'Tipo_Tamal', 'Guiso'], as_index=False)['Cantidad'].sum()
+    produccion['Cantidad'] = np.ceil(produccion['Cantidad']).astype(int)
+    produccion.sort_values(by=['Fecha', 'Tipo_Tamal', 'Guiso'], inplace=True)
+
+    return produccion, detalle
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+
+DIAS_SEMANA = ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo']
+SLOT_MINUTES_VALIDOS = (15, 30, 60)
+
+def _parse_minutos(horas: pd.Series) -> np.ndarray:
+    # 'Hora_Venta' comes as 'HH:MM' from formatear_hora_sql; anything else -> -1
+    partes = horas.astype(str).str.extract(r'(\d{1,2}):(\d{2})')
+    h = pd.to_numeric(partes[0], errors='coerce')
+    m = pd.to_numeric(partes[1], errors='coerce')
+    minutos = (h * 60 + m).where((h < 24) & (m < 60))
+    return minutos.fillna(-1).to_numpy(dtype=np.int64)
+
+def compute_demand_heatmap(df: pd.DataFrame, slot_minutes: int = 60, by_product: bool = False):
+    """
+    Mapa de calor de demanda: franja horaria x dia de la semana x sucursal
+    (opcionalmente x producto).
+    Every row is reduced to a single integer cell index and summed with
+    np.bincount, so there is no groupby over string keys.
+    """
+    if slot_minutes not in SLOT_MINUTES_VALIDOS:
+        slot_minutes = 60
+    n_slots = (24 * 60) // slot_minutes
+
+    result = {
+        "slot_minutes": slot_minutes,
+        "slots": [],
+        "weekdays": DIAS_SEMANA,
+        "series": []
+    }
+    if df.empty or 'Hora_Venta' not in df.columns:
+        return result
+
+    fechas = pd.to_datetime(df['Fecha'], errors='coerce')
+    minutos = _parse_minutos(df['Hora_Venta'])
+    valid = fechas.notna().to_numpy() & (minutos >= 0)
+    if not valid.any():
+        return result
+
+    dia = fechas.dt.dayofweek.to_numpy()[valid].astype(np.int64)
+    slot = minutos[valid] // slot_minutes
+
+    suc_codes, suc_labels = pd.factorize(df['Sucursal'].astype(str).to_numpy()[valid], sort=True)
+    if by_product:
+        prod_codes, prod_labels = pd.factorize(df['Producto_Normalizado'].astype(str).to_numpy()[valid], sort=True)
+    else:
+        prod_codes, prod_labels = np.zeros(len(slot), dtype=np.int64), [None]
+
+    n_suc, n_prod = len(suc_labels), len(prod_labels)
+    cell = ((suc_codes * n_prod + prod_codes) * 7 + dia) * n_slots + slot
+    size = n_suc * n_prod * 7 * n_slots
+
+    # Packages would double count units (wrapper + content), same rule as product_mix
+    unidades = df['Unidades_Reales'].to_numpy(dtype=np.float64)[valid]
+    if 'Categoria' in df.columns:
+        unidades = np.where(df['Categoria'].to_numpy()[valid] == 'Paquete', 0.0, unidades)
+    ventas = df['Total_Venta'].to_numpy(dtype=np.float64)[valid]
+
+    units = np.bincount(cell, weights=unidades, minlength=size).reshape(n_suc, n_prod, 7, n_slots)
+    sales = np.bincount(cell, weights=ventas, minlength=size).reshape(n_suc, n_prod, 7, n_slots)
+
+    # Trim to the active hours so the UI does not render empty night rows
+    activos = np.flatnonzero(np.bincount(slot, minlength=n_slots))
+    first, last = int(activos[0]), int(activos[-1]) + 1
+    units = units[..., first:last]
+    sales = sales[..., first:last]
+    result["slots"] = [f"{(s * slot_minutes) // 60:02d}:{(s * slot_minutes) % 60:02d}" for s in range(first, last)]
+
+    def build_series(sucursal, producto, u, s):
+        return {
+            "sucursal": sucursal,
+            "producto": producto,
+            "units": np.round(u, 2).tolist(),
+            "sales": np.round(s, 2).tolist()
+        }
+
+    # Total over all sucursales first, then one entry per sucursal (and product)
+    for p_idx, producto in enumerate(prod_labels):
+        u_tot = units[:, p_idx].sum(axis=0)
+        if u_tot.any() or sales[:, p_idx].any():
+            result["series"].append(build_series("TODAS", producto, u_tot, sales[:, p_idx].sum(axis=0)))
+
+    for s_idx, sucursal in enumerate(suc_labels):
+        for p_idx, producto in enumerate(prod_labels):
+            u, s = units[s_idx, p_idx], sales[s_idx, p_idx]
+            if u.any() or s.any():
+                result["series"].append(build_series(sucursal, producto, u, s))
+
+    return result
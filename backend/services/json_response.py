@@ -0,0 +1,158 @@
+import gzip
+import numpy as np
+import orjson
+import pandas as pd
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+from services.result_cache import fingerprint
+
+# Table layouts accepted by the JSON endpoints (form field `layout`)
+LAYOUT_RECORDS = "records"    # [{col: value, ...}, ...] (default, what the frontend reads)
+LAYOUT_COLUMNAR = "columnar"  # {columns: [...], data: {col: [...]}}
+LAYOUTS = (LAYOUT_RECORDS, LAYOUT_COLUMNAR)
+
+def _default(value):
+    # Whatever orjson does not handle natively (pandas scalars, object arrays)
+    if value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON con orjson: NumPy arrays are written straight from their buffers and the
+    content skips FastAPI's jsonable_encoder walk (return the response directly).
+    NaN / inf become null.
+    """
+    def render(self, content) -> bytes:
+        return orjson.dumps(
+            content,
+            default=_default,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        )
+
+def columna_json(serie: pd.Series):
+    """
+    Valores de una columna listos para orjson: numeric/bool columns stay as NumPy arrays,
+    dates become 'YYYY-MM-DD' strings and everything else a list with None for missing.
+    """
+    if pd.api.types.is_bool_dtype(serie) and not serie.hasnans:
+        return np.ascontiguousarray(serie.to_numpy(dtype=bool))
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        if pd.api.types.is_integer_dtype(serie) and not serie.hasnans:
+            return np.ascontiguousarray(serie.to_numpy(dtype='int64'))
+        return np.ascontiguousarray(serie.to_numpy(dtype='float64', na_value=np.nan))
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie.dt.strftime('%Y-%m-%d').astype(object).where(serie.notna(), None).tolist()
+    return serie.astype(object).where(serie.notna(), None).tolist()
+
+def tabla_json(df: pd.DataFrame, layout: str = LAYOUT_RECORDS):
+    """
+    DataFrame -> tabla JSON en el layout pedido.
+    """
+    if layout == LAYOUT_COLUMNAR:
+        columns = [str(c) for c in df.columns]
+        return {
+            "columns": columns,
+            "data": {name: columna_json(df[c]) for name, c in zip(columns, df.columns)}
+        }
+    return df.to_dict(orient='records')
+
+# --- Conditional responses (ETag) and compression ---
+COMPRESS_MIN_BYTES = 4096
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+def crear_etag(*parts) -> str:
+    """
+    ETag debil a partir de los insumos del resultado (hash de datos + filtros).
+    Weak because the same tag covers the identity, gzip and br bodies.
+    """
+    return f'W/"{fingerprint(*parts)[:32]}"'
+
+def etag_coincide(request: Request, etag: str) -> bool:
+    if request is None or not etag:
+        return False
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    candidatos = [c.strip() for c in header.split(',')]
+    # Weak comparison, as RFC 9110 asks for If-None-Match
+    etag = etag.removeprefix('W/')
+    return '*' in candidatos or any(c.removeprefix('W/') == etag for c in candidatos)
+
+def _codificaciones(request: Request) -> dict:
+    # Accept-Encoding -> {encoding: q}
+    aceptadas = {}
+    for item in request.headers.get('accept-encoding', '').lower().split(','):
+        nombre, *params = [p.strip() for p in item.split(';')]
+        if not nombre:
+            continue
+        q = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        aceptadas[nombre] = q
+    return aceptadas
+
+def acepta_codificacion(request: Request, codificacion: str) -> bool:
+    """
+    True si Accept-Encoding admite la codificacion con q > 0 ('gzip;q=0' means no gzip;
+    '*' covers anything not listed).
+    """
+    if request is None:
+        return False
+    aceptadas = _codificaciones(request)
+    return aceptadas.get(codificacion, aceptadas.get('*', 0)) > 0
+
+def elegir_codificacion(request: Request):
+    """
+    'br', 'gzip' o None segun Accept-Encoding (brotli first when installed).
+    """
+    if brotli is not None and acepta_codificacion(request, 'br'):
+        return 'br'
+    if acepta_codificacion(request, 'gzip'):
+        return 'gzip'
+    return None
+
+def no_modificado(etag: str) -> Response:
+    return Response(status_code=304, headers={
+        "ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept-Encoding"
+    })
+
+def json_negociado(content, request: Request = None, etag: str = None) -> Response:
+    """
+    JSON (orjson) con ETag y compresion negociada (br / gzip) para cuerpos grandes.
+    Returns 304 when the client already has this ETag.
+    """
+    # The body depends on Accept-Encoding on every path (including 304s and small bodies)
+    headers = {"Vary": "Accept-Encoding"}
+    if etag:
+        if etag_coincide(request, etag):
+            return no_modificado(etag)
+        headers["ETag"] = etag
+        headers["Cache-Control"] = "private, no-cache"
+
+    body = FastJSONResponse(content).body
+    if request is not None:
+        codificacion = elegir_codificacion(request) if len(body) >= COMPRESS_MIN_BYTES else None
+        if codificacion == 'br':
+            body = brotli.compress(body, quality=BROTLI_QUALITY)
+            headers["Content-Encoding"] = "br"
+        elif codificacion == 'gzip':
+            body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+            headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from services.sales_loader import cargar_ventas_limpias, tipar_ventas
+
+# Derived files of a pinned upload live in uploads/<user>/.cache/
+CACHE_DIRNAME = ".cache"
+
+def hash_archivo(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def cache_dir(file_path: str) -> str:
+    return os.path.join(os.path.dirname(file_path), CACHE_DIRNAME)
+
+def ruta_columnar(file_path: str, content_hash: str) -> str:
+    # Keyed by content, so a re-upload under the same name never reads a stale Parquet
+    return os.path.join(cache_dir(file_path), f"ventas_{content_hash}.parquet")
+
+def ruta_rollup(file_path: str, key: str) -> str:
+    return os.path.join(cache_dir(file_path), f"rollup_{key}.json")
+
+def limpiar_cache(file_path: str):
+    shutil.rmtree(cache_dir(file_path), ignore_errors=True)
+
+def _json_default(value):
+    # numpy scalars inside the computed rollups
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def guardar_rollup(file_path: str, key: str, result):
+    os.makedirs(cache_dir(file_path), exist_ok=True)
+    tmp = ruta_rollup(file_path, key) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(result, f, default=_json_default, ensure_ascii=False)
+    os.replace(tmp, ruta_rollup(file_path, key))
+
+def cargar_rollup(file_path: str, key: str):
+    path = ruta_rollup(file_path, key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Error loading rollup {path}: {e}")
+        return None
+
+def cargar_ventas_fijadas(pinned_info: dict, columns=None):
+    """
+    DataFrame de ventas limpias del archivo fijado, leido del Parquet tipado
+    (memory-mapped). None if the background cleaning has not finished.
+    """
+    if not pinned_info or pinned_info.get("clean_status") != "ready":
+        return None
+    path = pinned_info.get("clean_path")
+    if not path or not os.path.exists(path):
+        return None
+    return pd.read_parquet(path, columns=columns, memory_map=True)
+
+def preparar_archivo_fijado(pinned_info: dict, precalculos=(), publicar=None):
+    """
+    Tarea de fondo: limpia el archivo fijado una sola vez, lo guarda como Parquet
+    y ejecuta los precalculos (funciones df -> (key, result)) guardando cada rollup.
+    Runs in the BackgroundTasks threadpool, so the async loader gets its own loop.
+    pinned_info is only read here: status changes (clean_status: processing -> ready | failed)
+    go through publicar(cambios), which the caller applies where users_db is owned.
+    """
+    publicar = publicar or pinned_info.update
+    file_path = pinned_info["path"]
+    try:
+        publicar({"clean_status": "processing"})
+        with open(file_path, "rb") as f:
+            content = f.read()
+
+        df = asyncio.run(cargar_ventas_limpias([(pinned_info["filename"], content)]))
+        if df.empty:
+            publicar({"clean_status": "failed", "clean_error": "No valid sales data found in pinned file"})
+            return
+
+        df = tipar_ventas(df)
+        os.makedirs(cache_dir(file_path), exist_ok=True)
+        clean_path = ruta_columnar(file_path, pinned_info.get("content_hash") or hash_archivo(file_path))
+        df.to_parquet(clean_path + ".tmp", index=False)
+        os.replace(clean_path + ".tmp", clean_path)
+
+        publicar({"clean_path": clean_path, "rows": int(len(df)), "clean_status": "ready"})
+
+        for precalculo in precalculos:
+            try:
+                key, result = precalculo(df)
+                guardar_rollup(file_path, key, result)
+            except Exception as e:
+                print(f"Error precomputing rollup for {file_path}: {e}")
+
+    except Exception as e:
+        print(f"Error preparing pinned file {file_path}: {e}")
+        import traceback
+        traceback.print_exc()
+        publicar({"clean_status": "failed", "clean_error": str(e)})
@@ -1,8 +1,14 @@
+import multiprocessing as mp
+import os
+import threading
+import numpy as np
 import pandas as pd
 import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta
 from .utils import leer_archivo_base
-import openpyxl
+from .workbook_reader import leer_valores, nombres_hojas, ComentariosXlsx
 
 PALABRAS_CLAVE = {
     'TRA_END': ['TOTALES TRA', 'TOTALES TRADICIONAL'],
@@ -10,6 +16,10 @@ PALABRAS_CLAVE = {
     'BORR_START': ['TOTAL BORR', 'TOTALES BORR', 'TOTALES BORRACHO'],
     'BORR_END': ['TOTAL ELOTE', 'ELOTE']
 }
+# Tipo_Tamal of each block procesar_hoja reads (TRA, HP, BORR)
+TIPOS_BLOQUE = ("Tradicional", "Hoja de Platano (HP)", "Borracho")
+# Guisos with their own block after Borracho (it starts at BORR_END and is not parsed)
+GUISOS_SIN_BLOQUE = {'ELOTE'}
 
 def calcular_fecha_inicio(numero_semana):
     try:
@@ -20,41 +30,82 @@ def calcular_fecha_inicio(numero_semana):
     except ValueError:
         return None
 
+ESPACIOS = re.compile(r'\s+')
+# Single pass over the first columns: any block keyword
+PATRON_CLAVES = re.compile('|'.join(re.escape(p) for lista in PALABRAS_CLAVE.values() for p in lista))
+PATRONES_NOTA = [re.compile(r'(\d+)\s*(?:de)?\s*([a-z\.]+)'), re.compile(r'([a-z\.]+)\s*:?\s*(\d+)')]
+PALABRAS_IGNORADAS_NOTA = {'DE', 'Y', 'EL', 'LA', 'CAJAS', 'TOTAL'}
+MAPEO_GUISOS = {
+    'F': 'FRIJOL', 'FRIJOL': 'FRIJOL', 'FRIJO': 'FRIJOL',
+    'P': 'POLLO', 'POLLO': 'POLLO', 'POLL': 'POLLO',
+    'Q': 'QUESO', 'QUESO': 'QUESO', 'QUES': 'QUESO',
+    'PCO': 'PCO', 'PUERCO': 'PCO', 'CERDO': 'PCO',
+    'SV': 'SALSA VERDE', 'VERDE': 'SALSA VERDE', 'SALSA': 'SALSA VERDE',
+    'DULCE': 'DULCE', 'RAJAS': 'RAJAS', 'CHICHARRON': 'CHICHARRON',
+    'PICADILLO': 'PICADILLO'
+}
+DIAS = 7
+COLUMNAS_PRODUCCION = ['Fecha', 'Tipo_Tamal', 'Guiso', 'Cantidad']
+COL_GRID = 2 # Day i: guiso at 2 + 3i, cantidad at 3 + 3i
+MAX_PARTES_CELDA = 1024 # Sort key stride for the guisos split out of one mixed cell
+
 def limpiar_texto(texto):
     if pd.isna(texto): return ""
-    return re.sub(r'\s+', ' ', str(texto)).strip().upper()
-
-def buscar_fila_clave(df, lista_palabras, n_cols=5):
-    for col_idx in range(n_cols):
-        if col_idx >= len(df.columns): break
-        col_str = df.iloc[:, col_idx].apply(limpiar_texto)
-        for palabra in lista_palabras:
-            matches = col_str[col_str.str.contains(palabra, na=False)]
-            if not matches.empty:
-                return matches.index[0]
-    return None
+    return ESPACIOS.sub(' ', str(texto)).strip().upper()
+
+def _vacio(valor):
+    return valor is None or valor is pd.NaT or valor is pd.NA or (isinstance(valor, float) and valor != valor)
+
+def limpiar_valores(valores) -> np.ndarray:
+    """
+    limpiar_texto sobre un arreglo completo de celdas (una sola pasada).
+    Sheets are a few dozen rows, so one comprehension beats per-column pandas .str calls.
+    """
+    sub = ESPACIOS.sub
+    return np.array(["" if _vacio(v) else sub(' ', str(v)).strip().upper() for v in np.ravel(valores)], dtype=object).reshape(np.shape(valores))
+
+def localizar_bloques(valores: np.ndarray, n_cols=5) -> dict:
+    """
+    Fila de cada clave de PALABRAS_CLAVE (None si no esta). The first columns are normalized
+    once and scanned with one combined regex; the few candidate cells resolve the priority
+    of the old per-keyword search (column first, then keyword order, then row).
+    """
+    textos = limpiar_valores(valores[:, :n_cols])
+    buscar = PATRON_CLAVES.search
+    candidatas = [
+        [(fila, textos[fila, col]) for fila in range(textos.shape[0]) if buscar(textos[fila, col])]
+        for col in range(textos.shape[1])
+    ]
+    filas = {}
+    for clave, palabras in PALABRAS_CLAVE.items():
+        filas[clave] = None
+        for col in candidatas:
+            for palabra in palabras:
+                matches = [fila for fila, texto in col if palabra in texto]
+                if matches:
+                    filas[clave] = matches[0]
+                    break
+            if filas[clave] is not None:
+                break
+    return filas
+
+def clave_producible(tipo, guiso) -> bool:
+    """
+    True if procesar_hoja can emit (Tipo_Tamal, Guiso); guisos outside MAPEO_GUISOS pass through as written.
+    """
+    return tipo in TIPOS_BLOQUE and guiso not in GUISOS_SIN_BLOQUE
 
 def identificar_guiso(texto):
     t = limpiar_texto(texto).replace('.', '')
-    mapeo = {
-        'F': 'FRIJOL', 'FRIJOL': 'FRIJOL', 'FRIJO': 'FRIJOL',
-        'P': 'POLLO', 'POLLO': 'POLLO', 'POLL': 'POLLO',
-        'Q': 'QUESO', 'QUESO': 'QUESO', 'QUES': 'QUESO',
-        'PCO': 'PCO', 'PUERCO': 'PCO', 'CERDO': 'PCO',
-        'SV': 'SALSA VERDE', 'VERDE': 'SALSA VERDE', 'SALSA': 'SALSA VERDE',
-        'DULCE': 'DULCE', 'RAJAS': 'RAJAS', 'CHICHARRON': 'CHICHARRON',
-        'PICADILLO': 'PICADILLO'
-    }
-    return mapeo.get(t, t)
+    return MAPEO_GUISOS.get(t, t)
 
 def interpretar_nota(texto_nota, total_celda):
     if not texto_nota: return None
     texto = texto_nota.lower().replace('\n', ' ')
     resultados = {}
-    patrones = [r'(\d+)\s*(?:de)?\s*([a-z\.]+)', r'([a-z\.]+)\s*:?\s*(\d+)']
 
-    for p in patrones:
-        for match in re.findall(p, texto):
+    for p in PATRONES_NOTA:
+        for match in p.findall(texto):
             try:
                 cant = float(match[0])
                 palabra = match[1]
@@ -65,124 +116,286 @@ def interpretar_nota(texto_nota, total_celda):
                 except: continue
 
             guiso = identificar_guiso(palabra)
-            if guiso and guiso not in ['DE', 'Y', 'EL', 'LA', 'CAJAS', 'TOTAL']:
+            if guiso and guiso not in PALABRAS_IGNORADAS_NOTA:
                 resultados[guiso] = resultados.get(guiso, 0) + cant
 
     if resultados and abs(sum(resultados.values()) - total_celda) <= 2:
         return resultados
     return None
 
-def procesar_produccion(files_content: list):
-    datos_totales = []
+def _a_cantidad(valor):
+    try: return float(valor)
+    except: return 0.0
 
-    for filename, content in files_content:
-        # Needs to be Excel for this logic
-        if not filename.endswith(('.xlsx', '.xls')):
+def cantidades_grid(valores: np.ndarray) -> np.ndarray:
+    """
+    float() celda a celda como antes (texto numerico incluido, lo demas 0), vectorizado:
+    only cells that to_numeric cannot parse go through Python.
+    """
+    plano = valores.ravel()
+    numeros = pd.to_numeric(pd.Series(plano, dtype=object), errors='coerce').to_numpy(dtype='float64', copy=True)
+    pendientes = np.flatnonzero(np.isnan(numeros))
+    for k in pendientes:
+        if plano[k] is not None:
+            numeros[k] = _a_cantidad(plano[k])
+    return numeros.reshape(valores.shape)
+
+def numero_semana_hoja(hoja: str):
+    """
+    Numero de semana de una hoja ("SEM 12", "Sem.3", "12"), None si no es hoja semanal.
+    """
+    match = re.search(r'SEM.*?(\d+)', hoja.upper())
+    if match:
+        return int(match.group(1))
+    if hoja.strip().isdigit():
+        return int(hoja)
+    return None
+
+def procesar_hoja(data: list, hoja: str, comentarios=None):
+    """
+    Produccion de una hoja semanal en formato columnar
+    {Fecha, Tipo_Tamal, Guiso, Cantidad} (None if the sheet has no TRA/HP/BORR blocks).
+    The day grid is a (rows, 7, 3) array; mixed cells ("P/Q") are split in a small post-pass
+    using the cell comment when it adds up, else evenly.
+    """
+    num_sem = numero_semana_hoja(hoja)
+    fecha_inicio = calcular_fecha_inicio(num_sem)
+    if not data or fecha_inicio is None:
+        return None
+    # Raw cell matrix (rows padded with None), no per-column dtype inference
+    valores = np.full((len(data), max(len(fila) for fila in data)), None, dtype=object)
+    for i, fila in enumerate(data):
+        valores[i, :len(fila)] = fila
+
+    claves = localizar_bloques(valores)
+    idx_tra_end, idx_hp_start, idx_borr_start = claves['TRA_END'], claves['HP_START'], claves['BORR_START']
+    idx_borr_end = claves['BORR_END'] or len(valores)
+    if None in [idx_tra_end, idx_hp_start, idx_borr_start]:
+        return None
+
+    bloques = list(zip([
+        range(3, idx_tra_end),
+        range(idx_hp_start+1, idx_borr_start),
+        range(idx_borr_start+1, idx_borr_end)
+    ], TIPOS_BLOQUE))
+    filas = np.concatenate([np.arange(r.start, r.stop) for r, _ in bloques]).astype(int)
+    tipos = np.concatenate([np.full(len(r), tipo, dtype=object) for r, tipo in bloques])
+
+    # Rows with a name that is not a TOTAL line
+    validas = np.array([not _vacio(n) and "TOTAL" not in str(n).upper() for n in valores[filas, 0]], dtype=bool)
+    filas, tipos = filas[validas], tipos[validas]
+    if len(filas) == 0:
+        return None
+
+    # (rows, 7, 3) grid: guiso, cantidad, (unused); missing trailing columns are empty
+    ancho = COL_GRID + DIAS * 3
+    celdas = valores[filas]
+    if celdas.shape[1] < ancho:
+        celdas = np.hstack([celdas, np.full((len(filas), ancho - celdas.shape[1]), None, dtype=object)])
+    grid = celdas[:, COL_GRID:ancho].reshape(len(filas), DIAS, 3)
+
+    cantidades = cantidades_grid(grid[:, :, 1])
+    r_pos, dias = np.nonzero(cantidades > 0)
+    if len(r_pos) == 0:
+        return None
+    cant = cantidades[r_pos, dias]
+    guiso_raw = limpiar_valores(grid[r_pos, dias, 0])
+    tipo = tipos[r_pos]
+
+    # Simple cells: one guiso each, mapped once per distinct text
+    mixtas = np.array(['/' in g for g in guiso_raw], dtype=bool)
+    simples = ~mixtas
+    codigos, unicos = pd.factorize(pd.Series(guiso_raw[simples]))
+    mapeados = np.array([identificar_guiso(g if g else "DESCONOCIDO") for g in unicos], dtype=object)
+
+    orden = [np.flatnonzero(simples) * MAX_PARTES_CELDA] # cell position keeps the old record order
+    dia_col = [dias[simples]]
+    tipo_col = [tipo[simples]]
+    guiso_col = [mapeados[codigos] if len(codigos) else np.array([], dtype=object)]
+    cant_col = [cant[simples]]
+
+    # Mixed cells post-pass (a handful per sheet)
+    extra = {'orden': [], 'dia': [], 'tipo': [], 'guiso': [], 'cant': []}
+    for k in np.flatnonzero(mixtas):
+        nota = comentarios.texto(hoja, int(filas[r_pos[k]]), COL_GRID + 3 * int(dias[k])) if comentarios else None
+        desglose = interpretar_nota(nota, cant[k]) if nota else None
+        if desglose:
+            partes = list(desglose.items())
+        else:
+            nombres_partes = [p for p in guiso_raw[k].split('/') if p.strip()]
+            if nombres_partes:
+                split = round(cant[k] / len(nombres_partes), 2)
+                partes = [(identificar_guiso(p), split) for p in nombres_partes]
+            else:
+                partes = [(identificar_guiso(guiso_raw[k]), cant[k])]
+        for j, (g, c) in enumerate(partes):
+            extra['orden'].append(k * MAX_PARTES_CELDA + j)
+            extra['dia'].append(dias[k])
+            extra['tipo'].append(tipo[k])
+            extra['guiso'].append(g)
+            extra['cant'].append(c)
+
+    if extra['orden']:
+        orden.append(np.array(extra['orden']))
+        dia_col.append(np.array(extra['dia']))
+        tipo_col.append(np.array(extra['tipo'], dtype=object))
+        guiso_col.append(np.array(extra['guiso'], dtype=object))
+        cant_col.append(np.array(extra['cant'], dtype='float64'))
+
+    perm = np.argsort(np.concatenate(orden), kind='stable')
+    dias_out = np.concatenate(dia_col)[perm]
+    return {
+        'Fecha': np.datetime64(fecha_inicio, 'us') + dias_out.astype('timedelta64[D]'),
+        'Tipo_Tamal': np.concatenate(tipo_col)[perm],
+        'Guiso': np.concatenate(guiso_col)[perm],
+        'Cantidad': np.concatenate(cant_col).astype('float64')[perm]
+    }
+
+def agrupar_produccion(partes: list) -> pd.DataFrame:
+    """
+    Une las salidas columnares por hoja y agrega por (Fecha, Tipo_Tamal, Guiso).
+    """
+    partes = [p for p in partes if p is not None]
+    if not partes:
+        return pd.DataFrame()
+    df_fin = pd.DataFrame({col: np.concatenate([p[col] for p in partes]) for col in COLUMNAS_PRODUCCION})
+    df_agrupado = df_fin.groupby(['Fecha', 'Tipo_Tamal', 'Guiso'], as_index=False)['Cantidad'].sum()
+    df_agrupado.sort_values(by=['Fecha', 'Tipo_Tamal', 'Guiso'], inplace=True)
+    return df_agrupado
+
+def iter_hojas_libro(content: bytes, hojas=None):
+    """
+    (hoja, parte) de las hojas semanales de un libro, o solo de `hojas`, en el orden del libro.
+    Two phases: values of the selected sheets (no styles / comments), then comments straight
+    from the xlsx XML, only for sheets with mixed cells. A generator, so an error mid-file
+    keeps the sheets already yielded.
+    """
+    if hojas is None:
+        filtro = lambda h: numero_semana_hoja(h) is not None
+    else:
+        seleccion = set(hojas)
+        filtro = lambda h: h in seleccion
+    valores = leer_valores(content, filtro_hoja=filtro)
+    comentarios = ComentariosXlsx(content)
+    try:
+        for hoja, data in valores.items():
+            yield hoja, procesar_hoja(data, hoja, comentarios)
+    finally:
+        comentarios.close()
+
+# --- Parallel mode: weekly sheets spread over a process pool ---
+# Small default: the pool lives in the API process next to the request handlers
+WORKERS_PRODUCCION = int(os.getenv("PRODUCTION_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+MIN_HOJAS_PARALELO = 8 # Below this the pool start / pickling costs more than it saves
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _obtener_pool() -> ProcessPoolExecutor:
+    # Spawned once and reused; "spawn" is safe next to the server threads (and is Windows' only mode)
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=WORKERS_PRODUCCION, mp_context=mp.get_context("spawn"))
+        return _pool
+
+def cerrar_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+def _procesar_lote(content: bytes, hojas: list):
+    # Worker: ([(hoja, parte)], error) so one bad chunk does not lose the sheets it already parsed
+    resultados = []
+    try:
+        for hoja, parte in iter_hojas_libro(content, hojas):
+            resultados.append((hoja, parte))
+        return resultados, None
+    except Exception as e:
+        return resultados, str(e)
+
+def _lotes(hojas: list, n: int) -> list:
+    # Contiguous chunks in workbook order: one workbook open per chunk, merge order unchanged
+    tam = -(-len(hojas) // n)
+    return [hojas[i:i + tam] for i in range(0, len(hojas), tam)]
+
+def _planear_lotes(archivos: list) -> list:
+    """
+    [(filename, content, [hojas])] -> [(i_archivo, filename, content, lote)] repartiendo las hojas
+    semanales de todos los archivos entre los workers, proportional to each file's share.
+    """
+    total = sum(len(hojas) for _, _, hojas in archivos)
+    plan = []
+    for i, (filename, content, hojas) in enumerate(archivos):
+        if not hojas:
             continue
-        
-        try:
-            # We need openpyxl for comments, so we use load_workbook logic if possible
-            # But leer_archivo_base returns ExcelFile or DF. 
-            # We need to adapt logic to work with bytes -> openpyxl
-            import io
-            wb = openpyxl.load_workbook(io.BytesIO(content), data_only=True)
-            # We need comments, data_only=True removes formulas but keeps comments? 
-            # Actually data_only=True might lose comments in some versions, but usually comments are separate.
-            # But to get comments we need the cell object.
-            # Let's check the original script: it used `openpyxl.load_workbook(archivo, data_only=True)`
-            # And accessed `celda.comment`. So it works.
-            
-            for hoja in wb.sheetnames:
-                match = re.search(r'SEM.*?(\d+)', hoja.upper())
-                if not match:
-                    if hoja.strip().isdigit():
-                        num_sem = int(hoja)
-                    else:
-                        continue
-                else:
-                    num_sem = int(match.group(1))
-
-                fecha_inicio = calcular_fecha_inicio(num_sem)
-                ws = wb[hoja]
-                data = list(ws.values)
-                if not data: continue
-                df = pd.DataFrame(data)
-
-                idx_tra_end = buscar_fila_clave(df, PALABRAS_CLAVE['TRA_END'])
-                idx_hp_start = buscar_fila_clave(df, PALABRAS_CLAVE['HP_START'])
-                idx_borr_start = buscar_fila_clave(df, PALABRAS_CLAVE['BORR_START'])
-                idx_borr_end = buscar_fila_clave(df, PALABRAS_CLAVE['BORR_END']) or len(df)
-
-                if None in [idx_tra_end, idx_hp_start, idx_borr_start]:
-                    continue
-
-                bloques = [
-                    (range(3, idx_tra_end), "Tradicional"),
-                    (range(idx_hp_start+1, idx_borr_start), "Hoja de Platano (HP)"),
-                    (range(idx_borr_start+1, idx_borr_end), "Borracho")
-                ]
-
-                for rango, tipo in bloques:
-                    for r_idx in rango:
-                        fila = df.iloc[r_idx]
-                        nombre = fila[0]
-                        if pd.isna(nombre) or "TOTAL" in str(nombre).upper(): continue
-
-                        for i in range(7): # 7 días
-                            c_guiso = 2 + (i * 3)
-                            c_cant = 3 + (i * 3)
-                            if c_cant >= len(fila): continue
-
-                            try: cant = float(fila[c_cant])
-                            except: cant = 0
-
-                            if cant > 0:
-                                guiso_raw = limpiar_texto(fila[c_guiso])
-                                guiso_final = guiso_raw if guiso_raw else "DESCONOCIDO"
-                                registrado = False
-
-                                # Manejo de mezclas con notas
-                                if '/' in guiso_raw:
-                                    # Access cell for comment
-                                    # openpyxl is 1-indexed for rows/cols
-                                    celda = ws.cell(row=r_idx+1, column=c_guiso+1)
-                                    if celda.comment:
-                                        desglose = interpretar_nota(celda.comment.text, cant)
-                                        if desglose:
-                                            registrado = True
-                                            for g, c in desglose.items():
-                                                datos_totales.append({
-                                                    'Fecha': fecha_inicio + timedelta(days=i),
-                                                    'Tipo_Tamal': tipo, 'Guiso': g, 'Cantidad': c
-                                                })
-
-                                    if not registrado:
-                                        partes = [p for p in guiso_raw.split('/') if p.strip()]
-                                        if partes:
-                                            split = round(cant / len(partes), 2)
-                                            for p in partes:
-                                                datos_totales.append({
-                                                    'Fecha': fecha_inicio + timedelta(days=i),
-                                                    'Tipo_Tamal': tipo, 'Guiso': identificar_guiso(p), 'Cantidad': split
-                                                })
-                                            registrado = True
-
-                                if not registrado:
-                                    datos_totales.append({
-                                        'Fecha': fecha_inicio + timedelta(days=i),
-                                        'Tipo_Tamal': tipo,
-                                        'Guiso': identificar_guiso(guiso_final),
-                                        'Cantidad': cant
-                                    })
+        n = max(1, round(WORKERS_PRODUCCION * len(hojas) / total))
+        plan.extend((i, filename, content, lote) for lote in _lotes(hojas, n))
+    return plan
+
+def procesar_en_pool(archivos: list) -> list:
+    """
+    [(filename, content, [hojas])] -> [(i_archivo, hoja, parte)] en el orden de entrada,
+    parsing the sheets on the process pool. Raises BrokenProcessPool if a worker dies.
+    """
+    pool = _obtener_pool()
+    plan = _planear_lotes(archivos)
+    futuros = [pool.submit(_procesar_lote, content, lote) for _, _, content, lote in plan]
+    resultados = []
+    # Collected in submission order so the grouped sums match the sequential run
+    for (i, filename, _, _), futuro in zip(plan, futuros):
+        resultados_lote, error = futuro.result()
+        resultados.extend((i, hoja, parte) for hoja, parte in resultados_lote)
+        if error:
+            print(f"Error processing production file {filename}: {error}")
+    return resultados
+
+def usar_pool(n_hojas: int, paralelo=None) -> bool:
+    """
+    Si conviene el pool para n_hojas hojas (paralelo=None) o si se forzo (True / False).
+    """
+    if paralelo is False or WORKERS_PRODUCCION <= 1 or not n_hojas:
+        return False
+    return bool(paralelo) or n_hojas >= MIN_HOJAS_PARALELO
+
+def procesar_produccion(files_content: list, paralelo=None):
+    """
+    Produccion agrupada por (Fecha, Tipo_Tamal, Guiso) de uno o varios libros.
+    `paralelo`: None decides by the number of weekly sheets (MIN_HOJAS_PARALELO) and
+    available workers, True / False force the process pool / the sequential loop.
+    """
+    # Needs to be Excel for this logic
+    files_content = [(f, c) for f, c in files_content if f.endswith(('.xlsx', '.xls'))]
 
+    if paralelo is not False and WORKERS_PRODUCCION > 1:
+        archivos = []
+        for filename, content in files_content:
+            try:
+                hojas = [h for h in nombres_hojas(content) if numero_semana_hoja(h) is not None]
+            except Exception as e:
+                print(f"Error processing production file {filename}: {e}")
+                continue
+            archivos.append((filename, content, hojas))
+        files_content = [(f, c) for f, c, _ in archivos]
+
+        if usar_pool(sum(len(hojas) for _, _, hojas in archivos), paralelo):
+            try:
+                resultados = procesar_en_pool(archivos)
+                return agrupar_produccion([parte for _, _, parte in resultados])
+            except BrokenProcessPool as e:
+                # A dead worker breaks the whole pool: drop it and parse here instead
+                print(f"Production pool failed, processing sequentially: {e}")
+                cerrar_pool()
+
+    partes = []
+    for filename, content in files_content:
+        try:
+            for _, parte in iter_hojas_libro(content):
+                partes.append(parte)
         except Exception as e:
             print(f"Error processing production file {filename}: {e}")
             continue
 
-    if datos_totales:
-        df_fin = pd.DataFrame(datos_totales)
-        df_agrupado = df_fin.groupby(['Fecha', 'Tipo_Tamal', 'Guiso'], as_index=False)['Cantidad'].sum()
-        df_agrupado.sort_values(by=['Fecha', 'Tipo_Tamal', 'Guiso'], inplace=True)
-        return df_agrupado
-    
-    return pd.DataFrame()
+    return agrupar_produccion(partes)
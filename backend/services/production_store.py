@@ -0,0 +1,208 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures.process import BrokenProcessPool
+from services.result_cache import fingerprint
+from services.production_cleaner import (
+    COLUMNAS_PRODUCCION, numero_semana_hoja, procesar_hoja, agrupar_produccion,
+    usar_pool, procesar_en_pool, cerrar_pool
+)
+from services.workbook_reader import leer_valores, ComentariosXlsx
+
+# Persistent production store, one per user:
+#   indice.json       sheet hash -> {archivo, hoja, filas} + the upload's sheet sequence
+#   hojas.parquet     per-sheet parsed rows (procesar_hoja output) + Hash_Hoja
+#   produccion.parquet  the grouped (Fecha, Tipo_Tamal, Guiso) table of the last upload
+# Bump VERSION_STORE whenever procesar_hoja changes its output, so stored sheets are re-parsed.
+VERSION_STORE = 1
+INDICE = "indice.json"
+HOJAS = "hojas.parquet"
+PRODUCCION = "produccion.parquet"
+COLUMNA_HASH = "Hash_Hoja"
+
+def ruta_store(base_dir: str, username: str) -> str:
+    return os.path.join(base_dir, username)
+
+def hash_hoja(hoja: str, data: list, comentarios: dict) -> str:
+    """
+    Hash de una hoja semanal: nombre (da la fecha), valores y comentarios (desglose de celdas mixtas).
+    """
+    return fingerprint(VERSION_STORE, hoja, repr(data), sorted(comentarios.items()))
+
+def _escribir_parquet(df: pd.DataFrame, path: str):
+    df.to_parquet(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+
+def cargar_indice(store_dir: str):
+    # (indice, ok): ok False if missing, from another VERSION_STORE or unreadable
+    path_indice = os.path.join(store_dir, INDICE)
+    if not os.path.exists(path_indice):
+        return {}, False
+    try:
+        with open(path_indice, "r", encoding="utf-8") as f:
+            indice = json.load(f)
+    except Exception as e:
+        print(f"Error loading production store {store_dir}: {e}")
+        return {}, False
+    if indice.get("version") != VERSION_STORE:
+        return {}, False
+    return indice, True
+
+def cargar_store(store_dir: str):
+    """
+    (indice, {hash: parte}) del store; vacio si no existe, es de otra version o esta danado.
+    indice = {"hojas": {hash: {archivo, hoja, filas}}, "secuencia": [hash, ...]}.
+    Sheets that had no production blocks are in the index with parte None.
+    """
+    indice, ok = cargar_indice(store_dir)
+    if not ok:
+        return {}, {}
+    try:
+        hojas = indice.get("hojas", {})
+        partes = dict.fromkeys(hojas)
+        path_hojas = os.path.join(store_dir, HOJAS)
+        if os.path.exists(path_hojas):
+            df = pd.read_parquet(path_hojas)
+            # Row order inside each sheet is kept, so regrouped sums match a full re-parse
+            for h, grupo in df.groupby(COLUMNA_HASH, sort=False):
+                partes[h] = {
+                    'Fecha': grupo['Fecha'].to_numpy(dtype='datetime64[us]'),
+                    'Tipo_Tamal': grupo['Tipo_Tamal'].to_numpy(dtype=object),
+                    'Guiso': grupo['Guiso'].to_numpy(dtype=object),
+                    'Cantidad': grupo['Cantidad'].to_numpy(dtype='float64')
+                }
+        return indice, partes
+    except Exception as e:
+        print(f"Error loading production store {store_dir}: {e}")
+        return {}, {}
+
+def guardar_store(store_dir: str, secuencia: list, hojas: dict, partes: dict, df_agrupado: pd.DataFrame):
+    """
+    Reescribe el store (indice + filas por hoja + tabla agrupada). Files are replaced
+    atomically and the index goes last, so a crash leaves the previous store readable.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    con_filas = [(h, p) for h, p in partes.items() if p is not None and h in hojas]
+    if con_filas:
+        df_hojas = pd.DataFrame({
+            COLUMNA_HASH: np.concatenate([np.full(len(p['Cantidad']), h, dtype=object) for h, p in con_filas]),
+            **{col: np.concatenate([p[col] for _, p in con_filas]) for col in COLUMNAS_PRODUCCION}
+        })
+    else:
+        df_hojas = pd.DataFrame(columns=[COLUMNA_HASH] + COLUMNAS_PRODUCCION)
+    _escribir_parquet(df_hojas, os.path.join(store_dir, HOJAS))
+    _escribir_parquet(df_agrupado, os.path.join(store_dir, PRODUCCION))
+
+    path_indice = os.path.join(store_dir, INDICE)
+    with open(path_indice + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({
+            "version": VERSION_STORE,
+            "actualizado": pd.Timestamp.now().isoformat(),
+            "hojas": hojas,
+            "secuencia": secuencia
+        }, f, ensure_ascii=False)
+    os.replace(path_indice + ".tmp", path_indice)
+
+def cargar_produccion_guardada(store_dir: str) -> pd.DataFrame:
+    """
+    Tabla agrupada del ultimo upload, sin volver a leer los libros (vacia si no hay store).
+    """
+    path = os.path.join(store_dir, PRODUCCION)
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    return pd.read_parquet(path)
+
+def version_store(store_dir: str):
+    """
+    Hash del contenido guardado (secuencia de hojas del ultimo upload), None si no hay store.
+    Keys caches of results computed from the stored table.
+    """
+    indice, _ = cargar_indice(store_dir)
+    return fingerprint(VERSION_STORE, indice["secuencia"]) if indice.get("secuencia") else None
+
+def procesar_produccion_incremental(files_content: list, store_dir: str, paralelo=None):
+    """
+    procesar_produccion con store por hoja: solo las hojas nuevas o modificadas se parsean
+    (on the process pool when there are enough of them); unchanged weeks come from the store.
+    The store is then replaced by the sheets of this upload (the workbook is re-uploaded whole).
+    Returns (df_agrupado, resumen) with resumen = {hojas, reprocesadas, reutilizadas}.
+    """
+    indice, partes = cargar_store(store_dir)
+    hojas_upload = {}
+    secuencia = []  # Sheet hashes in upload order (merge order of the full parse)
+    pendientes = []  # (filename, content, {hoja: data}, comentarios, {hoja: hash}) with sheets to parse
+    por_parsear = set()
+
+    for filename, content in files_content:
+        # Needs to be Excel for this logic
+        if not filename.endswith(('.xlsx', '.xls')):
+            continue
+        comentarios = ComentariosXlsx(content)
+        try:
+            valores = leer_valores(content, filtro_hoja=lambda h: numero_semana_hoja(h) is not None)
+            hashes = {hoja: hash_hoja(hoja, data, comentarios.de_hoja(hoja)) for hoja, data in valores.items()}
+        except Exception as e:
+            print(f"Error processing production file {filename}: {e}")
+            comentarios.close()
+            continue
+
+        nuevas = {}
+        for hoja, h in hashes.items():
+            secuencia.append(h)
+            hojas_upload[h] = {"archivo": filename, "hoja": hoja}
+            # The same sheet twice (here or in an earlier file) is parsed once
+            if h not in partes and h not in por_parsear:
+                nuevas[hoja] = h
+                por_parsear.add(h)
+        if nuevas:
+            pendientes.append((filename, content, {hoja: valores[hoja] for hoja in nuevas}, comentarios, nuevas))
+        else:
+            comentarios.close()
+
+    parseadas = _parsear_pendientes(pendientes, paralelo)
+    partes.update(parseadas)
+
+    # Sheets that failed to parse are left out of the result and out of the store (retried next upload)
+    secuencia = [h for h in secuencia if h in partes]
+    df_agrupado = agrupar_produccion([partes[h] for h in secuencia])
+
+    hojas = {}
+    for h in secuencia:
+        parte = partes[h]
+        hojas[h] = {**hojas_upload[h], "filas": 0 if parte is None else int(len(parte['Cantidad']))}
+    resumen = {"hojas": len(hojas), "reprocesadas": len(parseadas), "reutilizadas": len(hojas) - len(parseadas)}
+    # An upload with no weekly sheets (wrong file) keeps the previous store
+    if secuencia and (parseadas or secuencia != indice.get("secuencia")):
+        try:
+            guardar_store(store_dir, secuencia, hojas, partes, df_agrupado)
+        except Exception as e:
+            print(f"Error saving production store {store_dir}: {e}")
+    return df_agrupado, resumen
+
+def _parsear_pendientes(pendientes: list, paralelo=None) -> dict:
+    # {hash: parte} de las hojas nuevas / modificadas
+    parseadas = {}
+    try:
+        if usar_pool(sum(len(nuevas) for *_, nuevas in pendientes), paralelo):
+            try:
+                resultados = procesar_en_pool([(f, c, list(nuevas)) for f, c, _, _, nuevas in pendientes])
+                for i, hoja, parte in resultados:
+                    parseadas[pendientes[i][4][hoja]] = parte
+                return parseadas
+            except BrokenProcessPool as e:
+                # A dead worker breaks the whole pool: drop it and parse here instead
+                print(f"Production pool failed, processing sequentially: {e}")
+                cerrar_pool()
+                parseadas.clear()
+
+        for filename, _, valores, comentarios, nuevas in pendientes:
+            for hoja, h in nuevas.items():
+                try:
+                    parseadas[h] = procesar_hoja(valores[hoja], hoja, comentarios)
+                except Exception as e:
+                    print(f"Error processing sheet {hoja} of production file {filename}: {e}")
+        return parseadas
+    finally:
+        for _, _, _, comentarios, _ in pendientes:
+            comentarios.close()
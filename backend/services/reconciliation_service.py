@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+from typing import Optional
+from services.analysis_cleaner import NORMALIZADO_A_PRODUCCION, TIPO_PRODUCCION, GUISO_PRODUCCION
+from services.production_cleaner import clave_producible
+from services.sales_loader import enriquecer_ventas
+
+CLAVES = ['Fecha', 'Tipo_Tamal', 'Guiso']
+# Sales columns the reconciliation needs (projection for the pinned Parquet)
+COLUMNAS_VENTAS = ['Fecha', 'Sucursal', 'Producto_Final', 'Cantidad', 'Total_Venta']
+# Typed join keys: both sides use the same categories, so the merge compares integer codes
+TIPOS = pd.CategoricalDtype(sorted(set(TIPO_PRODUCCION.values())))
+GUISOS_VENTA = set(GUISO_PRODUCCION.values())
+# A sales key production can never emit would count every sale as a shortage: such keys
+# are left out of the comparison (their production is zero, not missing)
+SIN_PRODUCCION = sorted(c for c in set(NORMALIZADO_A_PRODUCCION.values()) if not clave_producible(*c))
+if SIN_PRODUCCION:
+    print(f"[CONCILIACION] Claves de venta que procesar_hoja no produce (no comparables): {SIN_PRODUCCION}")
+# (Tipo_Tamal, Guiso) pairs that can be sold and produced; other keys have no counterpart
+CLAVES_VENTA = set(NORMALIZADO_A_PRODUCCION.values()) - set(SIN_PRODUCCION)
+
+def _tipo_guiso(tipos, guisos, guisos_extra=()):
+    guiso_dtype = pd.CategoricalDtype(sorted(GUISOS_VENTA | set(guisos_extra)))
+    return (
+        pd.Categorical(tipos, dtype=TIPOS),
+        pd.Categorical(guisos, dtype=guiso_dtype)
+    )
+
+def ventas_por_clave(df_ventas: pd.DataFrame) -> pd.DataFrame:
+    """
+    Ventas limpias -> unidades vendidas por (Fecha, Tipo_Tamal, Guiso) en el vocabulario de
+    produccion ("Puerco (Tradicional)" -> Tradicional / PCO). The product -> key lookup runs
+    once per distinct product and is broadcast with the factorize codes.
+    """
+    if 'Unidades_Reales' not in df_ventas.columns:
+        df_ventas = enriquecer_ventas(df_ventas)
+    # Package wrappers carry no units of their own (content rows do)
+    df = df_ventas[df_ventas['Categoria'] != 'Paquete']
+
+    codes, uniques = pd.factorize(df['Producto_Normalizado'])
+    # codes == -1 (missing product) picks the trailing None entry
+    claves = [NORMALIZADO_A_PRODUCCION.get(u, (None, None)) for u in uniques] + [(None, None)]
+    tipos = np.array([c[0] for c in claves], dtype=object)[codes]
+    guisos = np.array([c[1] for c in claves], dtype=object)[codes]
+
+    fechas = pd.to_datetime(df['Fecha'], errors='coerce').dt.normalize().to_numpy(dtype='datetime64[us]')
+    valid = ~np.isnat(fechas) & pd.notna(tipos)
+    tipo_cat, guiso_cat = _tipo_guiso(tipos[valid], guisos[valid])
+    ventas = pd.DataFrame({
+        'Fecha': fechas[valid],
+        'Tipo_Tamal': tipo_cat,
+        'Guiso': guiso_cat,
+        'Vendido': df['Unidades_Reales'].to_numpy(dtype=np.float64)[valid]
+    })
+    return ventas.groupby(CLAVES, observed=True, as_index=False)['Vendido'].sum()
+
+def produccion_por_clave(df_produccion: pd.DataFrame) -> pd.DataFrame:
+    """
+    Salida de procesar_produccion con llaves tipadas (Fecha datetime64[us], categorias).
+    """
+    tipo_cat, guiso_cat = _tipo_guiso(
+        df_produccion['Tipo_Tamal'].to_numpy(dtype=object),
+        df_produccion['Guiso'].to_numpy(dtype=object),
+        df_produccion['Guiso'].dropna().unique()
+    )
+    produccion = pd.DataFrame({
+        'Fecha': pd.to_datetime(df_produccion['Fecha']).dt.normalize().to_numpy(dtype='datetime64[us]'),
+        'Tipo_Tamal': tipo_cat,
+        'Guiso': guiso_cat,
+        'Producido': df_produccion['Cantidad'].to_numpy(dtype=np.float64)
+    })
+    return produccion.groupby(CLAVES, observed=True, as_index=False)['Producido'].sum()
+
+def _variacion(df: pd.DataFrame) -> pd.DataFrame:
+    df['Diferencia'] = df['Producido'] - df['Vendido']
+    df['Sobrante'] = df['Diferencia'].clip(lower=0)
+    df['Faltante'] = (-df['Diferencia']).clip(lower=0)
+    # Share of production that was sold (NaN when nothing was produced)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df['Pct_Vendido'] = np.where(df['Producido'] > 0, (df['Vendido'] / df['Producido'] * 100).round(1), np.nan)
+    return df
+
+def conciliar_produccion_ventas(
+    df_produccion: pd.DataFrame,
+    df_ventas: pd.DataFrame,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None
+) -> dict:
+    """
+    Producido vs vendido por (Fecha, Tipo_Tamal, Guiso): un solo merge externo sobre llaves
+    tipadas, y su agregado semanal (weeks start on Monday, like the production sheets).
+    Without explicit dates the window is the overlap of both sources.
+    Returns {diario, semanal: DataFrame, resumen: dict} (empty frames if nothing overlaps).
+    """
+    produccion = produccion_por_clave(df_produccion)
+    ventas = ventas_por_clave(df_ventas)
+
+    inicio = pd.Timestamp(start_date) if start_date else max(produccion['Fecha'].min(), ventas['Fecha'].min())
+    fin = pd.Timestamp(end_date) if end_date else min(produccion['Fecha'].max(), ventas['Fecha'].max())
+    produccion = produccion[produccion['Fecha'].between(inicio, fin)]
+    ventas = ventas[ventas['Fecha'].between(inicio, fin)]
+
+    # Same categories on both sides (production may have guisos sales never map to)
+    guiso_dtype = produccion['Guiso'].dtype
+    ventas = ventas.astype({'Guiso': guiso_dtype})
+
+    diario = produccion.merge(ventas, on=CLAVES, how='outer', sort=True)
+    diario[['Producido', 'Vendido']] = diario[['Producido', 'Vendido']].fillna(0.0)
+    pares = pd.MultiIndex.from_arrays([diario['Tipo_Tamal'].astype(object), diario['Guiso'].astype(object)])
+    # False: produced but never sold under this key (e.g. RAJAS), not real waste
+    diario['Comparable'] = pares.isin(list(CLAVES_VENTA))
+    diario = _variacion(diario)
+
+    semanas = diario['Fecha'] - pd.to_timedelta(diario['Fecha'].dt.weekday, unit='D')
+    semanal = diario.assign(Semana=semanas).groupby(
+        ['Semana', 'Tipo_Tamal', 'Guiso'], observed=True, as_index=False
+    ).agg(Producido=('Producido', 'sum'), Vendido=('Vendido', 'sum'), Comparable=('Comparable', 'first'))
+    semanal = _variacion(semanal)
+
+    comparables = diario[diario['Comparable']]
+    resumen = {
+        'start_date': inicio.strftime('%Y-%m-%d') if pd.notna(inicio) else None,
+        'end_date': fin.strftime('%Y-%m-%d') if pd.notna(fin) else None,
+        'producido': float(comparables['Producido'].sum()),
+        'vendido': float(comparables['Vendido'].sum()),
+        'sobrante': float(comparables['Sobrante'].sum()),
+        'faltante': float(comparables['Faltante'].sum()),
+        'sin_venta_mapeada': float(diario.loc[~diario['Comparable'], 'Producido'].sum()),
+    }
+    return {'diario': diario, 'semanal': semanal, 'resumen': resumen}
@@ -0,0 +1,40 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+# Simple in-memory LRU for computed results (breakdown pivots, ...)
+# Structure: key -> (stored_at, value)
+MAX_ENTRIES = 32
+TTL_SECONDS = 30 * 60
+
+_cache = OrderedDict()
+
+def fingerprint(*parts) -> str:
+    """
+    Hash estable de los insumos de un calculo (bytes de archivos + filtros).
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, bytes):
+            h.update(part)
+        else:
+            h.update(repr(part).encode())
+        h.update(b"\x00")
+    return h.hexdigest()
+
+def get_cached(key: str):
+    entry = _cache.get(key)
+    if entry is None:
+        return None
+    stored_at, value = entry
+    if time.time() - stored_at > TTL_SECONDS:
+        _cache.pop(key, None)
+        return None
+    _cache.move_to_end(key)
+    return value
+
+def put_cached(key: str, value):
+    _cache[key] = (time.time(), value)
+    _cache.move_to_end(key)
+    while len(_cache) > MAX_ENTRIES:
+        _cache.popitem(last=False)
@@ -1,3 +1,5 @@
+import asyncio
+import os
 import pandas as pd
 import numpy as np
 import hashlib
@@ -178,24 +180,96 @@ def extract_df_and_sucursal(file_obj, filename, content_bytes=None):
     return df_final, sucursal
 
 
-async def process_sales_clean(files_content: list):
+# Threads cleaning Wansoft reports while the rest still download (LimpiezaEnCola)
+CLEAN_WORKERS = int(os.getenv("WANSOFT_CLEAN_WORKERS", "1"))
+
+def limpiar_reporte(filename, content) -> pd.DataFrame:
+    """
+    Un reporte crudo (bytes) -> ventas limpias de ese archivo (vacio si no trae detalle).
+    """
+    base = leer_archivo_base(content, filename)
+
+    # Use common extraction logic
+    df, sucursal = extract_df_and_sucursal(base, filename, content_bytes=content)
+
+    if df is not None and not df.empty:
+        return procesar_dataframe_ventas(df, sucursal)
+    return pd.DataFrame()
+
+def unir_ventas(partes: list, dias_por_archivo: list = None) -> pd.DataFrame:
     """
-    Recibe lista de tuplas (filename, content_bytes)
+    Une las ventas limpias de cada archivo (dedup por Hash, orden Fecha / Sucursal / Hora).
+    dias_por_archivo: optional, per file, the days ('YYYY-MM-DD') to keep from it
+    (cached Wansoft reports overlap; each day comes from the newest report).
     """
     dfs = []
-    for filename, content in files_content:
-        base = leer_archivo_base(content, filename)
-        
-        # Use common extraction logic
-        df, sucursal = extract_df_and_sucursal(base, filename, content_bytes=content)
+    for i, df_res in enumerate(partes):
+        if not df_res.empty and dias_por_archivo is not None:
+            fechas = pd.to_datetime(df_res['Fecha'], errors='coerce').dt.strftime('%Y-%m-%d')
+            df_res = df_res[fechas.isin(dias_por_archivo[i]) | fechas.isna()]
+        if not df_res.empty:
+            dfs.append(df_res)
 
-        if df is not None and not df.empty:
-            df_res = procesar_dataframe_ventas(df, sucursal)
-            if not df_res.empty:
-                dfs.append(df_res)
-    
     if dfs:
         final = pd.concat(dfs).drop_duplicates(subset=['Hash'])
         final = final.sort_values(by=['Fecha', 'Sucursal', 'Hora_Venta'])
         return final
     return pd.DataFrame()
+
+async def process_sales_clean(files_content: list, dias_por_archivo: list = None):
+    """
+    Recibe lista de tuplas (filename, content_bytes); dias_por_archivo as in unir_ventas.
+    """
+    partes = [limpiar_reporte(filename, content) for filename, content in files_content]
+    return unir_ventas(partes, dias_por_archivo)
+
+class LimpiezaEnCola:
+    """
+    Consumidores que limpian cada reporte apenas llega (el productor es la descarga), asi la
+    red y el CPU se traslapan. encolar() is sync, so download callbacks can call it; each
+    key is cleaned once. `content` may be a function returning the bytes, called by the
+    worker (nothing waits in the queue in memory). unir() waits for the queue and only merges
+    cleaned frames; it raises if any of them failed to clean (like process_sales_clean).
+    Must be created inside the running event loop.
+    """
+    def __init__(self, workers: int = None):
+        self.cola = asyncio.Queue()
+        self.partes = {}
+        self.fallidos = {}
+        self._vistas = set()
+        self._workers = [asyncio.create_task(self._trabajar()) for _ in range(max(1, workers or CLEAN_WORKERS))]
+
+    def encolar(self, clave, filename, content):
+        if clave in self._vistas:
+            return
+        self._vistas.add(clave)
+        self.cola.put_nowait((clave, filename, content))
+
+    async def _trabajar(self):
+        while True:
+            clave, filename, content = await self.cola.get()
+            try:
+                # Worker thread: the event loop keeps serving downloads meanwhile
+                self.partes[clave] = await asyncio.to_thread(self._limpiar, filename, content)
+            except Exception as e:
+                print(f"Error limpiando {filename}: {e}")
+                self.fallidos[clave] = (filename, e)
+            finally:
+                self.cola.task_done()
+
+    @staticmethod
+    def _limpiar(filename, content):
+        return limpiar_reporte(filename, content() if callable(content) else content)
+
+    async def unir(self, claves: list, dias_por_archivo: list = None) -> pd.DataFrame:
+        await self.cola.join()
+        self.cerrar()
+        fallidos = [self.fallidos[c] for c in claves if c in self.fallidos]
+        if fallidos:
+            filename, error = fallidos[0]
+            raise ValueError(f"No se pudieron limpiar {len(fallidos)} reportes ({filename}: {error})") from error
+        return unir_ventas([self.partes.get(c, pd.DataFrame()) for c in claves], dias_por_archivo)
+
+    def cerrar(self):
+        for worker in self._workers:
+            worker.cancel()
@@ -0,0 +1,140 @@
+import numpy as np
+import pandas as pd
+from typing import List, Tuple
+from services.utils import leer_archivo_base, es_archivo_columnar
+from services.sales_cleaner import process_sales_clean
+from services.analysis_cleaner import TAMAL_MAPPING, get_product_category
+
+def _normalize_col(c):
+    return str(c).upper().strip().replace(' ', '_').replace('.', '')
+
+def detectar_ventas_limpias(df_check: pd.DataFrame):
+    """
+    Si el DataFrame ya es un archivo de "Ventas limpias" devuelve una copia con
+    las columnas estandarizadas; si no, None.
+    """
+    if df_check is None or df_check.empty:
+        return None
+
+    cols = {_normalize_col(c) for c in df_check.columns}
+    has_sucursal = any('SUCURSAL' in c for c in cols)
+    has_fecha = any('FECHA' in c for c in cols)
+    has_total = any('TOTAL_VENTA' in c or 'TOTALVENTA' in c for c in cols)
+    has_prod = any('PRODUCTO_FINAL' in c or 'PRODUCTOFINAL' in c for c in cols)
+    if not (has_sucursal and has_fecha and has_total and has_prod):
+        return None
+
+    new_cols = {}
+    for c in df_check.columns:
+        norm = _normalize_col(c)
+        if 'SUCURSAL' in norm: new_cols[c] = 'Sucursal'
+        elif 'FECHA' in norm: new_cols[c] = 'Fecha'
+        elif 'TOTAL_VENTA' in norm or 'TOTALVENTA' in norm: new_cols[c] = 'Total_Venta'
+        elif 'PRODUCTO_FINAL' in norm or 'PRODUCTOFINAL' in norm: new_cols[c] = 'Producto_Final'
+        elif 'CANTIDAD' in norm: new_cols[c] = 'Cantidad'
+        elif 'PAQUETE_ORIGEN' in norm or 'PAQUETEORIGEN' in norm: new_cols[c] = 'Paquete_Origen'
+        else: new_cols[c] = str(c).strip()
+    return df_check.rename(columns=new_cols)
+
+# Typed schema of "Ventas limpias" (pinned Parquet, columnar uploads/exports)
+ESQUEMA_VENTAS = {
+    'Sucursal': 'category',
+    'MovimientoPDV': 'string',
+    'Hora_Venta': 'string',
+    'Producto_Final': 'string',
+    'Cantidad': 'float64',
+    'Total_Venta': 'float64',
+    'Paquete_Origen': 'string',
+    'Tipo_Oferta': 'category',
+    'Hash': 'string',
+}
+
+# Columns read from columnar uploads; anything else in the file is skipped
+COLUMNAS_VENTAS_LIMPIAS = ['Fecha'] + list(ESQUEMA_VENTAS)
+
+def tipar_ventas(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Aplica el esquema tipado (fechas reales, categorias, numericos) antes de escribir Parquet.
+    """
+    df = df.copy()
+    df['Fecha'] = pd.to_datetime(df['Fecha'], errors='coerce')
+    for col, dtype in ESQUEMA_VENTAS.items():
+        if col not in df.columns:
+            continue
+        if dtype == 'float64':
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype('float64')
+        else:
+            df[col] = df[col].astype(str).where(df[col].notna()).astype(dtype)
+    # Anything else (extra columns of user-cleaned files) is kept as text
+    for col in df.columns:
+        if col not in ESQUEMA_VENTAS and col != 'Fecha' and df[col].dtype == object:
+            df[col] = df[col].astype(str).where(df[col].notna()).astype('string')
+    return df
+
+async def cargar_ventas_limpias(files_content: List[Tuple[str, bytes]]) -> pd.DataFrame:
+    """
+    Recibe lista de tuplas (filename, content_bytes) con archivos limpios o crudos
+    y devuelve un solo DataFrame de ventas limpias (vacio si no hay datos).
+    """
+    clean_dfs = []
+    raw_files_content = []
+
+    for filename, content in files_content:
+        try:
+            base = leer_archivo_base(content, filename, columns=COLUMNAS_VENTAS_LIMPIAS)
+        except Exception as e:
+            print(f"Error reading file {filename}: {e}")
+            base = None
+
+        df_check = None
+        if isinstance(base, pd.ExcelFile):
+            try:
+                df_check = pd.read_excel(base, sheet_name=0)
+            except:
+                pass
+        elif isinstance(base, pd.DataFrame):
+            df_check = base
+
+        df_clean = detectar_ventas_limpias(df_check)
+        if df_clean is not None:
+            if es_archivo_columnar(filename):
+                df_clean = tipar_ventas(df_clean)
+            clean_dfs.append(df_clean)
+        else:
+            raw_files_content.append((filename, content))
+
+    if raw_files_content:
+        try:
+            df_processed = await process_sales_clean(raw_files_content)
+            if not df_processed.empty:
+                clean_dfs.append(df_processed)
+        except Exception as e:
+            print(f"Error processing raw files: {e}")
+
+    if not clean_dfs:
+        return pd.DataFrame()
+    return pd.concat(clean_dfs, ignore_index=True)
+
+# Producto_Final -> (Producto_Normalizado, Factor), same rule as get_normalized_info
+NORMALIZACION = {k: (f"{guiso} ({tipo})", factor) for k, (guiso, tipo, factor) in TAMAL_MAPPING.items()}
+
+def enriquecer_ventas(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Agrega Producto_Normalizado, Factor, Unidades_Reales y Categoria.
+    Lookups run once per distinct product and are broadcast with the factorize codes.
+    """
+    df = df.copy()
+    df['Total_Venta'] = pd.to_numeric(df['Total_Venta'], errors='coerce').fillna(0)
+    df['Cantidad'] = pd.to_numeric(df['Cantidad'], errors='coerce').fillna(0)
+
+    codes, uniques = pd.factorize(df['Producto_Final'])
+    # codes == -1 (missing product) picks the trailing NaN entry
+    nombres = np.array([NORMALIZACION.get(u, (u, 1))[0] for u in uniques] + [np.nan], dtype=object)
+    factores = np.array([NORMALIZACION.get(u, (u, 1))[1] for u in uniques] + [1], dtype=np.float64)
+    categorias = np.array([get_product_category(u) for u in uniques] + [get_product_category(np.nan)], dtype=object)
+
+    df['Producto_Normalizado'] = nombres[codes]
+    df['Factor'] = factores[codes]
+    df['Unidades_Reales'] = df['Cantidad'] * df['Factor']
+    df['Categoria'] = categorias[codes]
+    return df
@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Pairs seen in fewer tickets than this are noise for lift
+MIN_TICKETS_PAR = 5
+TOP_PARES = 50
+TOP_PRODUCTOS_MATRIZ = 20
+
+def _codificar_tickets(df: pd.DataFrame) -> np.ndarray:
+    # MovimientoPDV restarts per sucursal, so the ticket key is (Sucursal, MovimientoPDV)
+    suc_codes, _ = pd.factorize(df['Sucursal'].astype(str))
+    mov_codes, mov_labels = pd.factorize(df['MovimientoPDV'].astype(str))
+    combined = suc_codes.astype(np.int64) * (len(mov_labels) + 1) + mov_codes
+    ticket_codes, _ = pd.factorize(combined)
+    return ticket_codes
+
+def compute_ticket_analytics(df: pd.DataFrame):
+    """
+    Metricas por ticket (MovimientoPDV): ticket promedio, piezas por ticket
+    y matriz de co-ocurrencia / lift entre productos.
+    Tickets x productos is a scipy.sparse matrix, so co-occurrence is X.T @ X.
+    """
+    if df.empty or 'MovimientoPDV' not in df.columns:
+        return None
+
+    df = df[df['MovimientoPDV'].notna()]
+    if df.empty:
+        return None
+
+    ticket_codes = _codificar_tickets(df)
+    n_tickets = int(ticket_codes.max()) + 1
+
+    # A. Ticket value and items per ticket
+    es_paquete = (df['Categoria'] == 'Paquete').to_numpy()
+    valor = np.bincount(ticket_codes, weights=df['Total_Venta'].to_numpy(dtype=np.float64), minlength=n_tickets)
+    piezas = np.bincount(
+        ticket_codes,
+        weights=np.where(es_paquete, 0.0, df['Unidades_Reales'].to_numpy(dtype=np.float64)),
+        minlength=n_tickets
+    )
+
+    # Sucursal of each ticket (first row wins, all rows share it)
+    suc_ticket = pd.Series(df['Sucursal'].astype(str).to_numpy()).groupby(ticket_codes).first()
+    por_sucursal = pd.DataFrame({
+        'Sucursal': suc_ticket.to_numpy(),
+        'Valor': valor,
+        'Piezas': piezas
+    }).groupby('Sucursal').agg(
+        Tickets=('Valor', 'size'),
+        Ticket_Promedio=('Valor', 'mean'),
+        Piezas_Promedio=('Piezas', 'mean')
+    ).reset_index().round(2)
+
+    summary = {
+        "tickets": n_tickets,
+        "ticket_promedio": round(float(valor.mean()), 2),
+        "ticket_mediana": round(float(np.median(valor)), 2),
+        "piezas_promedio": round(float(piezas.mean()), 2),
+        "por_sucursal": por_sucursal.to_dict(orient='records')
+    }
+
+    # B. Co-occurrence over real products (package wrappers excluded, like product_mix)
+    df_items = df.loc[~es_paquete]
+    t_items = ticket_codes[~es_paquete]
+    prod_codes, prod_labels = pd.factorize(df_items['Producto_Normalizado'].astype(str))
+    n_prod = len(prod_labels)
+    if n_prod == 0:
+        return {**summary, "co_occurrence": {"products": [], "soporte": [], "tickets": [], "lift": []}, "top_pairs": []}
+
+    X = sparse.csr_matrix(
+        (np.ones(len(prod_codes), dtype=np.float64), (t_items, prod_codes)),
+        shape=(n_tickets, n_prod)
+    )
+    X.sum_duplicates()
+    X.data[:] = 1.0  # presence, not quantity
+
+    C = (X.T @ X).tocsr()  # C[i, j] = tickets containing both i and j
+    tickets_prod = C.diagonal()
+    soporte = tickets_prod / n_tickets
+
+    # Pairs (upper triangle only)
+    pares = sparse.triu(C, k=1).tocoo()
+    keep = pares.data >= MIN_TICKETS_PAR
+    a, b, both = pares.row[keep], pares.col[keep], pares.data[keep]
+    lift = both * n_tickets / (tickets_prod[a] * tickets_prod[b])
+    orden = np.lexsort((-both, -lift))[:TOP_PARES]
+    top_pairs = [
+        {
+            "producto_a": prod_labels[i],
+            "producto_b": prod_labels[j],
+            "tickets": int(n),
+            "soporte": round(float(n / n_tickets), 4),
+            "confianza_a_b": round(float(n / tickets_prod[i]), 4),
+            "confianza_b_a": round(float(n / tickets_prod[j]), 4),
+            "lift": round(float(l), 3)
+        }
+        for i, j, n, l in zip(a[orden], b[orden], both[orden], lift[orden])
+    ]
+
+    # Dense matrix only for the most frequent products
+    top_idx = np.argsort(-tickets_prod, kind='stable')[:TOP_PRODUCTOS_MATRIZ]
+    sub = C[top_idx][:, top_idx].toarray()
+    lift_sub = sub * n_tickets / np.outer(tickets_prod[top_idx], tickets_prod[top_idx])
+
+    return {
+        **summary,
+        "co_occurrence": {
+            "products": [prod_labels[i] for i in top_idx],
+            "soporte": np.round(soporte[top_idx], 4).tolist(),
+            "tickets": sub.astype(np.int64).tolist(),
+            "lift": np.round(lift_sub, 3).tolist()
+        },
+        "top_pairs": top_pairs
+    }
@@ -50,12 +50,57 @@ def encontrar_columna_flexible(df, keywords):
             if k in cols_norm[i]: return col_real
     return None
 
-def leer_archivo_base(file_content: bytes, filename: str):
+# Columnar uploads (Parquet, Arrow IPC / Feather v2)
+EXTENSIONES_PARQUET = ('.parquet', '.pq')
+EXTENSIONES_ARROW = ('.arrow', '.feather', '.ipc')
+
+def es_archivo_columnar(filename: str) -> bool:
+    return str(filename).lower().endswith(EXTENSIONES_PARQUET + EXTENSIONES_ARROW)
+
+def _clave_columna(c):
+    return str(c).upper().strip().replace(' ', '').replace('_', '').replace('.', '')
+
+def leer_columnar(file_content: bytes, filename: str, columns=None) -> pd.DataFrame:
+    """
+    Lee Parquet / Arrow IPC. `columns` (nombres estandar) limits what is read from
+    disk; names are matched ignoring case, spaces and underscores, missing ones are skipped.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    source = pa.BufferReader(file_content)
+    if filename.lower().endswith(EXTENSIONES_PARQUET):
+        reader = pq.ParquetFile(source)
+        names = reader.schema_arrow.names
+        read = lambda cols: reader.read(columns=cols)
+    else:
+        try:
+            reader = pa.ipc.open_file(source)
+        except pa.ArrowInvalid:
+            # Streaming format (no footer)
+            reader = pa.ipc.open_stream(pa.BufferReader(file_content))
+        names = reader.schema.names
+        read = lambda cols: reader.read_all().select(cols) if cols is not None else reader.read_all()
+
+    cols = None
+    if columns is not None:
+        wanted = {_clave_columna(c) for c in columns}
+        cols = [n for n in names if _clave_columna(n) in wanted]
+    return read(cols).to_pandas()
+
+def leer_archivo_base(file_content: bytes, filename: str, columns=None):
     """
     Lee el archivo en memoria y retorna el objeto ExcelFile o DataFrame base
     para que cada servicio lo procese como necesite.
+    `columns` only applies to columnar files (Parquet / Arrow), which come back as a DataFrame.
     """
-    if filename.endswith(('.xlsx', '.xls')):
+    if es_archivo_columnar(filename):
+        try:
+            return leer_columnar(file_content, filename, columns=columns)
+        except Exception as e:
+            print(f"Error Parquet/Arrow: {e}")
+            return None
+    elif filename.endswith(('.xlsx', '.xls')):
         try:
             return pd.ExcelFile(io.BytesIO(file_content))
         except Exception as e:
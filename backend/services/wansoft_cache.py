@@ -0,0 +1,389 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+import zipfile
+from datetime import date, datetime, timedelta
+from functools import partial
+from itertools import groupby
+import brotli
+import pandas as pd
+from services.result_cache import fingerprint
+from services.utils import encontrar_columna_flexible, formatear_fecha_sql
+from services.wansoft_service import descargar_ventanas, subsidiarias
+
+# Raw Wansoft reports per account, reused across jobs:
+#   indice.json        subsidiary -> day -> {blob, bajado} and blob -> the window it covers
+#   blobs/<sha256>.br  report bytes (brotli); identical reports are stored once
+# A report covers a window of days; each day points to the newest report that covered it
+# (blob None: Wansoft answered that window without a report, i.e. no sales).
+VERSION_CACHE = 1
+CACHE_DIR = os.getenv("WANSOFT_CACHE_DIR", os.path.join("uploads", ".wansoft_cache"))
+# Longest window asked in one report (0 = no split); windows download in parallel
+WINDOW_DAYS = int(os.getenv("WANSOFT_WINDOW_DAYS", "7"))
+# A day is final once it was downloaded this many days later: today and yesterday always refresh
+DIAS_ABIERTOS = 2
+BROTLI_QUALITY = 5
+INDICE = "indice.json"
+CHUNK_BYTES = 256 * 1024
+# Blobs are deleted this many seconds after they stop being referenced (a finishing job may still read them)
+PODA_GRACIA = 60 * 60
+
+_locks = {}
+
+def ruta_cache(base_dir: str, username: str) -> str:
+    return os.path.join(base_dir, fingerprint("wansoft-cache", username.strip())[:32])
+
+def _ruta_blob(cache_dir: str, blob: str) -> str:
+    return os.path.join(cache_dir, "blobs", f"{blob}.br")
+
+def dias_rango(start_date: str, end_date: str) -> list:
+    inicio, fin = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    return [(inicio + timedelta(days=i)).isoformat() for i in range((fin - inicio).days + 1)]
+
+def cargar_indice(cache_dir: str) -> dict:
+    # Empty index if missing, from another VERSION_CACHE or unreadable (everything re-downloads)
+    vacio = {"version": VERSION_CACHE, "dias": {}, "blobs": {}}
+    path = os.path.join(cache_dir, INDICE)
+    if not os.path.exists(path):
+        return vacio
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            indice = json.load(f)
+    except Exception as e:
+        print(f"[WANSOFT] Error leyendo caché de reportes {cache_dir}: {e}")
+        return vacio
+    return indice if indice.get("version") == VERSION_CACHE else vacio
+
+def _guardar_indice(cache_dir: str, indice: dict):
+    path = os.path.join(cache_dir, INDICE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(indice, f)
+    os.replace(path + ".tmp", path)
+
+def guardar_reporte(cache_dir: str, indice: dict, sub_id, start_date, end_date, archivo, bajado: date):
+    """
+    Guarda un reporte (sub_id, ventana) y apunta cada dia de la ventana a el.
+    `archivo` is a binary file, read in blocks: hashed and compressed in one pass.
+    Returns the blob hash; content already stored (same report) is not written again.
+    """
+    carpeta = os.path.join(cache_dir, "blobs")
+    os.makedirs(carpeta, exist_ok=True)
+    h = hashlib.sha256()
+    compresor = brotli.Compressor(quality=BROTLI_QUALITY)
+    n_bytes = 0
+    fd, tmp = tempfile.mkstemp(dir=carpeta, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                chunk = archivo.read(CHUNK_BYTES)
+                if not chunk:
+                    break
+                h.update(chunk)
+                n_bytes += len(chunk)
+                f.write(compresor.process(chunk))
+            f.write(compresor.finish())
+        blob = h.hexdigest()
+        path = _ruta_blob(cache_dir, blob)
+        if os.path.exists(path):
+            os.remove(tmp)
+        else:
+            os.replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    indice["blobs"].setdefault(blob, {"sub": sub_id, "inicio": start_date, "fin": end_date, "bytes": n_bytes})
+    dias = indice["dias"].setdefault(str(sub_id), {})
+    for dia in dias_rango(start_date, end_date):
+        dias[dia] = {"blob": blob, "bajado": bajado.isoformat()}
+    return blob
+
+def guardar_vacio(indice: dict, sub_id, start_date, end_date, bajado: date):
+    """
+    Marca los dias de una ventana sin reporte (sin ventas) para no volver a pedirlos.
+    """
+    dias = indice["dias"].setdefault(str(sub_id), {})
+    for dia in dias_rango(start_date, end_date):
+        dias[dia] = {"blob": None, "bajado": bajado.isoformat()}
+
+def _podar(cache_dir: str, indice: dict):
+    # Reports no day points to anymore (fully superseded by newer downloads), and leftovers.
+    # The grace period counts from when a report stopped being used (`sin_uso`), not from when
+    # it was written: a job that already listed it may still be reading it.
+    vivos = {d["blob"] for dias in indice["dias"].values() for d in dias.values() if d["blob"]}
+    ahora = time.time()
+    limite = ahora - PODA_GRACIA
+    for blob, meta in list(indice["blobs"].items()):
+        if blob in vivos:
+            meta.pop("sin_uso", None)
+        elif "sin_uso" not in meta:
+            meta["sin_uso"] = ahora
+        elif meta["sin_uso"] < limite:
+            indice["blobs"].pop(blob)
+    carpeta = os.path.join(cache_dir, "blobs")
+    for nombre in os.listdir(carpeta) if os.path.isdir(carpeta) else []:
+        path = os.path.join(carpeta, nombre)
+        if nombre.split(".")[0] not in indice["blobs"] and os.path.getmtime(path) < limite:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+def leer_reporte(cache_dir: str, blob: str) -> bytes:
+    with open(_ruta_blob(cache_dir, blob), "rb") as f:
+        return brotli.decompress(f.read())
+
+def copiar_reporte(cache_dir: str, blob: str, destino):
+    """
+    Descomprime un reporte guardado por bloques hacia `destino` (binary file).
+    """
+    descompresor = brotli.Decompressor()
+    with open(_ruta_blob(cache_dir, blob), "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_BYTES)
+            if not chunk:
+                break
+            destino.write(descompresor.process(chunk))
+
+def _vigente(entrada: dict, dia: str, blobs_ok: set) -> bool:
+    if entrada is None or (entrada["blob"] is not None and entrada["blob"] not in blobs_ok):
+        return False
+    return date.fromisoformat(entrada["bajado"]) >= date.fromisoformat(dia) + timedelta(days=DIAS_ABIERTOS)
+
+def _ventanas(dias: list, max_dias: int) -> list:
+    # Consecutive runs of days, cut every max_dias
+    ventanas = []
+    for dia in dias:
+        d = date.fromisoformat(dia)
+        if ventanas and d == date.fromisoformat(ventanas[-1][-1]) + timedelta(days=1) and (max_dias <= 0 or len(ventanas[-1]) < max_dias):
+            ventanas[-1].append(dia)
+        else:
+            ventanas.append([dia])
+    return [(v[0], v[-1]) for v in ventanas]
+
+def planear_descargas(cache_dir: str, indice: dict, subs: list, start_date: str, end_date: str,
+                      hoy: date = None, max_dias: int = None) -> list:
+    """
+    Ventanas (sub_id, inicio, fin) a descargar: dias sin reporte o aun abiertos
+    (downloaded less than DIAS_ABIERTOS days after them). Future days are not asked for.
+    """
+    hoy = hoy or date.today()
+    max_dias = WINDOW_DAYS if max_dias is None else max_dias
+    dias = [d for d in dias_rango(start_date, end_date) if d <= hoy.isoformat()]
+    blobs_ok = {b for b in indice["blobs"] if os.path.exists(_ruta_blob(cache_dir, b))}
+    tareas = []
+    for sub_id in subs:
+        guardados = indice["dias"].get(str(sub_id), {})
+        faltantes = [d for d in dias if not _vigente(guardados.get(d), d, blobs_ok)]
+        tareas += [(sub_id, inicio, fin) for inicio, fin in _ventanas(faltantes, max_dias)]
+    return tareas
+
+def fuentes_rango(indice: dict, subs: list, start_date: str, end_date: str) -> list:
+    """
+    Reportes guardados que cubren el rango, en orden de ID: [(filename, blob, dias)].
+    `dias` are the range days this report is the newest source for (reports may overlap
+    or extend past the range; keep only these days when cleaning).
+    """
+    rango = dias_rango(start_date, end_date)
+    fuentes = []
+    for sub_id in subs:
+        guardados = indice["dias"].get(str(sub_id), {})
+        por_blob = {}
+        for dia in rango:
+            if dia in guardados and guardados[dia]["blob"]:
+                por_blob.setdefault(guardados[dia]["blob"], []).append(dia)
+        for blob, dias in por_blob.items():
+            meta = indice["blobs"][blob]
+            fuentes.append((f"Reporte_{sub_id}_{meta['inicio']}_{meta['fin']}.xlsx", blob, set(dias)))
+    return fuentes
+
+def anunciar_fuentes(username: str, fuentes: list, al_llegar, cache_dir: str = None):
+    """
+    Pasa cada fuente a al_llegar(blob, filename, leer) como lo hace sincronizar_reportes.
+    """
+    cache_dir = ruta_cache(cache_dir or CACHE_DIR, username)
+    for filename, blob, _ in fuentes:
+        al_llegar(blob, filename, partial(leer_reporte, cache_dir, blob))
+
+def _dia_celda(valor):
+    # Fecha cell of a raw report -> 'YYYY-MM-DD' (None if it is not a date)
+    if valor is None or (isinstance(valor, float) and pd.isna(valor)):
+        return None
+    if isinstance(valor, str):
+        valor = formatear_fecha_sql(valor)
+    try:
+        return pd.Timestamp(valor).date().isoformat()
+    except (ValueError, TypeError):
+        return None
+
+def recortar_reporte(contenido: bytes, dias: set):
+    """
+    Filas de un reporte crudo (primera hoja) solo de `dias`: returns (encabezado, filas)
+    as lists of cells, where encabezado is everything up to the column header row.
+    Returns None if no detail header is found. Total rows are dropped (they sum the whole window).
+    """
+    crudo = pd.read_excel(io.BytesIO(contenido), sheet_name=0, header=None, dtype=object)
+    header_idx = None
+    for i, row in crudo.head(50).iterrows():
+        linea = " ".join(str(x) for x in row.values).upper()
+        if "MOVIMIENTO" in linea and ("PLATILLO" in linea or "ART" in linea):
+            header_idx = i
+            break
+    if header_idx is None:
+        return None
+    detalle = crudo.iloc[header_idx + 1:]
+    columnas = pd.Index([str(c) for c in crudo.iloc[header_idx]])
+    col_fecha = encontrar_columna_flexible(pd.DataFrame(columns=columnas), ["FECHA", "OPERACION"])
+    col_mov = encontrar_columna_flexible(pd.DataFrame(columns=columnas), ["MOVIMIENTO", "FOLIO", "PDV"])
+    if col_fecha is None:
+        return None
+    # Modifier rows leave the date blank: they belong to the day above
+    fechas = detalle.iloc[:, columnas.get_loc(col_fecha)].map(_dia_celda).ffill()
+    movs = detalle.iloc[:, columnas.get_loc(col_mov)].astype(str).str.upper()
+    keep = fechas.isin(dias) & ~movs.str.contains("TOTAL", regex=False)
+    return crudo.iloc[:header_idx + 1].values.tolist(), detalle[keep].values.tolist()
+
+def _escribir_recortado(destino, encabezado: list, filas):
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(destino, {'constant_memory': True, 'strings_to_urls': False})
+    fmt_fecha = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+    hoja = workbook.add_worksheet()
+    for r, fila in enumerate(encabezado + filas):
+        for c, valor in enumerate(fila):
+            if valor is None or (isinstance(valor, float) and pd.isna(valor)):
+                continue
+            if isinstance(valor, datetime):
+                hoja.write_datetime(r, c, valor, fmt_fecha)
+            else:
+                hoja.write(r, c, valor)
+    workbook.close()
+
+def _partes_nombre(filename: str):
+    # "Reporte_<sub>_<inicio>_<fin>.xlsx" -> ("Reporte_<sub>", inicio, fin)
+    return filename.rsplit(".", 1)[0].rsplit("_", 2)
+
+def escribir_zip(username: str, fuentes: list, destino, start_date: str, end_date: str, cache_dir: str = None):
+    """
+    ZIP de los reportes crudos, uno por sucursal con exactamente los dias pedidos
+    (`destino`: path or binary file). A cached report all of whose days are used is copied
+    as is, block by block; otherwise its detail rows are re-exported restricted to its `dias`,
+    so overlapping or longer cached windows never repeat or leak days.
+    """
+    cache_dir = ruta_cache(cache_dir or CACHE_DIR, username)
+    with zipfile.ZipFile(destino, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for prefijo, grupo in groupby(fuentes, key=lambda f: _partes_nombre(f[0])[0]):
+            grupo = list(grupo)
+            for filename, blob, _ in grupo:
+                if not os.path.exists(_ruta_blob(cache_dir, blob)):
+                    print(f"[WANSOFT] Reporte en caché no encontrado ({blob[:12]})")
+            grupo = [f for f in grupo if os.path.exists(_ruta_blob(cache_dir, f[1]))]
+            if not grupo:
+                continue
+            nombre = f"{prefijo}_{start_date}_{end_date}.xlsx"
+            filename, blob, dias = grupo[0]
+            _, inicio, fin = _partes_nombre(filename)
+            if len(grupo) == 1 and dias == set(dias_rango(inicio, fin)):
+                with zip_file.open(nombre, "w") as entrada:
+                    copiar_reporte(cache_dir, blob, entrada)
+                continue
+            encabezado, filas = None, []
+            for filename, blob, dias in sorted(grupo, key=lambda f: min(f[2])):
+                recorte = recortar_reporte(leer_reporte(cache_dir, blob), dias)
+                if recorte is None:
+                    print(f"[WANSOFT] {filename} sin encabezado de detalle, se omite del ZIP")
+                    continue
+                encabezado = encabezado or recorte[0]
+                filas += recorte[1]
+            if encabezado is None:
+                continue
+            with tempfile.TemporaryFile() as tmp:
+                _escribir_recortado(tmp, encabezado, filas)
+                tmp.seek(0)
+                with zip_file.open(nombre, "w") as entrada:
+                    while chunk := tmp.read(CHUNK_BYTES):
+                        entrada.write(chunk)
+
+def _guardar(cache_dir: str, indice: dict):
+    _podar(cache_dir, indice)
+    # Index last: a crash leaves at most unreferenced blobs
+    _guardar_indice(cache_dir, indice)
+
+async def sincronizar_reportes(cookies, username: str, start_date: str, end_date: str,
+                               progress_callback=None, al_llegar=None, cache_dir: str = None, **descarga):
+    """
+    Trae al cache solo los dias faltantes o abiertos; la salida se arma desde el cache.
+    Returns (fuentes [(filename, blob, dias)] as in fuentes_rango, resumen); write them out with
+    escribir_zip or anunciar_fuentes. `descarga` goes to descargar_ventanas (e.g. metricas).
+    al_llegar(blob, filename, leer) is called once per returned report as soon as it is known
+    (leer() returns its bytes): cached ones before the download starts, new ones as they
+    arrive (to clean while downloading). Each download goes to disk as it arrives.
+    Raises SesionExpirada like the downloader; the reports that did arrive are kept.
+    """
+    cache_dir = ruta_cache(cache_dir or CACHE_DIR, username)
+    subs = subsidiarias()
+    anunciados = set()
+    guardados = {}
+    vacias = []
+
+    def anunciar(blob, filename):
+        if al_llegar and blob not in anunciados:
+            anunciados.add(blob)
+            al_llegar(blob, filename, partial(leer_reporte, cache_dir, blob))
+
+    def anunciar_guardados(fuentes, excepto_dias=None):
+        for filename, blob, dias in fuentes:
+            sub_id = indice["blobs"][blob]["sub"]
+            # Skip reports whose days are all about to be replaced by a download
+            if excepto_dias and dias <= excepto_dias.get(sub_id, set()):
+                continue
+            anunciar(blob, filename)
+
+    async def llego(ventana, archivo):
+        sub_id, inicio, fin = ventana
+        if archivo is None:
+            guardar_vacio(indice, sub_id, inicio, fin, date.today())
+            vacias.append(ventana)
+            return
+        # Temp file -> compressed blob off the event loop, then the spool is released
+        with archivo[1] as contenido:
+            blob = await asyncio.to_thread(guardar_reporte, cache_dir, indice, sub_id, inicio, fin, contenido, date.today())
+        guardados[ventana] = blob
+        anunciar(blob, f"Reporte_{sub_id}_{inicio}_{fin}.xlsx")
+
+    # One sync per account at a time: concurrent jobs reuse each other's downloads
+    async with _locks.setdefault(cache_dir, asyncio.Lock()):
+        indice = cargar_indice(cache_dir)
+        tareas = planear_descargas(cache_dir, indice, subs, start_date, end_date)
+        n_dias = len(subs) * sum(d <= date.today().isoformat() for d in dias_rango(start_date, end_date))
+        dias_bajados = sum(len(dias_rango(i, f)) for _, i, f in tareas)
+        print(f"[WANSOFT] Caché: {n_dias - dias_bajados}/{n_dias} días sucursal vigentes, {len(tareas)} reportes por bajar")
+        if al_llegar:
+            por_bajar = {}
+            for sub_id, inicio, fin in tareas:
+                por_bajar.setdefault(sub_id, set()).update(dias_rango(inicio, fin))
+            anunciar_guardados(fuentes_rango(indice, subs, start_date, end_date), por_bajar)
+        if tareas:
+            try:
+                await descargar_ventanas(cookies, tareas, progress_callback, al_llegar=llego, **descarga)
+            finally:
+                if guardados or vacias:
+                    _guardar(cache_dir, indice)
+        elif progress_callback:
+            progress_callback("Reportes al día en caché, sin descargas...", 90)
+        fuentes = fuentes_rango(indice, subs, start_date, end_date)
+        if al_llegar:
+            # Older reports that are the source again because a window failed to download
+            anunciar_guardados(fuentes)
+
+    resumen = {
+        "reportes_bajados": len(guardados),
+        "reportes_vacios": len(vacias),
+        "reportes_fallidos": len(tareas) - len(guardados) - len(vacias),
+        "dias_desde_cache": n_dias - dias_bajados
+    }
+    return fuentes, resumen
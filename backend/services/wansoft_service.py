@@ -1,26 +1,79 @@
 import asyncio
 import base64
+import importlib.util
 import io
+import os
+import random
+import re
+import tempfile
+import time
+import httpx
+import orjson
 import pandas as pd
-from playwright.async_api import async_playwright
 from typing import List, Tuple
+from urllib.parse import urlsplit
 import traceback
+from services.browser_pool import navegador
 
 # --- CONFIGURACIÓN ---
 SUBSIDIARY_START = 8447
 SUBSIDIARY_END = 8458
 EXCLUDED_IDS = [8457]
-REPORT_URL = "https://www.wansoft.net/Wansoft.Web/Reports/ExportSalesDetailReport"
-LOGIN_URL = "https://www.wansoft.net/Wansoft.Web/"
+# WANSOFT_BASE_URL points the downloader at another server (e.g. wansoft_stub_server.py)
+BASE_URL = os.getenv("WANSOFT_BASE_URL", "https://www.wansoft.net").rstrip("/")
+REPORT_URL = f"{BASE_URL}/Wansoft.Web/Reports/ExportSalesDetailReport"
+LOGIN_URL = f"{BASE_URL}/Wansoft.Web/"
+# "http": pooled httpx client with the login cookies; "browser": fetch inside Chromium (previous path)
+DOWNLOAD_MODE = os.getenv("WANSOFT_DOWNLOAD_MODE", "http")
+# HTTP/2 only when the h2 package is installed (httpx[http2])
+HTTP2 = importlib.util.find_spec("h2") is not None
+HTTP_TIMEOUT = httpx.Timeout(float(os.getenv("WANSOFT_HTTP_TIMEOUT", "300")), connect=15.0)
+# Reports in flight at once, and request starts per second per host (0 = no limit)
+MAX_CONCURRENCY = int(os.getenv("WANSOFT_MAX_CONCURRENCY", "4"))
+RATE_LIMIT = float(os.getenv("WANSOFT_RATE_LIMIT", "2"))
+# Per-report retries on transient failures (5xx / 429 / timeouts / JS errors), exponential
+# backoff with full jitter, and a wall-clock cap per attempt (also covers browser mode)
+MAX_RETRIES = int(os.getenv("WANSOFT_MAX_RETRIES", "3"))
+BACKOFF_BASE = float(os.getenv("WANSOFT_BACKOFF_BASE", "1"))
+BACKOFF_MAX = 30.0
+REPORT_TIMEOUT = float(os.getenv("WANSOFT_REPORT_TIMEOUT", "600"))
+# Circuit breaker per host: opens after this many consecutive transient failures
+CIRCUIT_THRESHOLD = int(os.getenv("WANSOFT_CIRCUIT_THRESHOLD", "5"))
+CIRCUIT_COOLDOWN = float(os.getenv("WANSOFT_CIRCUIT_COOLDOWN", "30"))
+CIRCUIT_COOLDOWN_MAX = 300.0
+
+class SesionExpirada(Exception):
+    """
+    Wansoft rechazo la sesion (401 / 403 o redireccion al login) durante la descarga.
+    """
+
+class ErrorReporte(Exception):
+    """
+    Un reporte fallo. `reintentable` for transient failures (5xx, 429, JS / network errors);
+    `espera` carries the server's Retry-After in seconds, if any.
+    """
+    def __init__(self, mensaje, reintentable=False, espera=None):
+        super().__init__(mensaje)
+        self.reintentable = reintentable
+        self.espera = espera
+
+def _error_http(status, detalle, retry_after=None) -> ErrorReporte:
+    espera = None
+    if retry_after:
+        try:
+            espera = min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            pass  # HTTP-date form: plain backoff
+    reintentable = status == 429 or status >= 500
+    return ErrorReporte(f"HTTP {status} {detalle or ''}".strip(), reintentable, espera)
 
 async def get_wansoft_session_cookies(username, password):
     """
     Inicia sesión en Wansoft usando Playwright y devuelve las cookies.
     """
     print(f"[WANSOFT] Iniciando navegador para login de usuario: {username}")
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        context = await browser.new_context()
+    # Fresh context of the shared browser: no cookies from other accounts or jobs
+    async with navegador.contexto() as context:
         page = await context.new_page()
 
         try:
@@ -58,91 +111,452 @@ async def get_wansoft_session_cookies(username, password):
             print(f"[WANSOFT] Error en login: {e}")
             traceback.print_exc()
             raise e
+
+class LimitadorTasa:
+    """
+    Espaciado minimo entre inicios de request (por host), compartido entre jobs concurrentes.
+    """
+    def __init__(self, por_segundo: float):
+        self.intervalo = 1.0 / por_segundo if por_segundo and por_segundo > 0 else 0.0
+        self._siguiente = 0.0
+        self._lock = asyncio.Lock()
+
+    async def esperar(self):
+        if not self.intervalo:
+            return
+        async with self._lock:
+            ahora = time.monotonic()
+            espera = self._siguiente - ahora
+            self._siguiente = max(ahora, self._siguiente) + self.intervalo
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+_limitadores = {}
+
+def limitador_host(url: str, por_segundo: float) -> LimitadorTasa:
+    clave = (urlsplit(url).netloc, por_segundo)
+    if clave not in _limitadores:
+        _limitadores[clave] = LimitadorTasa(por_segundo)
+    return _limitadores[clave]
+
+class CircuitoHost:
+    """
+    Circuit breaker por host, compartido entre jobs. Tras `umbral` fallas transitorias seguidas
+    se abre: nadie pide nada durante el enfriamiento. Then a single probe goes through
+    (half-open); success closes it, failure reopens it with a doubled cooldown.
+    """
+    def __init__(self, umbral: int, enfriamiento: float):
+        self.umbral = max(1, umbral)
+        self.enfriamiento_base = enfriamiento
+        self.enfriamiento = enfriamiento
+        self.fallas = 0
+        self.abierto_hasta = 0.0
+        self._sonda = None
+        self.aperturas = 0
+
+    @property
+    def probando(self) -> bool:
+        return self._sonda is not None
+
+    @property
+    def estado(self) -> str:
+        if self.fallas < self.umbral:
+            return "cerrado"
+        return "medio-abierto" if self.probando or time.monotonic() >= self.abierto_hasta else "abierto"
+
+    async def esperar(self):
+        """
+        Espera a que el circuito deje pasar un request. Returns a probe token when this caller
+        is the half-open probe (else None); pass it to soltar() once the attempt is over.
+        """
+        while self.fallas >= self.umbral:
+            espera = self.abierto_hasta - time.monotonic()
+            if espera > 0:
+                await asyncio.sleep(espera)
+            elif self._sonda is None:
+                self._sonda = object()
+                return self._sonda
+            else:
+                await asyncio.sleep(0.5)  # another request is probing
+        return None
+
+    def soltar(self, sonda):
+        # Probe ended without exito() / falla() (cancelled, unexpected error): next caller probes
+        if sonda is not None and self._sonda is sonda:
+            self._sonda = None
+
+    def exito(self):
+        self.fallas = 0
+        self._sonda = None
+        self.enfriamiento = self.enfriamiento_base
+
+    def falla(self):
+        self.fallas += 1
+        if self.probando:
+            self.enfriamiento = min(self.enfriamiento * 2, CIRCUIT_COOLDOWN_MAX)
+        if self.probando or self.fallas == self.umbral:
+            self.abierto_hasta = time.monotonic() + self.enfriamiento
+            self.aperturas += 1
+            print(f"[WANSOFT] Circuito abierto por {self.enfriamiento:.0f}s tras {self.fallas} fallas seguidas")
+        self._sonda = None
+
+_circuitos = {}
+
+def circuito_host(url: str) -> CircuitoHost:
+    clave = urlsplit(url).netloc
+    if clave not in _circuitos:
+        _circuitos[clave] = CircuitoHost(CIRCUIT_THRESHOLD, CIRCUIT_COOLDOWN)
+    return _circuitos[clave]
+
+def _backoff(intento: int, espera=None) -> float:
+    # Full jitter: uniform in [0, base * 2^intento], capped; Retry-After is a floor
+    tope = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** intento))
+    return max(espera or 0.0, random.uniform(0, tope))
+
+def subsidiarias() -> List[int]:
+    return [s for s in range(SUBSIDIARY_START, SUBSIDIARY_END + 1) if s not in EXCLUDED_IDS]
+
+async def _descargar_subsidiaria(page, sub_id, start_date, end_date):
+    """
+    Un reporte via fetch dentro de la pagina (cookies de sesion del navegador).
+    Returns (filename, archivo) or None if the report came back empty.
+    Raises ErrorReporte if Wansoft answered with an error.
+    """
+    result = await page.evaluate(f"""async () => {{
+        try {{
+            const params = new URLSearchParams();
+            params.append('subsidiaryId', '{sub_id}');
+            params.append('startDate', '{start_date}');
+            params.append('endDate', '{end_date}');
+
+            const res = await fetch('{REPORT_URL}', {{
+                method: 'POST',
+                headers: {{
+                    'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
+                    'X-Requested-With': 'XMLHttpRequest'
+                }},
+                body: params
+            }});
+            
+            if (!res.ok) return {{ error: res.status, statusText: res.statusText, retryAfter: res.headers.get('Retry-After') }};
+            return await res.json();
+        }} catch (err) {{
+            return {{ error: 'JS Exception', details: err.toString() }};
+        }}
+    }}""")
+    
+    if result.get("error") in (401, 403):
+        raise SesionExpirada(f"HTTP {result['error']} en ID {sub_id}")
+    if result.get("error") == 'JS Exception':
+        # fetch itself failed (network / aborted): transient
+        raise ErrorReporte(f"JS {result.get('details')}", reintentable=True)
+    if result.get("error"):
+        raise _error_http(result["error"], result.get("statusText"), result.get("retryAfter"))
+    b64_str = result.get('fileBase64') or result.get('FileContents') or result.get('Data')
+    if not b64_str:
+        print(f"[WANSOFT] No se encontró base64 válido para ID {sub_id}. Keys encontradas: {list(result.keys())}")
+        return None
+    # The string came whole from the page; decode it by slices into the temp file
+    decodificador = DecodificadorReporte()
+    decodificador.procesar(b'{"fileBase64":"')
+    for i in range(0, len(b64_str), B64_CHUNK):
+        decodificador.procesar(b64_str[i:i + B64_CHUNK].encode("ascii"))
+    decodificador.procesar(b'"}')
+    return _archivo_reporte(decodificador, sub_id, start_date, end_date)
+
+# Report bytes stay in RAM up to this size, then spill to a temp file
+SPOOL_MAX_BYTES = 4 * 1024 * 1024
+B64_CHUNK = 1024 * 1024  # multiple of 4
+CLAVES_BASE64 = re.compile(rb'"(?:fileBase64|FileContents|Data)"\s*:\s*"')
+
+class DecodificadorReporte:
+    """
+    JSON del reporte por bloques -> bytes del archivo en un SpooledTemporaryFile.
+    Only the part before the base64 value is buffered (for error messages); the value is
+    decoded as it streams, so the JSON text, the base64 string and the bytes never coexist.
+    """
+    def __init__(self):
+        self.archivo = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        self.prefijo = b""
+        self.bytes = 0
+        self._pendiente = b""
+        self._estado = "buscando"  # -> "valor" -> "fin"
+
+    def _escribir(self, b64: bytes, final=False):
+        # JSON may escape "/" as "\/"; base64 itself has no backslashes
+        datos = self._pendiente + b64.replace(b"\\", b"")
+        corte = len(datos) if final else len(datos) - len(datos) % 4
+        if corte:
+            decodificado = base64.b64decode(datos[:corte])
+            self.archivo.write(decodificado)
+            self.bytes += len(decodificado)
+        self._pendiente = datos[corte:]
+
+    def procesar(self, chunk: bytes):
+        if self._estado == "buscando":
+            self.prefijo += chunk
+            m = CLAVES_BASE64.search(self.prefijo)
+            if not m:
+                return
+            chunk = self.prefijo[m.end():]
+            self.prefijo = self.prefijo[:m.start()]
+            self._estado = "valor"
+        if self._estado == "valor":
+            fin = chunk.find(b'"')
+            if fin == -1:
+                self._escribir(chunk)
+            else:
+                self._escribir(chunk[:fin], final=True)
+                self._estado = "fin"
+
+    def terminar(self):
+        """
+        True si se encontro el base64 completo (archivo en la posicion 0), si no False.
+        """
+        if self._estado != "fin" or not self.bytes:
+            self.archivo.close()
+            return False
+        self.archivo.seek(0)
+        return True
+
+    def claves(self):
+        # Keys of an answer without the report (error JSON), for the log
+        try:
+            return list(orjson.loads(self.prefijo).keys())
+        except Exception:
+            return self.prefijo[:200]
+
+def _archivo_reporte(decodificador: DecodificadorReporte, sub_id, start_date, end_date):
+    """
+    Reporte decodificado -> (filename, archivo temporal) o None si no trajo el base64.
+    """
+    if not decodificador.terminar():
+        print(f"[WANSOFT] No se encontró base64 válido para ID {sub_id}. Keys encontradas: {decodificador.claves()}")
+        return None
+    print(f"[WANSOFT] ID {sub_id} descargado correctamente. Bytes: {decodificador.bytes}")
+    return f"Reporte_{sub_id}_{start_date}_{end_date}.xlsx", decodificador.archivo
+
+def cookies_httpx(cookies) -> httpx.Cookies:
+    """
+    Cookies de Playwright (lista de dicts) -> jar de httpx con su dominio y path.
+    """
+    jar = httpx.Cookies()
+    for c in cookies:
+        jar.set(c["name"], c["value"], domain=c.get("domain", ""), path=c.get("path", "/"))
+    return jar
+
+def cliente_http(cookies, max_concurrency: int = None) -> httpx.AsyncClient:
+    """
+    Cliente async con keep-alive (HTTP/2 si h2 esta instalado) y la sesion del login.
+    One connection pool per job: every report reuses the same connections.
+    """
+    max_concurrency = max(1, max_concurrency or MAX_CONCURRENCY)
+    return httpx.AsyncClient(
+        http2=HTTP2,
+        cookies=cookies_httpx(cookies),
+        timeout=HTTP_TIMEOUT,
+        limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+        headers={'X-Requested-With': 'XMLHttpRequest', 'Referer': LOGIN_URL}
+    )
+
+async def _descargar_subsidiaria_http(client: httpx.AsyncClient, sub_id, start_date, end_date):
+    """
+    Un reporte por POST directo (sin navegador). Same result as _descargar_subsidiaria.
+    """
+    async with client.stream("POST", REPORT_URL, data={
+        'subsidiaryId': str(sub_id),
+        'startDate': start_date,
+        'endDate': end_date
+    }) as res:
+        # Redirects are not followed: an expired session answers 302 to the login page
+        if res.status_code in (401, 403) or res.is_redirect:
+            raise SesionExpirada(f"HTTP {res.status_code} en ID {sub_id}")
+        if not res.is_success:
+            raise _error_http(res.status_code, res.reason_phrase, res.headers.get("Retry-After"))
+        # Body decoded as it arrives (base64 -> temp file), never held whole
+        decodificador = DecodificadorReporte()
+        try:
+            async for chunk in res.aiter_bytes():
+                decodificador.procesar(chunk)
+        except Exception:
+            decodificador.archivo.close()
+            raise
+    return _archivo_reporte(decodificador, sub_id, start_date, end_date)
+
+async def _descargar_todas(descargar_una, tareas, progress_callback, max_concurrency, rate_limit,
+                          al_llegar=None, metricas=None):
+    # Bounded-concurrency loop shared by both download modes; tareas = [(sub_id, start, end)]
+    semaforo = asyncio.Semaphore(max_concurrency)
+    limitador = limitador_host(REPORT_URL, rate_limit)
+    circuito = circuito_host(REPORT_URL)
+
+    rechazadas = []
+    vacias = set()
+
+    async def descargar(tarea):
+        sub_id, start_date, end_date = tarea
+        m = {"sucursal": sub_id, "inicio": start_date, "fin": end_date, "estado": "descargando",
+             "intentos": 0, "latencia_s": None, "total_s": None, "bytes": 0, "error": None}
+        if metricas is not None:
+            metricas.append(m)
+        t0 = time.monotonic()
+        try:
+            while True:
+                # Backoff and an open circuit wait outside the semaphore: other reports keep going
+                sonda = await circuito.esperar()
+                try:
+                    async with semaforo:
+                        await limitador.esperar()
+                        m["intentos"] += 1
+                        intento = f" (intento {m['intentos']})" if m["intentos"] > 1 else ""
+                        print(f"[WANSOFT] Descargando ID: {sub_id} ({start_date} a {end_date}){intento}...")
+                        inicio = time.monotonic()
+                        try:
+                            archivo = await asyncio.wait_for(descargar_una(sub_id, start_date, end_date), REPORT_TIMEOUT)
+                        except SesionExpirada as e:
+                            circuito.exito()  # the server answered
+                            print(f"[WANSOFT] Sesión rechazada en ID {sub_id}: {e}")
+                            m.update(estado="sesion", error=str(e))
+                            rechazadas.append(tarea)
+                            return tarea, None
+                        except asyncio.TimeoutError:
+                            error = ErrorReporte(f"Sin respuesta en {REPORT_TIMEOUT:.0f}s", reintentable=True)
+                        except (ErrorReporte, httpx.TransportError) as e:
+                            error = e
+                        except Exception as e:
+                            print(f"[WANSOFT] Error descargando ID {sub_id}: {e}")
+                            traceback.print_exc()
+                            error = ErrorReporte(str(e) or type(e).__name__)
+                        else:
+                            circuito.exito()
+                            m["latencia_s"] = round(time.monotonic() - inicio, 2)
+                            if not archivo:
+                                m["estado"] = "vacio"
+                                vacias.add(tarea)
+                                return tarea, None
+                            m["bytes"] = archivo[1].seek(0, io.SEEK_END)
+                            archivo[1].seek(0)
+                            m["estado"] = "ok"
+                            return tarea, archivo
+
+                    # Network errors are transient too
+                    reintentable = getattr(error, "reintentable", True)
+                    m["error"] = str(error) or type(error).__name__
+                    if not reintentable:
+                        circuito.exito()
+                        print(f"[WANSOFT] ID {sub_id} falló sin reintento: {m['error']}")
+                        m["estado"] = "fallido"
+                        return tarea, None
+                    circuito.falla()
+                    if m["intentos"] > MAX_RETRIES:
+                        print(f"[WANSOFT] ID {sub_id} falló tras {m['intentos']} intentos: {m['error']}")
+                        m["estado"] = "fallido"
+                        return tarea, None
+                finally:
+                    circuito.soltar(sonda)
+                espera = _backoff(m["intentos"], getattr(error, "espera", None))
+                print(f"[WANSOFT] ID {sub_id}: {m['error']}; reintento en {espera:.1f}s")
+                m["estado"] = "reintentando"
+                await asyncio.sleep(espera)
         finally:
-            await browser.close()
+            m["total_s"] = round(time.monotonic() - t0, 2)
+
+    n_subs = len({t[0] for t in tareas})
+    if progress_callback: progress_callback(f"Descargando {len(tareas)} reportes de {n_subs} sucursales...", 10)
+    descargados = {}
+    completados = 0
+    pendientes = [asyncio.ensure_future(descargar(t)) for t in tareas]
+    try:
+        for pendiente in asyncio.as_completed(pendientes):
+            tarea, archivo = await pendiente
+            completados += 1
+            if archivo:
+                descargados[tarea] = archivo
+                if al_llegar:
+                    await al_llegar(tarea, archivo)
+            elif tarea in vacias and al_llegar:
+                await al_llegar(tarea, None)
+            current_progress = 10 + int((completados / len(tareas)) * 80) # 10% to 90%
+            if progress_callback:
+                progress_callback(f"Sucursal {tarea[0]} lista ({completados}/{len(tareas)})...", current_progress)
+    finally:
+        # Job cancelled or al_llegar failed: stop the downloads still in flight (each one releases
+        # its circuit probe) before the client closes, instead of leaving them orphaned
+        for t in pendientes:
+            t.cancel()
+        await asyncio.gather(*pendientes, return_exceptions=True)
+
+    if rechazadas:
+        # The caller logs in again and repeats the download; what did come back rides along
+        error = SesionExpirada(f"Sesión rechazada en {len(rechazadas)} reportes")
+        error.descargados = descargados
+        raise error
+    return descargados
 
-async def download_reports_raw(cookies, start_date, end_date, progress_callback=None) -> List[Tuple[str, bytes]]:
+async def descargar_ventanas(cookies, tareas, progress_callback=None,
+                             max_concurrency=None, rate_limit=None, mode=None, al_llegar=None,
+                             metricas=None) -> dict:
     """
-    Descarga los reportes iterando por ID y devuelve una lista de (filename, bytes).
-    progress_callback: function(message, percent)
+    Descarga un reporte por ventana (sub_id, start_date, end_date) y devuelve
+    {ventana: (filename, archivo)} con las que llegaron bien; archivo is a SpooledTemporaryFile
+    at position 0 that the caller closes. Up to `max_concurrency` reports are
+    in flight at once (WANSOFT_MAX_CONCURRENCY) and request starts are spaced to `rate_limit`
+    per second per host (WANSOFT_RATE_LIMIT, 0 = off).
+    `mode` (WANSOFT_DOWNLOAD_MODE): "http" posts with the session cookies from a pooled client,
+    "browser" runs fetch inside Chromium.
+    progress_callback: function(message, percent), called as each report finishes.
+    al_llegar: async function(ventana, (filename, archivo)), awaited as each report arrives
+    (pipelining); archivo is None for a window Wansoft answered without a report (no sales).
+    metricas: optional list; one dict per ventana is appended and kept up to date (estado,
+    intentos, latencia_s, total_s, bytes, error). Transient failures are retried up to
+    WANSOFT_MAX_RETRIES times with jittered backoff behind a per-host circuit breaker;
+    what still fails is left out of the result.
+    Raises SesionExpirada if Wansoft rejected the session cookies (its .descargados has the
+    reports that did arrive).
     """
-    print(f"[WANSOFT] Iniciando descarga de reportes {start_date} a {end_date}")
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
+    max_concurrency = max(1, max_concurrency or MAX_CONCURRENCY)
+    rate_limit = RATE_LIMIT if rate_limit is None else rate_limit
+    mode = mode or DOWNLOAD_MODE
+    print(f"[WANSOFT] Descargando {len(tareas)} reportes (concurrencia {max_concurrency}, modo {mode})")
+
+    if mode != "browser":
+        if progress_callback: progress_callback("Conectando al servidor de reportes...", 5)
+        async with cliente_http(cookies, max_concurrency) as client:
+            async def descargar_una(sub_id, start_date, end_date):
+                return await _descargar_subsidiaria_http(client, sub_id, start_date, end_date)
+            return await _descargar_todas(descargar_una, tareas, progress_callback, max_concurrency, rate_limit, al_llegar, metricas)
+
+    async with navegador.contexto() as context:
         # Cargamos cookies
-        context = await browser.new_context()
         await context.add_cookies(cookies)
-        
+
         page = await context.new_page()
         # Navegamos a cualquier pagina dentro del dominio para activar cookies antes del fetch
         if progress_callback: progress_callback("Conectando al servidor de reportes...", 5)
         print("[WANSOFT] Navegando al home para activar cookies...")
         await page.goto(LOGIN_URL) 
-        
-        downloaded_files = []
-        
-        # Calculate total steps for progress
-        total_subs = SUBSIDIARY_END - SUBSIDIARY_START + 1
-        processed_count = 0
-
-        for sub_id in range(SUBSIDIARY_START, SUBSIDIARY_END + 1):
-            processed_count += 1
-            current_progress = 10 + int((processed_count / total_subs) * 80) # 10% to 90%
-            
-            if sub_id in EXCLUDED_IDS:
-                print(f"[WANSOFT] Skipping ID {sub_id} (Excluido)")
-                if progress_callback: progress_callback(f"Omitiendo sucursal excluida ({sub_id})...", current_progress)
-                continue
-                
-            print(f"[WANSOFT] Descargando ID: {sub_id}...")
-            if progress_callback: progress_callback(f"Descargando sucursal ID {sub_id}...", current_progress)
-            
-            try:
-                # Ejecutar fetch en el contexto del navegador
-                result = await page.evaluate(f"""async () => {{
-                    try {{
-                        const params = new URLSearchParams();
-                        params.append('subsidiaryId', '{sub_id}');
-                        params.append('startDate', '{start_date}');
-                        params.append('endDate', '{end_date}');
-
-                        const res = await fetch('{REPORT_URL}', {{
-                            method: 'POST',
-                            headers: {{
-                                'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
-                                'X-Requested-With': 'XMLHttpRequest'
-                            }},
-                            body: params
-                        }});
-                        
-                        if (!res.ok) return {{ error: res.status, statusText: res.statusText }};
-                        return await res.json();
-                    }} catch (err) {{
-                        return {{ error: 'JS Exception', details: err.toString() }};
-                    }}
-                }}""")
-                
-                if result.get("error"):
-                    print(f"[WANSOFT] Error HTTP/JS {result['error']} en ID {sub_id}: {result.get('statusText') or result.get('details')}")
-                    continue
-
-                # Extraer Base64
-                b64_str = result.get('fileBase64') or result.get('FileContents') or result.get('Data')
-                
-                if b64_str:
-                    file_bytes = base64.b64decode(b64_str)
-                    filename = f"Reporte_{sub_id}_{start_date}_{end_date}.xlsx"
-                    downloaded_files.append((filename, file_bytes))
-                    print(f"[WANSOFT] ID {sub_id} descargado correctamente. Bytes: {len(file_bytes)}")
-                else:
-                    print(f"[WANSOFT] No se encontró base64 válido para ID {sub_id}. Keys encontradas: {list(result.keys())}")
-
-            except Exception as e:
-                print(f"[WANSOFT] Error descargando ID {sub_id}: {e}")
-                traceback.print_exc()
-            
-            # Pequeña pausa para no saturar
-            await asyncio.sleep(0.5)
-            
-        await browser.close()
-        return downloaded_files
+
+        # Fetches from one page run concurrently in the browser; the semaphore bounds them
+        async def descargar_una(sub_id, start_date, end_date):
+            return await _descargar_subsidiaria(page, sub_id, start_date, end_date)
+        return await _descargar_todas(descargar_una, tareas, progress_callback, max_concurrency, rate_limit, al_llegar, metricas)
+
+async def download_reports_raw(cookies, start_date, end_date, progress_callback=None,
+                               max_concurrency=None, rate_limit=None, mode=None) -> List[Tuple[str, bytes]]:
+    """
+    Descarga los reportes de todas las subsidiarias para todo el rango y devuelve una lista
+    de (filename, bytes) en orden de ID. Options as in descargar_ventanas.
+    Raises SesionExpirada if Wansoft rejected the session cookies.
+    """
+    print(f"[WANSOFT] Iniciando descarga de reportes {start_date} a {end_date}")
+    for sub_id in EXCLUDED_IDS:
+        print(f"[WANSOFT] Skipping ID {sub_id} (Excluido)")
+    tareas = [(sub_id, start_date, end_date) for sub_id in subsidiarias()]
+    descargados = await descargar_ventanas(cookies, tareas, progress_callback, max_concurrency, rate_limit, mode)
+    archivos = []
+    for t in tareas:
+        if t in descargados:
+            filename, archivo = descargados[t]
+            with archivo:
+                archivos.append((filename, archivo.read()))
+    return archivos
@@ -0,0 +1,110 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import time
+import httpx
+import orjson
+from cryptography.fernet import Fernet, InvalidToken
+from services.wansoft_service import LOGIN_URL, HTTP_TIMEOUT, cookies_httpx, get_wansoft_session_cookies
+
+# Login cookies per Wansoft account, encrypted at rest (Fernet, key derived from SECRET_KEY).
+# Files are named by an HMAC of user + password: a wrong password never finds a session.
+SESSION_DIR = os.getenv("WANSOFT_SESSION_DIR", os.path.join("uploads", ".wansoft_sessions"))
+SESSION_TTL = int(os.getenv("WANSOFT_SESSION_TTL", str(20 * 60)))
+# A session probed this recently is reused without a new probe
+PROBE_INTERVAL = 60
+
+_secret = os.getenv("SECRET_KEY", "tu_clave_secreta_super_segura_cambiar_en_prod").encode()
+_fernet = Fernet(base64.urlsafe_b64encode(hashlib.sha256(b"wansoft-session\x00" + _secret).digest()))
+
+# clave -> {"cookies", "probada"}; avoids disk + decrypt on every job
+_memoria = {}
+_locks = {}
+
+def _clave(username: str, password: str) -> str:
+    return hmac.new(_secret, f"{username}\x00{password}".encode(), hashlib.sha256).hexdigest()
+
+def _ruta(clave: str) -> str:
+    return os.path.join(SESSION_DIR, f"{clave[:32]}.session")
+
+def guardar_sesion(username: str, password: str, cookies: list):
+    clave = _clave(username, password)
+    _memoria[clave] = {"cookies": cookies, "creada": time.time(), "probada": time.time()}
+    os.makedirs(SESSION_DIR, exist_ok=True)
+    path = _ruta(clave)
+    # The Fernet token carries its own timestamp; cargar_sesion enforces the TTL with it
+    with open(path + ".tmp", "wb") as f:
+        f.write(_fernet.encrypt(orjson.dumps(cookies)))
+    os.replace(path + ".tmp", path)
+
+def cargar_sesion(username: str, password: str):
+    """
+    Cookies guardadas de la cuenta si no han vencido (TTL), si no None.
+    """
+    clave = _clave(username, password)
+    entrada = _memoria.get(clave)
+    if entrada and time.time() - entrada["creada"] < SESSION_TTL:
+        return entrada["cookies"]
+    path = _ruta(clave)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            token = f.read()
+        cookies = orjson.loads(_fernet.decrypt(token, ttl=SESSION_TTL))
+        _memoria[clave] = {"cookies": cookies, "creada": _fernet.extract_timestamp(token), "probada": 0}
+        return cookies
+    except InvalidToken:
+        # Expired, or encrypted with another SECRET_KEY
+        invalidar_sesion(username, password)
+        return None
+    except Exception as e:
+        print(f"[WANSOFT] Error leyendo sesión guardada: {e}")
+        return None
+
+def invalidar_sesion(username: str, password: str):
+    clave = _clave(username, password)
+    _memoria.pop(clave, None)
+    try:
+        os.remove(_ruta(clave))
+    except FileNotFoundError:
+        pass
+
+async def sesion_valida(cookies: list) -> bool:
+    """
+    Prueba barata: una pagina de la app con las cookies; sin sesion Wansoft redirige al login.
+    """
+    try:
+        async with httpx.AsyncClient(cookies=cookies_httpx(cookies), timeout=HTTP_TIMEOUT, follow_redirects=True) as client:
+            res = await client.get(LOGIN_URL)
+        return res.is_success and "Login" not in str(res.url)
+    except Exception as e:
+        print(f"[WANSOFT] Error probando sesión guardada: {e}")
+        return False
+
+async def obtener_sesion(username: str, password: str, forzar_login: bool = False):
+    """
+    Cookies de sesion de la cuenta: la guardada si sigue valida, si no un login nuevo.
+    Returns (cookies, reutilizada). Jobs of the same account wait for one login instead of
+    each starting a browser.
+    """
+    clave = _clave(username, password)
+    lock = _locks.setdefault(clave, asyncio.Lock())
+    async with lock:
+        if forzar_login:
+            invalidar_sesion(username, password)
+        else:
+            cookies = cargar_sesion(username, password)
+            if cookies is not None:
+                entrada = _memoria[clave]
+                if time.time() - entrada["probada"] < PROBE_INTERVAL or await sesion_valida(cookies):
+                    entrada["probada"] = time.time()
+                    print("[WANSOFT] Reutilizando sesión guardada")
+                    return cookies, True
+                invalidar_sesion(username, password)
+
+        cookies = await get_wansoft_session_cookies(username, password)
+        guardar_sesion(username, password, cookies)
+        return cookies, False
@@ -0,0 +1,177 @@
+import io
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+
+# Fast value reader (Rust); openpyxl read-only is the fallback
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
+
+NS_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+NS_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+NS_PKG_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+TIPO_COMENTARIOS = "/comments"
+
+def leer_valores(content: bytes, filtro_hoja=None) -> dict:
+    """
+    Fase 1: valores de cada hoja como lista de filas (sin estilos ni comentarios).
+    Row/column 0 is always Excel's A1, like `list(ws.values)` in openpyxl; empty cells are None.
+    `filtro_hoja(nombre) -> bool` skips sheets before they are parsed.
+    """
+    if CalamineWorkbook is not None:
+        try:
+            return _valores_calamine(content, filtro_hoja)
+        except Exception as e:
+            print(f"calamine failed, falling back to openpyxl: {e}")
+    return _valores_openpyxl(content, filtro_hoja)
+
+def _valores_calamine(content, filtro_hoja):
+    wb = CalamineWorkbook.from_filelike(io.BytesIO(content))
+    hojas = {}
+    for nombre in wb.sheet_names:
+        if filtro_hoja and not filtro_hoja(nombre):
+            continue
+        filas = wb.get_sheet_by_name(nombre).to_python(skip_empty_area=False)
+        # calamine returns "" for empty cells
+        hojas[nombre] = [[None if v == "" else v for v in fila] for fila in filas]
+    return hojas
+
+def _valores_openpyxl(content, filtro_hoja):
+    import openpyxl
+
+    wb = openpyxl.load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+    try:
+        hojas = {}
+        for nombre in wb.sheetnames:
+            if filtro_hoja and not filtro_hoja(nombre):
+                continue
+            ws = wb[nombre]
+            hojas[nombre] = [list(fila) for fila in ws.iter_rows(min_row=1, min_col=1, values_only=True)]
+        return hojas
+    finally:
+        wb.close()
+
+def nombres_hojas(content: bytes) -> list:
+    """
+    Nombres de las hojas en el orden del libro, sin leer celdas.
+    """
+    if CalamineWorkbook is not None:
+        try:
+            return list(CalamineWorkbook.from_filelike(io.BytesIO(content)).sheet_names)
+        except Exception as e:
+            print(f"calamine failed, falling back to openpyxl: {e}")
+    import openpyxl
+
+    wb = openpyxl.load_workbook(io.BytesIO(content), read_only=True)
+    try:
+        return list(wb.sheetnames)
+    finally:
+        wb.close()
+
+def ref_celda(fila: int, col: int) -> str:
+    """
+    (fila, columna) base 0 -> referencia A1 ("C5").
+    """
+    letras = ""
+    col += 1
+    while col:
+        col, resto = divmod(col - 1, 26)
+        letras = chr(65 + resto) + letras
+    return f"{letras}{fila + 1}"
+
+class ComentariosXlsx:
+    """
+    Fase 2: comentarios leidos directo de las partes XML del .xlsx, una hoja a la vez y
+    solo cuando se piden. Text is the concatenation of all runs, as openpyxl's comment.text.
+    """
+    def __init__(self, content: bytes):
+        self._content = content
+        self._zip = None
+        self._rutas = None
+        self._por_hoja = {}
+
+    def _abrir(self):
+        if self._zip is None:
+            self._zip = zipfile.ZipFile(io.BytesIO(self._content))
+            self._rutas = self._rutas_hojas()
+        return self._zip
+
+    def _rels(self, ruta_parte: str) -> dict:
+        # Relationships of a part: Id -> (Type, absolute target path)
+        base, nombre = posixpath.split(ruta_parte)
+        ruta_rels = posixpath.join(base, "_rels", nombre + ".rels")
+        try:
+            raiz = ET.fromstring(self._zip.read(ruta_rels))
+        except KeyError:
+            return {}
+        rels = {}
+        for rel in raiz.iter(f"{NS_PKG_REL}Relationship"):
+            target = rel.get("Target", "")
+            if target.startswith("/"):
+                ruta = target.lstrip("/")
+            else:
+                ruta = posixpath.normpath(posixpath.join(base, target))
+            rels[rel.get("Id")] = (rel.get("Type", ""), ruta)
+        return rels
+
+    def _rutas_hojas(self) -> dict:
+        # Sheet name -> worksheet part path
+        libro = "xl/workbook.xml"
+        rels = self._rels(libro)
+        raiz = ET.fromstring(self._zip.read(libro))
+        rutas = {}
+        for hoja in raiz.iter(f"{NS_MAIN}sheet"):
+            rel = rels.get(hoja.get(f"{NS_REL}id"))
+            if rel:
+                rutas[hoja.get("name")] = rel[1]
+        return rutas
+
+    def de_hoja(self, hoja: str) -> dict:
+        """
+        {ref A1: texto} de los comentarios de la hoja (vacio si no tiene).
+        """
+        if hoja in self._por_hoja:
+            return self._por_hoja[hoja]
+        comentarios = {}
+        try:
+            self._abrir()
+            ruta_hoja = self._rutas.get(hoja)
+            if ruta_hoja:
+                for tipo, ruta in self._rels(ruta_hoja).values():
+                    if tipo.endswith(TIPO_COMENTARIOS):
+                        comentarios.update(self._leer_parte(ruta))
+        except Exception as e:
+            print(f"Error reading comments of sheet {hoja}: {e}")
+        self._por_hoja[hoja] = comentarios
+        return comentarios
+
+    def _leer_parte(self, ruta: str) -> dict:
+        raiz = ET.fromstring(self._zip.read(ruta))
+        comentarios = {}
+        for comentario in raiz.iter(f"{NS_MAIN}comment"):
+            texto = comentario.find(f"{NS_MAIN}text")
+            if texto is None:
+                continue
+            partes = []
+            for nodo in texto:
+                if nodo.tag == f"{NS_MAIN}t":
+                    partes.append(nodo.text or "")
+                elif nodo.tag == f"{NS_MAIN}r":
+                    t = nodo.find(f"{NS_MAIN}t")
+                    if t is not None:
+                        partes.append(t.text or "")
+            comentarios[comentario.get("ref")] = "".join(partes)
+        return comentarios
+
+    def texto(self, hoja: str, fila: int, col: int):
+        """
+        Texto del comentario de una celda (base 0) o None.
+        """
+        return self.de_hoja(hoja).get(ref_celda(fila, col))
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
@@ -0,0 +1,28 @@
+import os
+import sys
+import pandas as pd
+import pytest
+
+# Tests import the backend modules the way main.py does (services.*)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def ventas():
+    """
+    Ventas limpias ya enriquecidas (as analysis_service hands them to the services).
+    Ticket (CENTRO, 1) has Pollo + Puerco; MovimientoPDV restarts per sucursal.
+    2026-01-05 and 2026-01-12 are Mondays, 2026-01-06 a Tuesday.
+    """
+    return pd.DataFrame({
+        'Fecha': pd.to_datetime(['2026-01-05', '2026-01-05', '2026-01-05', '2026-01-06', '2026-01-06', '2026-01-12']),
+        'Hora_Venta': ['12:10', '12:10', '12:40', '13:05', '13:05', '12:15'],
+        'Sucursal': ['CENTRO', 'CENTRO', 'NORTE', 'CENTRO', 'CENTRO', 'CENTRO'],
+        'MovimientoPDV': ['1', '1', '1', '2', '2', '3'],
+        'Producto_Normalizado': [
+            'Pollo (Tradicional)', 'Puerco (Tradicional)', 'Puerco (Tradicional)',
+            'Pollo (Tradicional)', 'Media Docena', 'Pollo (Tradicional)'
+        ],
+        'Categoria': ['Tamal', 'Tamal', 'Tamal', 'Tamal', 'Paquete', 'Tamal'],
+        'Unidades_Reales': [2.0, 1.0, 1.0, 3.0, 6.0, 1.0],
+        'Total_Venta': [50.0, 25.0, 25.0, 75.0, 150.0, 25.0],
+    })
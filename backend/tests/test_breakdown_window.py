@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from services.breakdown_service import window_breakdown
+
+COLUMNAS = ["2026-01-01", "2026-01-02", "2026-01-03", "2026-01-04"]
+
+@pytest.fixture
+def resultado():
+    # Shape of a cached process_breakdown result (plain pivot)
+    return {
+        "row_key": "Producto_Normalizado",
+        "columns": COLUMNAS,
+        "available_sucursales": ["CENTRO"],
+        "data": [
+            {"Producto_Normalizado": f"P{i}", **{c: float((i + j) % 3) for j, c in enumerate(COLUMNAS)}}
+            for i in range(5)
+        ]
+    }
+
+def test_records_window(resultado):
+    window = window_breakdown(resultado, row_offset=1, row_limit=2, column_start="2026-01-02", column_end="2026-01-03")
+
+    assert window["columns"] == ["2026-01-02", "2026-01-03"]
+    assert (window["total_rows"], window["total_columns"], window["row_offset"]) == (5, 4, 1)
+    assert window["data"] == [
+        {"Producto_Normalizado": "P1", "2026-01-02": 2.0, "2026-01-03": 0.0},
+        {"Producto_Normalizado": "P2", "2026-01-02": 0.0, "2026-01-03": 1.0},
+    ]
+    # The cached frame never leaks into the response
+    assert "_tabla" not in window and window["available_sucursales"] == ["CENTRO"]
+
+def test_sparse_window(resultado):
+    window = window_breakdown(resultado, row_limit=2, sparse=True)
+
+    assert window["encoding"] == "sparse"
+    assert window["rows"] == ["P0", "P1"]
+    # Row-major [row, column, value], zeros left out
+    assert window["cells"] == [[0, 1, 1.0], [0, 2, 2.0], [1, 0, 1.0], [1, 1, 2.0], [1, 3, 1.0]]
+
+def test_columnar_window(resultado):
+    window = window_breakdown(resultado, row_offset=3, layout="columnar")
+
+    data = window["data"]
+    assert data["columns"] == ["Producto_Normalizado"] + COLUMNAS
+    assert data["data"]["Producto_Normalizado"] == ["P3", "P4"]
+    np.testing.assert_array_equal(data["data"]["2026-01-01"], [0.0, 1.0])
+
+def test_window_past_the_end(resultado):
+    window = window_breakdown(resultado, row_offset=10, row_limit=5)
+    assert window["data"] == [] and window["total_rows"] == 5
+
+def test_split_window_clips_periods():
+    resultado = {
+        "row_key": "Producto_Normalizado",
+        "columns": COLUMNAS,
+        "split_by": "sucursal",
+        "data": [{
+            "Producto_Normalizado": "P0",
+            "total": {"2026-01-01": 3, "2026-01-04": 1},
+            "sucursales": {"CENTRO": {"2026-01-01": 3}, "NORTE": {"2026-01-04": 1}}
+        }]
+    }
+    window = window_breakdown(resultado, column_end="2026-01-02")
+
+    assert window["data"] == [{"Producto_Normalizado": "P0", "total": {"2026-01-01": 3}, "sucursales": {"CENTRO": {"2026-01-01": 3}}}]
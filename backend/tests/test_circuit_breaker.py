@@ -0,0 +1,97 @@
+import asyncio
+import httpx
+import pytest
+import services.wansoft_service as wansoft
+from services.wansoft_service import CircuitoHost, circuito_host, descargar_ventanas
+
+def _abierto(enfriamiento=0.05, umbral=2):
+    circuito = CircuitoHost(umbral, enfriamiento)
+    for _ in range(umbral):
+        circuito.falla()
+    return circuito
+
+def test_opens_after_threshold():
+    circuito = CircuitoHost(3, 30)
+    circuito.falla()
+    circuito.falla()
+    assert circuito.estado == "cerrado"
+
+    circuito.falla()
+    assert circuito.estado == "abierto" and circuito.aperturas == 1
+
+    circuito.exito()
+    assert circuito.estado == "cerrado" and circuito.fallas == 0
+
+def test_single_probe_after_cooldown():
+    async def escenario():
+        circuito = _abierto()
+        sonda = await circuito.esperar()
+        assert sonda is not None and circuito.estado == "medio-abierto"
+
+        # Everyone else waits for the probe's verdict
+        otro = asyncio.ensure_future(circuito.esperar())
+        await asyncio.sleep(0.1)
+        assert not otro.done()
+
+        circuito.exito()
+        assert await asyncio.wait_for(otro, 2) is None
+
+    asyncio.run(escenario())
+
+def test_failed_probe_doubles_cooldown(monkeypatch):
+    monkeypatch.setattr(wansoft, "CIRCUIT_COOLDOWN_MAX", 0.15)
+
+    async def escenario():
+        circuito = _abierto(enfriamiento=0.05)
+        for esperado in (0.1, 0.15, 0.15):
+            await circuito.esperar()
+            circuito.falla()
+            assert circuito.enfriamiento == esperado and circuito.estado == "abierto"
+        assert circuito.aperturas == 4
+
+    asyncio.run(escenario())
+
+def test_released_probe_lets_the_next_caller_probe():
+    async def escenario():
+        circuito = _abierto()
+        vieja = await circuito.esperar()
+        circuito.soltar(vieja)
+        assert not circuito.probando
+
+        nueva = await asyncio.wait_for(circuito.esperar(), 2)
+        assert nueva is not None
+        # A stale token never clears a newer probe
+        circuito.soltar(vieja)
+        assert circuito.probando
+
+    asyncio.run(escenario())
+
+def test_cancelled_probe_does_not_wedge_the_circuit(monkeypatch):
+    monkeypatch.setattr(wansoft, "_circuitos", {})
+    en_vuelo = asyncio.Event()
+
+    async def colgado(request):
+        en_vuelo.set()
+        await asyncio.Event().wait()  # never answers
+
+    monkeypatch.setattr(wansoft, "cliente_http", lambda cookies, max_concurrency=None: httpx.AsyncClient(transport=httpx.MockTransport(colgado)))
+
+    async def escenario():
+        circuito = circuito_host(wansoft.REPORT_URL)
+        circuito.enfriamiento = 0.01
+        for _ in range(circuito.umbral):
+            circuito.falla()
+        await asyncio.sleep(0.02)
+
+        job = asyncio.ensure_future(descargar_ventanas([], [(8447, "2026-01-01", "2026-01-01")], rate_limit=0, mode="http"))
+        await asyncio.wait_for(en_vuelo.wait(), 2)
+        assert circuito.probando
+
+        job.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await job
+        # The next job can still probe instead of waiting forever
+        assert not circuito.probando
+        assert await asyncio.wait_for(circuito.esperar(), 2) is not None
+
+    asyncio.run(escenario())
@@ -0,0 +1,36 @@
+from services.comparison_service import compute_period_metrics
+
+def _fila(comparison, producto, sucursal="CENTRO"):
+    return next(r for r in comparison["rows"] if r["Producto_Normalizado"] == producto and r["Sucursal"] == sucursal)
+
+def test_previous_period_deltas(ventas):
+    comparison, _ = compute_period_metrics(ventas, "2026-01-06", "2026-01-06")
+
+    assert comparison["previous"] == {"start": "2026-01-05", "end": "2026-01-05", "days_with_data": 1}
+    pollo = _fila(comparison, "Pollo (Tradicional)")
+    assert (pollo["Unidades_Actual"], pollo["Unidades_Anterior"], pollo["Delta_Unidades_Pct"]) == (3.0, 2.0, 50.0)
+    assert _fila(comparison, "Puerco (Tradicional)")["Delta_Unidades_Pct"] == -100.0
+    # No previous sales: no percentage (null in records)
+    assert _fila(comparison, "Media Docena")["Delta_Unidades_Pct"] is None
+    assert comparison["totals"]["units_current"] == 9.0
+    assert comparison["totals"]["units_previous"] == 4.0
+
+def test_rolling_averages_use_days_before_the_window(ventas):
+    _, rolling = compute_period_metrics(ventas, "2026-01-06", "2026-01-06")
+
+    assert rolling["dates"] == ["2026-01-06"]
+    pollo = next(s for s in rolling["series"] if s["Producto_Normalizado"] == "Pollo (Tradicional)")
+    assert pollo["ma7"] == [2.5]
+    # Series without sales in the window are left out
+    assert {s["Producto_Normalizado"] for s in rolling["series"]} == {"Pollo (Tradicional)", "Media Docena"}
+
+def test_year_over_year_without_history(ventas):
+    comparison, _ = compute_period_metrics(ventas, compare_to="year")
+
+    assert comparison["compare_to"] == "year"
+    assert comparison["previous"]["days_with_data"] == 0
+    assert comparison["totals"]["units_delta_pct"] is None
+
+def test_columnar_layout(ventas):
+    comparison, _ = compute_period_metrics(ventas, "2026-01-06", "2026-01-06", layout="columnar")
+    assert "Delta_Venta" in comparison["rows"]["columns"]
@@ -0,0 +1,97 @@
+import gzip
+import io
+import openpyxl
+import pandas as pd
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+import services.export_service as export_service
+from services.export_service import (
+    iter_csv, iter_gzip, csv_streaming_response, escribir_xlsx, xlsx_streaming_response,
+    XLSX_MEDIA_TYPE, FORMATO_FECHA, FORMATO_NUMERO
+)
+
+@pytest.fixture
+def tabla():
+    return pd.DataFrame({
+        "Producto": ["Pollo (Tradicional)", "Piña", "Queso (Tradicional)", "Puerco (Tradicional)", "Dulce (Tradicional)"],
+        "Unidades": [3.0, 1.5, 0.0, 2.0, 7.0],
+        "Fecha": pd.to_datetime(["2026-01-05", "2026-01-06", None, "2026-01-07", "2026-01-08"]),
+    })
+
+def test_iter_csv_chunks_match_to_csv(tabla):
+    chunks = list(iter_csv(tabla, chunk_rows=2))
+
+    assert len(chunks) == 3
+    # Header and BOM only in the first block
+    assert chunks[0].startswith("\ufeffProducto,".encode("utf-8"))
+    assert not chunks[1].startswith(b"\xef\xbb\xbf") and b"Producto" not in chunks[1]
+    assert b"".join(chunks) == tabla.to_csv(index=False).encode("utf-8-sig")
+
+def test_iter_csv_empty_frame(tabla):
+    assert list(iter_csv(tabla.iloc[0:0])) == [tabla.iloc[0:0].to_csv(index=False).encode("utf-8-sig")]
+
+def test_iter_gzip_is_one_stream(tabla):
+    comprimido = b"".join(iter_gzip(iter_csv(tabla, chunk_rows=2)))
+    assert gzip.decompress(comprimido) == tabla.to_csv(index=False).encode("utf-8-sig")
+
+@pytest.fixture
+def cliente(tabla):
+    app = FastAPI()
+
+    @app.get("/csv")
+    async def csv(request: Request):
+        return csv_streaming_response(tabla, "tabla.csv", request)
+
+    return TestClient(app)
+
+@pytest.mark.parametrize("accept, comprimido", [
+    ("gzip, br", True),
+    ("gzip;q=0, br", False),
+    ("identity", False),
+])
+def test_csv_response_negotiates_gzip(cliente, tabla, accept, comprimido):
+    r = cliente.get("/csv", headers={"Accept-Encoding": accept})
+
+    assert r.status_code == 200
+    assert r.headers["vary"] == "Accept-Encoding"
+    assert (r.headers.get("content-encoding") == "gzip") == comprimido
+    assert r.headers["content-disposition"] == "attachment; filename=tabla.csv"
+    assert r.content == tabla.to_csv(index=False).encode("utf-8-sig")
+
+# --- XLSX ---
+
+def test_escribir_xlsx_round_trip(tabla, monkeypatch):
+    # Several row blocks, so block boundaries are exercised
+    monkeypatch.setattr(export_service, "XLSX_CHUNK_ROWS", 2)
+    mixta = pd.DataFrame({"Etiqueta": ["TOTAL", 4, None], "Total_Venta": [10.5, None, 3.0]})
+    destino = io.BytesIO()
+
+    escribir_xlsx({"DETALLE": tabla, "RESUMEN": mixta}, destino)
+
+    destino.seek(0)
+    hojas = pd.read_excel(destino, sheet_name=None)
+    assert list(hojas) == ["DETALLE", "RESUMEN"]
+    pd.testing.assert_frame_equal(hojas["DETALLE"], tabla, check_dtype=False)
+    assert hojas["RESUMEN"]["Etiqueta"].tolist()[:2] == ["TOTAL", 4]
+    assert pd.isna(hojas["RESUMEN"]["Total_Venta"][1])
+
+    destino.seek(0)
+    hoja = openpyxl.load_workbook(destino)["DETALLE"]
+    # Header in bold, dates and numbers with their formats, NaT left empty
+    assert hoja["A1"].font.bold
+    assert hoja["C2"].number_format == FORMATO_FECHA and hoja["C4"].value is None
+    assert hoja["B2"].number_format == FORMATO_NUMERO
+
+def test_xlsx_streaming_response(tabla):
+    app = FastAPI()
+
+    @app.get("/xlsx")
+    async def xlsx():
+        return xlsx_streaming_response(tabla, "tabla.xlsx")
+
+    r = TestClient(app).get("/xlsx")
+
+    assert r.headers["content-type"] == XLSX_MEDIA_TYPE
+    assert r.headers["content-disposition"] == "attachment; filename=tabla.xlsx"
+    assert pd.read_excel(io.BytesIO(r.content)).shape == tabla.shape
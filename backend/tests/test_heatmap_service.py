@@ -0,0 +1,28 @@
+from services.heatmap_service import compute_demand_heatmap
+
+def test_heatmap_totals_by_weekday_and_slot(ventas):
+    result = compute_demand_heatmap(ventas)
+
+    # Only the active hours are kept
+    assert result["slot_minutes"] == 60
+    assert result["slots"] == ["12:00", "13:00"]
+
+    todas = result["series"][0]
+    assert todas["sucursal"] == "TODAS"
+    # Monday 12:00: both Mondays, both sucursales; Tuesday 13:00 skips the package wrapper units
+    assert todas["units"][0] == [5.0, 0.0]
+    assert todas["units"][1] == [0.0, 3.0]
+    assert todas["sales"][1] == [0.0, 225.0]
+    assert [s["sucursal"] for s in result["series"]] == ["TODAS", "CENTRO", "NORTE"]
+    assert result["series"][2]["units"][0] == [1.0, 0.0]
+
+def test_heatmap_by_product_and_invalid_slot(ventas):
+    result = compute_demand_heatmap(ventas, slot_minutes=45, by_product=True)
+
+    assert result["slot_minutes"] == 60
+    pollo = next(s for s in result["series"] if s["sucursal"] == "TODAS" and s["producto"] == "Pollo (Tradicional)")
+    assert pollo["units"][0] == [3.0, 0.0]
+
+def test_heatmap_without_hours(ventas):
+    result = compute_demand_heatmap(ventas.drop(columns=["Hora_Venta"]))
+    assert result["series"] == [] and result["slots"] == []
@@ -0,0 +1,47 @@
+import os
+from services.pinned_store import (
+    hash_archivo, ruta_columnar, preparar_archivo_fijado, cargar_ventas_fijadas, cargar_rollup
+)
+
+CSV = (
+    "Sucursal,MovimientoPDV,Fecha,Hora_Venta,Producto_Final,Cantidad,Total_Venta,Paquete_Origen,Tipo_Oferta,Hash\n"
+    "CENTRO,1,2026-01-05,12:10,Tamal Pollo,2,50,N/A,VENTA REGULAR,1\n"
+    "CENTRO,1,2026-01-05,12:10,Tamal Puerco,1,25,N/A,VENTA REGULAR,2\n"
+    "NORTE,1,2026-01-06,13:05,Tamal Pollo,3,75,N/A,VENTA REGULAR,3\n"
+)
+
+def _fijar(tmp_path, contenido=CSV, nombre="ventas.csv"):
+    path = tmp_path / "tester" / nombre
+    path.parent.mkdir(exist_ok=True)
+    path.write_text(contenido, encoding="utf-8")
+    return {"filename": nombre, "path": str(path), "content_hash": hash_archivo(str(path)), "clean_status": "pending"}
+
+def test_prepare_publishes_status_without_touching_pinned_info(tmp_path):
+    info = _fijar(tmp_path)
+    original = dict(info)
+    cambios = []
+
+    preparar_archivo_fijado(info, precalculos=[lambda df: ("filas", {"filas": len(df)})], publicar=cambios.append)
+
+    assert info == original
+    assert [c["clean_status"] for c in cambios] == ["processing", "ready"]
+    listo = {**info, **cambios[-1]}
+    assert listo["rows"] == 3
+    assert os.path.basename(listo["clean_path"]) == f"ventas_{info['content_hash']}.parquet"
+    assert len(cargar_ventas_fijadas(listo)) == 3
+    assert cargar_rollup(info["path"], "filas") == {"filas": 3}
+
+def test_parquet_is_keyed_by_content(tmp_path):
+    primero = _fijar(tmp_path)
+    segundo = _fijar(tmp_path, CSV + "NORTE,2,2026-01-07,13:00,Tamal Pollo,1,25,N/A,VENTA REGULAR,4\n")
+
+    # Same file name, different upload: never the same Parquet
+    assert ruta_columnar(primero["path"], primero["content_hash"]) != ruta_columnar(segundo["path"], segundo["content_hash"])
+
+def test_not_ready_and_failed(tmp_path):
+    info = _fijar(tmp_path)
+    assert cargar_ventas_fijadas(info) is None
+
+    os.remove(info["path"])
+    preparar_archivo_fijado(info)  # default publicar updates pinned_info itself
+    assert info["clean_status"] == "failed" and info["clean_error"]
@@ -0,0 +1,46 @@
+import pandas as pd
+import pytest
+from services.analysis_cleaner import NORMALIZADO_A_PRODUCCION
+from services.production_cleaner import clave_producible
+from services.reconciliation_service import CLAVES_VENTA, SIN_PRODUCCION, conciliar_produccion_ventas
+
+@pytest.fixture
+def produccion():
+    # Shape of procesar_produccion's output
+    return pd.DataFrame({
+        'Fecha': pd.to_datetime(['2026-01-05', '2026-01-05', '2026-01-06', '2026-01-06']),
+        'Tipo_Tamal': ['Tradicional', 'Tradicional', 'Tradicional', 'Tradicional'],
+        'Guiso': ['POLLO', 'PCO', 'POLLO', 'RAJAS'],
+        'Cantidad': [5.0, 1.0, 2.0, 4.0],
+    })
+
+def test_sales_keys_are_producible():
+    # A sales key production never emits would show up as a permanent shortage
+    assert all(clave_producible(*clave) for clave in CLAVES_VENTA)
+    assert CLAVES_VENTA | set(SIN_PRODUCCION) == set(NORMALIZADO_A_PRODUCCION.values())
+
+def test_daily_reconciliation(produccion, ventas):
+    result = conciliar_produccion_ventas(produccion, ventas)
+    diario = result['diario'].set_index(['Fecha', 'Guiso'])
+
+    pollo = diario.loc[(pd.Timestamp('2026-01-05'), 'POLLO')]
+    assert (pollo['Producido'], pollo['Vendido'], pollo['Sobrante'], pollo['Pct_Vendido']) == (5.0, 2.0, 3.0, 40.0)
+    # Puerco sold in two sucursales; the package wrapper of 2026-01-06 adds no units
+    assert diario.loc[(pd.Timestamp('2026-01-05'), 'PCO'), 'Faltante'] == 1.0
+    assert diario.loc[(pd.Timestamp('2026-01-06'), 'POLLO'), 'Vendido'] == 3.0
+    # Produced but never sold under that key: not comparable
+    assert not diario.loc[(pd.Timestamp('2026-01-06'), 'RAJAS'), 'Comparable']
+
+def test_summary_uses_the_overlap_of_both_sources(produccion, ventas):
+    resumen = conciliar_produccion_ventas(produccion, ventas)['resumen']
+
+    # The 2026-01-12 sale is outside the production range
+    assert (resumen['start_date'], resumen['end_date']) == ('2026-01-05', '2026-01-06')
+    assert (resumen['producido'], resumen['vendido']) == (8.0, 7.0)
+    assert (resumen['sobrante'], resumen['faltante'], resumen['sin_venta_mapeada']) == (3.0, 2.0, 4.0)
+
+def test_weekly_reconciliation(produccion, ventas):
+    semanal = conciliar_produccion_ventas(produccion, ventas)['semanal'].set_index('Guiso')
+
+    assert semanal.loc['POLLO', 'Semana'] == pd.Timestamp('2026-01-05')
+    assert (semanal.loc['POLLO', 'Producido'], semanal.loc['POLLO', 'Vendido']) == (7.0, 5.0)
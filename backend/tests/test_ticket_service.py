@@ -0,0 +1,32 @@
+import services.ticket_service as ticket_service
+from services.ticket_service import compute_ticket_analytics
+
+def test_ticket_summary(ventas):
+    result = compute_ticket_analytics(ventas)
+
+    # (CENTRO, 1) and (NORTE, 1) are different tickets
+    assert result["tickets"] == 4
+    assert result["ticket_promedio"] == 87.5
+    assert result["ticket_mediana"] == 50.0
+    assert result["piezas_promedio"] == 2.0
+    por_sucursal = {r["Sucursal"]: r for r in result["por_sucursal"]}
+    assert por_sucursal["CENTRO"]["Tickets"] == 3
+    assert por_sucursal["NORTE"]["Ticket_Promedio"] == 25.0
+
+def test_ticket_co_occurrence(ventas, monkeypatch):
+    monkeypatch.setattr(ticket_service, "MIN_TICKETS_PAR", 1)
+    result = compute_ticket_analytics(ventas)
+
+    co = result["co_occurrence"]
+    # Package wrappers are not products of the matrix
+    assert co["products"] == ["Pollo (Tradicional)", "Puerco (Tradicional)"]
+    assert co["tickets"] == [[3, 1], [1, 2]]
+    [par] = result["top_pairs"]
+    assert (par["producto_a"], par["producto_b"], par["tickets"]) == ("Pollo (Tradicional)", "Puerco (Tradicional)", 1)
+    assert par["lift"] == round(1 * 4 / (3 * 2), 3)
+
+def test_ticket_pairs_below_minimum_are_dropped(ventas):
+    assert compute_ticket_analytics(ventas)["top_pairs"] == []
+
+def test_ticket_without_movimiento(ventas):
+    assert compute_ticket_analytics(ventas.drop(columns=["MovimientoPDV"])) is None
@@ -0,0 +1,151 @@
+import asyncio
+import base64
+import io
+import os
+import time
+import zipfile
+from datetime import date
+from urllib.parse import parse_qs
+import httpx
+import openpyxl
+import pandas as pd
+import pytest
+import services.wansoft_cache as wansoft_cache
+import services.wansoft_service as wansoft
+from services.wansoft_cache import (
+    cargar_indice, guardar_reporte, guardar_vacio, planear_descargas, fuentes_rango,
+    escribir_zip, leer_reporte, ruta_cache, sincronizar_reportes, _podar
+)
+
+def _reporte(sub_id, dias) -> bytes:
+    # Raw Wansoft layout: title rows, column header, detail rows, window total
+    libro = openpyxl.Workbook()
+    hoja = libro.active
+    hoja.append([f"Detalle de ventas {sub_id}"])
+    hoja.append(["Movimiento", "Fecha de operación", "Platillo", "Cantidad"])
+    for i, dia in enumerate(dias):
+        hoja.append([f"{sub_id}-{i}", dia, "Tamal Pollo", 1])
+    hoja.append(["TOTAL", None, None, len(dias)])
+    salida = io.BytesIO()
+    libro.save(salida)
+    return salida.getvalue()
+
+def _guardar(cache_dir, indice, sub_id, inicio, fin, bajado):
+    contenido = _reporte(sub_id, pd.date_range(inicio, fin).strftime("%Y-%m-%d").tolist())
+    return guardar_reporte(cache_dir, indice, sub_id, inicio, fin, io.BytesIO(contenido), bajado)
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return ruta_cache(str(tmp_path), "usuario")
+
+def test_plan_skips_closed_days_and_refreshes_open_ones(cache_dir):
+    indice = cargar_indice(cache_dir)
+    hoy = date(2026, 1, 10)
+    # 01-01..01-05 downloaded on 01-06: closed up to 01-04, 01-05 still open
+    _guardar(cache_dir, indice, 8447, "2026-01-01", "2026-01-05", date(2026, 1, 6))
+
+    tareas = planear_descargas(cache_dir, indice, [8447, 8448], "2026-01-01", "2026-01-12", hoy=hoy, max_dias=4)
+
+    assert tareas == [
+        (8447, "2026-01-05", "2026-01-08"), (8447, "2026-01-09", "2026-01-10"),
+        (8448, "2026-01-01", "2026-01-04"), (8448, "2026-01-05", "2026-01-08"), (8448, "2026-01-09", "2026-01-10"),
+    ]
+
+def test_missing_blob_is_downloaded_again(cache_dir):
+    indice = cargar_indice(cache_dir)
+    blob = _guardar(cache_dir, indice, 8447, "2026-01-01", "2026-01-02", date(2026, 1, 9))
+    os.remove(os.path.join(cache_dir, "blobs", f"{blob}.br"))
+
+    assert planear_descargas(cache_dir, indice, [8447], "2026-01-01", "2026-01-02", hoy=date(2026, 1, 10)) == [
+        (8447, "2026-01-01", "2026-01-02")
+    ]
+
+def test_empty_window_counts_as_cached(cache_dir):
+    indice = cargar_indice(cache_dir)
+    guardar_vacio(indice, 8447, "2026-01-01", "2026-01-03", date(2026, 1, 9))
+
+    assert planear_descargas(cache_dir, indice, [8447], "2026-01-01", "2026-01-03", hoy=date(2026, 1, 10)) == []
+    assert fuentes_rango(indice, [8447], "2026-01-01", "2026-01-03") == []
+
+def test_newest_report_wins_overlapping_days(cache_dir):
+    indice = cargar_indice(cache_dir)
+    viejo = _guardar(cache_dir, indice, 8447, "2026-01-01", "2026-01-03", date(2026, 1, 4))
+    nuevo = _guardar(cache_dir, indice, 8447, "2026-01-03", "2026-01-05", date(2026, 1, 9))
+
+    fuentes = fuentes_rango(indice, [8447], "2026-01-02", "2026-01-04")
+
+    assert fuentes == [
+        ("Reporte_8447_2026-01-01_2026-01-03.xlsx", viejo, {"2026-01-02"}),
+        ("Reporte_8447_2026-01-03_2026-01-05.xlsx", nuevo, {"2026-01-03", "2026-01-04"}),
+    ]
+
+def test_zip_has_exactly_the_requested_days(tmp_path, cache_dir):
+    indice = cargar_indice(cache_dir)
+    _guardar(cache_dir, indice, 8447, "2026-01-01", "2026-01-03", date(2026, 1, 4))
+    nuevo = _guardar(cache_dir, indice, 8447, "2026-01-03", "2026-01-05", date(2026, 1, 9))
+    destino = io.BytesIO()
+
+    escribir_zip("usuario", fuentes_rango(indice, [8447], "2026-01-02", "2026-01-04"), destino,
+                 "2026-01-02", "2026-01-04", cache_dir=str(tmp_path))
+
+    with zipfile.ZipFile(destino) as zf:
+        assert zf.namelist() == ["Reporte_8447_2026-01-02_2026-01-04.xlsx"]
+        detalle = pd.read_excel(io.BytesIO(zf.read(zf.namelist()[0])), skiprows=1)
+    # One row per day, each from its newest report, and no window total
+    assert pd.to_datetime(detalle["Fecha de operación"]).dt.strftime("%Y-%m-%d").tolist() == ["2026-01-02", "2026-01-03", "2026-01-04"]
+    assert detalle["Movimiento"].tolist() == ["8447-1", "8447-0", "8447-1"]
+
+    # A single report whose days are all used is copied as is
+    destino = io.BytesIO()
+    escribir_zip("usuario", fuentes_rango(indice, [8447], "2026-01-03", "2026-01-05"), destino,
+                 "2026-01-03", "2026-01-05", cache_dir=str(tmp_path))
+    with zipfile.ZipFile(destino) as zf:
+        assert zf.read("Reporte_8447_2026-01-03_2026-01-05.xlsx") == leer_reporte(cache_dir, nuevo)
+
+def test_prune_waits_for_the_grace_period(cache_dir):
+    indice = cargar_indice(cache_dir)
+    viejo = _guardar(cache_dir, indice, 8447, "2026-01-01", "2026-01-02", date(2026, 1, 3))
+    _guardar(cache_dir, indice, 8447, "2026-01-01", "2026-01-03", date(2026, 1, 9))
+
+    _podar(cache_dir, indice)
+    # Superseded, but a running job may still read it
+    assert viejo in indice["blobs"] and "sin_uso" in indice["blobs"][viejo]
+
+    indice["blobs"][viejo]["sin_uso"] = time.time() - wansoft_cache.PODA_GRACIA - 1
+    _podar(cache_dir, indice)
+    assert viejo not in indice["blobs"]
+
+def test_sync_downloads_once_and_remembers_empty_windows(tmp_path, monkeypatch):
+    pedidos = []
+
+    def handler(request):
+        sub_id = parse_qs(request.content.decode())["subsidiaryId"][0]
+        pedidos.append(sub_id)
+        if sub_id == "8448":
+            return httpx.Response(200, json={"Success": True})  # no sales that week
+        contenido = base64.b64encode(_reporte(8447, ["2026-01-05"])).decode()
+        return httpx.Response(200, json={"fileBase64": contenido})
+
+    monkeypatch.setattr(wansoft_cache, "subsidiarias", lambda: [8447, 8448])
+    monkeypatch.setattr(wansoft, "cliente_http", lambda cookies, max_concurrency=None: httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(wansoft, "_circuitos", {})
+    llegadas = []
+
+    def sincronizar():
+        return asyncio.run(sincronizar_reportes(
+            [], "usuario", "2026-01-05", "2026-01-07", cache_dir=str(tmp_path), mode="http", rate_limit=0,
+            al_llegar=lambda blob, filename, leer: llegadas.append(filename)
+        ))
+
+    fuentes, resumen = sincronizar()
+    assert sorted(pedidos) == ["8447", "8448"]
+    assert (resumen["reportes_bajados"], resumen["reportes_vacios"], resumen["reportes_fallidos"]) == (1, 1, 0)
+    assert [f[0] for f in fuentes] == llegadas == ["Reporte_8447_2026-01-05_2026-01-07.xlsx"]
+
+    pedidos.clear()
+    llegadas.clear()
+    fuentes, resumen = sincronizar()
+    # Closed days, including the empty window, come from the cache
+    assert pedidos == []
+    assert resumen["dias_desde_cache"] == 6
+    assert llegadas == ["Reporte_8447_2026-01-05_2026-01-07.xlsx"]
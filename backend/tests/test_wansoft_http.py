@@ -0,0 +1,124 @@
+import asyncio
+import base64
+from urllib.parse import parse_qs
+import httpx
+import pytest
+import services.wansoft_service as wansoft
+from services.wansoft_service import (
+    DecodificadorReporte, ErrorReporte, SesionExpirada, _descargar_subsidiaria_http, descargar_ventanas
+)
+
+REPORTE = bytes(range(256)) * 40  # stands in for the xlsx bytes
+
+def _json_reporte(clave="fileBase64", contenido=REPORTE):
+    # ASP.NET escapes "/" inside JSON strings
+    b64 = base64.b64encode(contenido).decode().replace("/", "\\/")
+    return f'{{"Success":true,"{clave}":"{b64}","FileName":"x.xlsx"}}'.encode()
+
+def _cliente(handler):
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+@pytest.fixture(autouse=True)
+def _red_rapida(monkeypatch):
+    # Fresh circuit per test, near-zero backoff
+    monkeypatch.setattr(wansoft, "_circuitos", {})
+    monkeypatch.setattr(wansoft, "BACKOFF_BASE", 0.01)
+
+@pytest.mark.parametrize("bloque", [1, 7, 4096])
+@pytest.mark.parametrize("clave", ["fileBase64", "FileContents", "Data"])
+def test_decoder_in_any_chunk_size(bloque, clave):
+    cuerpo = _json_reporte(clave)
+    decodificador = DecodificadorReporte()
+    for i in range(0, len(cuerpo), bloque):
+        decodificador.procesar(cuerpo[i:i + bloque])
+
+    assert decodificador.terminar()
+    assert decodificador.archivo.read() == REPORTE
+    assert decodificador.bytes == len(REPORTE)
+
+def test_decoder_without_report():
+    decodificador = DecodificadorReporte()
+    decodificador.procesar(b'{"Success":false,"Message":"sin datos"}')
+
+    assert not decodificador.terminar()
+    assert decodificador.claves() == ["Success", "Message"]
+
+def test_http_download_posts_the_window():
+    pedidos = []
+
+    def handler(request):
+        pedidos.append(parse_qs(request.content.decode()))
+        return httpx.Response(200, content=_json_reporte())
+
+    async def bajar():
+        async with _cliente(handler) as client:
+            return await _descargar_subsidiaria_http(client, 8447, "2026-01-01", "2026-01-07")
+
+    filename, archivo = asyncio.run(bajar())
+
+    assert filename == "Reporte_8447_2026-01-01_2026-01-07.xlsx"
+    assert archivo.read() == REPORTE
+    assert pedidos == [{"subsidiaryId": ["8447"], "startDate": ["2026-01-01"], "endDate": ["2026-01-07"]}]
+
+@pytest.mark.parametrize("respuesta, error, reintentable, espera", [
+    (httpx.Response(503), ErrorReporte, True, None),
+    (httpx.Response(429, headers={"Retry-After": "2"}), ErrorReporte, True, 2.0),
+    (httpx.Response(400), ErrorReporte, False, None),
+    (httpx.Response(401), SesionExpirada, None, None),
+    (httpx.Response(302, headers={"Location": "/Wansoft.Web/Account/Login"}), SesionExpirada, None, None),
+])
+def test_http_errors(respuesta, error, reintentable, espera):
+    async def bajar():
+        async with _cliente(lambda request: respuesta) as client:
+            return await _descargar_subsidiaria_http(client, 8447, "2026-01-01", "2026-01-01")
+
+    with pytest.raises(error) as info:
+        asyncio.run(bajar())
+    if error is ErrorReporte:
+        assert (info.value.reintentable, info.value.espera) == (reintentable, espera)
+
+def _descargar(monkeypatch, handler, tareas, **kwargs):
+    monkeypatch.setattr(wansoft, "cliente_http", lambda cookies, max_concurrency=None: _cliente(handler))
+    return asyncio.run(descargar_ventanas([], tareas, rate_limit=0, mode="http", **kwargs))
+
+def test_transient_errors_are_retried(monkeypatch):
+    respuestas = {
+        "8447": [httpx.Response(503), httpx.Response(429, headers={"Retry-After": "0"})],
+        "8448": [httpx.Response(400)],
+    }
+
+    def handler(request):
+        sub_id = parse_qs(request.content.decode())["subsidiaryId"][0]
+        pendientes = respuestas.get(sub_id)
+        return pendientes.pop(0) if pendientes else httpx.Response(200, content=_json_reporte())
+
+    metricas = []
+    tareas = [(8447, "2026-01-01", "2026-01-01"), (8448, "2026-01-01", "2026-01-01")]
+    descargados = _descargar(monkeypatch, handler, tareas, metricas=metricas)
+
+    assert list(descargados) == [tareas[0]]
+    assert descargados[tareas[0]][1].read() == REPORTE
+    por_sub = {m["sucursal"]: m for m in metricas}
+    assert (por_sub[8447]["estado"], por_sub[8447]["intentos"]) == ("ok", 3)
+    # Client errors are not retried
+    assert (por_sub[8448]["estado"], por_sub[8448]["intentos"]) == ("fallido", 1)
+
+def test_retries_give_up(monkeypatch):
+    monkeypatch.setattr(wansoft, "MAX_RETRIES", 2)
+    metricas = []
+    descargados = _descargar(monkeypatch, lambda request: httpx.Response(500), [(8447, "2026-01-01", "2026-01-01")], metricas=metricas)
+
+    assert descargados == {}
+    assert (metricas[0]["estado"], metricas[0]["intentos"]) == ("fallido", 3)
+
+def test_rejected_session_keeps_what_arrived(monkeypatch):
+    def handler(request):
+        if parse_qs(request.content.decode())["subsidiaryId"] == ["8448"]:
+            return httpx.Response(403)
+        return httpx.Response(200, content=_json_reporte())
+
+    tareas = [(8447, "2026-01-01", "2026-01-01"), (8448, "2026-01-01", "2026-01-01")]
+    with pytest.raises(SesionExpirada) as info:
+        _descargar(monkeypatch, handler, tareas)
+
+    assert list(info.value.descargados) == [tareas[0]]
@@ -0,0 +1,141 @@
+"""
+Servidor local que imita a Wansoft para probar el descargador sin tocar produccion:
+login form (sets the session cookie) and ExportSalesDetailReport (base64 JSON, like the real one).
+
+Usage: python wansoft_stub_server.py [--port 8765] [--delay 0.5] [--slow 8455:3] [--fail-rate 0.1]
+                                     [--fail-sub 8452] [--retry-after 2]
+                                     [--size-kb 200] [--reports-dir DIR] [--session-ttl 1200]
+Then run the API with WANSOFT_BASE_URL=http://127.0.0.1:8765 (user / password: any non-empty).
+--reports-dir serves DIR/Reporte_<subsidiaryId>.xlsx when present, else random bytes of --size-kb
+(seeded by subsidiary and dates).
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import secrets
+import threading
+import time
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+SESSION_COOKIE = ".ASPXAUTH"
+LOGIN_PAGE = b"""<html><body><form method="post" action="/Wansoft.Web/Account/Login">
+<input id="UserName" name="UserName"><input id="Password" name="Password" type="password">
+<input type="submit" value="Entrar"></form></body></html>"""
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Keep-alive, as IIS does (the client pool reuses connections)
+    protocol_version = "HTTP/1.1"
+    sesiones = {}  # token -> created at
+    stats = {"reportes": 0, "fallas": 0}
+    lock = threading.Lock()
+    args = None
+
+    def log_message(self, fmt, *a):
+        if self.args.verbose:
+            super().log_message(fmt, *a)
+
+    def _enviar(self, status, body: bytes, content_type="text/html", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _form(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+
+    def _sesion_valida(self) -> bool:
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        if SESSION_COOKIE not in cookie:
+            return False
+        creada = self.sesiones.get(cookie[SESSION_COOKIE].value)
+        return creada is not None and time.time() - creada < self.args.session_ttl
+
+    def do_GET(self):
+        if self.path.startswith("/Wansoft.Web/Account/Login"):
+            return self._enviar(200, LOGIN_PAGE)
+        if self.path.startswith("/Wansoft.Web"):
+            # Like the real site: the app pages redirect to the login without a valid session
+            if not self._sesion_valida():
+                return self._enviar(302, b"", headers={"Location": "/Wansoft.Web/Account/Login?ReturnUrl=%2FWansoft.Web%2F"})
+            if self.path.rstrip("/") == "/Wansoft.Web":
+                return self._enviar(302, b"", headers={"Location": "/Wansoft.Web/Home"})
+            return self._enviar(200, b"<html><body>Inicio</body></html>")
+        self._enviar(404, b"not found")
+
+    def do_POST(self):
+        if self.path.startswith("/Wansoft.Web/Account/Login"):
+            form = self._form()
+            if not form.get("UserName") or not form.get("Password"):
+                return self._enviar(200, LOGIN_PAGE.replace(b"<form", b'<div class="validation-summary-errors">Usuario invalido</div><form'))
+            token = secrets.token_hex(16)
+            self.sesiones[token] = time.time()
+            return self._enviar(302, b"", headers={
+                "Location": "/Wansoft.Web/Home",
+                "Set-Cookie": f"{SESSION_COOKIE}={token}; Path=/; HttpOnly"
+            })
+
+        if self.path.startswith("/Wansoft.Web/Reports/ExportSalesDetailReport"):
+            form = self._form()
+            if not self._sesion_valida():
+                # AJAX requests get 401 instead of the login redirect
+                return self._enviar(401, b"Unauthorized")
+            sub_id = form.get("subsidiaryId", "")
+            time.sleep(self.args.lentos.get(sub_id, self.args.delay))
+            with self.lock:
+                self.stats["reportes"] += 1
+                falla = sub_id in self.args.fail_sub or random.random() < self.args.fail_rate
+                if falla:
+                    self.stats["fallas"] += 1
+            if falla:
+                reintentar = {"Retry-After": str(self.args.retry_after)} if self.args.retry_after else None
+                return self._enviar(503, b"Service Unavailable", headers=reintentar)
+            contenido = self._reporte(sub_id, form.get("startDate", ""), form.get("endDate", ""))
+            body = json.dumps({"fileBase64": base64.b64encode(contenido).decode()}).encode()
+            return self._enviar(200, body, "application/json")
+
+        self._enviar(404, b"not found")
+
+    def _reporte(self, sub_id: str, start: str, end: str) -> bytes:
+        if self.args.reports_dir:
+            path = os.path.join(self.args.reports_dir, f"Reporte_{sub_id}.xlsx")
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    return f.read()
+        # Same window, same bytes (like a closed period on the real site)
+        return random.Random(f"{sub_id}|{start}|{end}").randbytes(self.args.size_kb * 1024)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0.5, help="seconds per report")
+    parser.add_argument("--slow", action="append", default=[], help="subsidiaryId:seconds, repeatable")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of reports answered with 503")
+    parser.add_argument("--fail-sub", action="append", default=[], help="subsidiaryId that always gets 503, repeatable")
+    parser.add_argument("--retry-after", type=int, default=0, help="Retry-After seconds sent with the 503s")
+    parser.add_argument("--size-kb", type=int, default=200)
+    parser.add_argument("--reports-dir")
+    parser.add_argument("--session-ttl", type=float, default=1200, help="seconds a login stays valid")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    args.lentos = {s.split(":")[0]: float(s.split(":")[1]) for s in args.slow}
+    StubHandler.args = args
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), StubHandler)
+    print(f"Wansoft stub on http://127.0.0.1:{args.port} (WANSOFT_BASE_URL)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Reports served: {StubHandler.stats}")
+
+if __name__ == "__main__":
+    main()
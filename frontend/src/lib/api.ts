@@ -29,3 +29,29 @@ api.interceptors.response.use(
 );
 
 export default api;
+
+// Conditional POST for heavy JSON endpoints (breakdown, pinned analysis):
+// remembers the last ETag per key and reuses the cached body on 304.
+const etagCache = new Map<string, { etag: string; data: unknown }>();
+
+export async function postConditional<T = unknown>(
+  url: string,
+  formData: FormData,
+  cacheKey: string,
+  config: Parameters<typeof api.post>[2] = {}
+): Promise<T> {
+  const cached = etagCache.get(cacheKey);
+  const response = await api.post(url, formData, {
+    ...config,
+    headers: { ...(config.headers || {}), ...(cached ? { 'If-None-Match': cached.etag } : {}) },
+    validateStatus: (status) => (status >= 200 && status < 300) || status === 304,
+  });
+  if (response.status === 304 && cached) {
+    return cached.data as T;
+  }
+  const etag = response.headers['etag'];
+  if (etag) {
+    etagCache.set(cacheKey, { etag, data: response.data });
+  }
+  return response.data as T;
+}
@@ -176,7 +176,7 @@ export default function Analysis() {
                         <p className="mb-1 text-sm text-gray-500"><span className="font-semibold">Click para subir reporte</span></p>
                         <p className="text-xs text-gray-500">.xlsx, .csv (Soporta múltiples)</p>
                     </div>
-                    <input type="file" className="hidden" onChange={handleFileChange} multiple accept=".csv, .xlsx" />
+                    <input type="file" className="hidden" onChange={handleFileChange} multiple accept=".csv, .xlsx, .parquet, .arrow" />
                 </label>
             </div>
             {files.length > 0 && <p className="mt-2 text-sm text-green-600">{files.length} archivo(s) seleccionado(s)</p>}
@@ -1,7 +1,7 @@
 
 import { useState, useEffect } from 'react';
 import { Upload, Filter, Table, Pin, Download } from 'lucide-react';
-import api from '../../lib/api';
+import api, { postConditional } from '../../lib/api';
 import { Button } from '../../components/ui/Button';
 import LoadingModal from '../../components/ui/LoadingModal';
 
@@ -69,8 +69,13 @@ export default function Breakdown() {
     if (selectedProduct.length > 0) formData.append('product_filter', selectedProduct.join(','));
     formData.append('view_mode', viewMode);
 
+    // Same files + filters -> the server answers 304 and the last result is reused
+    const cacheKey = 'breakdown:' + Array.from(formData.entries())
+      .map(([k, v]) => `${k}=${v instanceof File ? `${v.name}:${v.size}:${v.lastModified}` : v}`)
+      .join('&');
+
     try {
-      const response = await api.post('/tools/breakdown', formData, {
+      const result = await postConditional('/tools/breakdown', formData, cacheKey, {
         onUploadProgress: (progressEvent) => {
             if (progressEvent.total) {
                 const percent = Math.round((progressEvent.loaded * 100) / progressEvent.total);
@@ -81,7 +86,7 @@ export default function Breakdown() {
             }
         }
       });
-      setData(response.data);
+      setData(result);
     } catch (err: unknown) {
       console.error(err);
       const error = err as { response?: { data?: { detail?: string } } };
@@ -214,7 +219,7 @@ export default function Breakdown() {
                             <p className="mb-1 text-sm text-gray-500"><span className="font-semibold">Click para subir reporte</span></p>
                             <p className="text-xs text-gray-500">.xlsx, .csv</p>
                         </div>
-                        <input type="file" className="hidden" onChange={handleFileChange} multiple accept=".csv, .xlsx" />
+                        <input type="file" className="hidden" onChange={handleFileChange} multiple accept=".csv, .xlsx, .parquet, .arrow" />
                     </label>
                     {files.length > 0 && <p className="mt-2 text-sm text-green-600">{files.length} archivo(s) seleccionado(s)</p>}
                 </div>
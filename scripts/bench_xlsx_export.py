@@ -0,0 +1,78 @@
+"""
+Benchmark del export xlsx: pandas+openpyxl en BytesIO (ruta anterior) vs
+xlsxwriter constant_memory en SpooledTemporaryFile (services.export_service).
+
+Each engine runs in a fresh process so peak RSS is not shared between runs.
+Usage: python scripts/bench_xlsx_export.py [rows ...]   (default: 20000 100000)
+"""
+import io
+import multiprocessing as mp
+import os
+import resource
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+# Runs from the repo root, outside the app: import the backend services from there
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+SUCURSALES = ["CENTRO", "NORTE", "SUR", "PLAZA", "AEROPUERTO", "MERCADO"]
+PRODUCTOS = ["Tamal Verde", "Tamal Mole", "Tamal Rajas", "Tamal Dulce", "Paquete Docena", "Atole Champurrado"]
+
+def generar_ventas(rows: int) -> pd.DataFrame:
+    # Same shape as "Ventas limpias"
+    rng = np.random.default_rng(0)
+    fechas = pd.Timestamp("2026-01-01") + pd.to_timedelta(rng.integers(0, 365, rows), unit="D")
+    return pd.DataFrame({
+        "Fecha": fechas.strftime("%Y-%m-%d"),
+        "Sucursal": rng.choice(SUCURSALES, rows),
+        "MovimientoPDV": rng.integers(100000, 999999, rows).astype(str),
+        "Hora_Venta": [f"{h:02d}:{m:02d}" for h, m in zip(rng.integers(7, 22, rows), rng.integers(0, 60, rows))],
+        "Producto_Final": rng.choice(PRODUCTOS, rows),
+        "Cantidad": rng.integers(1, 12, rows).astype(float),
+        "Total_Venta": np.round(rng.uniform(20, 600, rows), 2),
+        "Paquete_Origen": np.where(rng.random(rows) < 0.2, "Paquete Docena", None),
+        "Tipo_Oferta": rng.choice(["Normal", "Promocion"], rows),
+        "Hash": [f"{x:016x}" for x in rng.integers(0, 2**62, rows)],
+    })
+
+def _ruta_openpyxl(df):
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine="openpyxl") as writer:
+        df.to_excel(writer, index=False)
+    output.seek(0)
+    return len(output.getvalue())
+
+def _ruta_constant_memory(df):
+    from services.export_service import xlsx_spooled, iter_archivo
+    spool = xlsx_spooled({"Sheet1": df})
+    return sum(len(chunk) for chunk in iter_archivo(spool))
+
+MOTORES = {"openpyxl (BytesIO)": _ruta_openpyxl, "xlsxwriter constant_memory": _ruta_constant_memory}
+
+def _medir(nombre, rows, queue):
+    df = generar_ventas(rows)
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    size = MOTORES[nombre](df)
+    elapsed = time.perf_counter() - t0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux; delta = memory added by the export itself
+    queue.put((elapsed, (peak - base) / 1024, size / 1024 / 1024))
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [20000, 100000]
+    ctx = mp.get_context("spawn")
+    print(f"{'rows':>8}  {'engine':<28}{'time s':>9}{'+RSS MiB':>10}{'file MiB':>10}")
+    for rows in sizes:
+        for nombre in MOTORES:
+            queue = ctx.Queue()
+            proc = ctx.Process(target=_medir, args=(nombre, rows, queue))
+            proc.start()
+            elapsed, rss, size = queue.get()
+            proc.join()
+            print(f"{rows:>8}  {nombre:<28}{elapsed:>9.2f}{rss:>10.1f}{size:>10.2f}")
+
+if __name__ == "__main__":
+    main()